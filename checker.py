@@ -13,12 +13,104 @@ The rules are the following:
 
 """
 
-from typing import List, Tuple
+import os
+from enum import Enum
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Tuple, Iterator, Optional, Dict, Set, NamedTuple, Union
 from pathlib import Path
 from log import *
+import metrics
 
 logger = log_logger('filechecker')
 
+FOLDERS_WALKED = metrics.counter('checker_folders_walked_total', 'Folders of src found by the walk.')
+SRC_LISTINGS = metrics.counter('checker_src_listings_total', 'Folders of src listed with os.scandir.')
+DEST_LOOKUPS = metrics.counter('checker_dest_lookups_total', 'Folders looked up in dest.')
+DEST_STATS = metrics.counter('checker_dest_stat_calls_total', 'Folders of dest checked with a stat.')
+DEST_LISTINGS = metrics.counter('checker_dest_listings_total', 'Folders of dest listed by the DestinationIndex.')
+CHECK_SECONDS = metrics.histogram('checker_check_seconds', 'Duration of check_folders.')
+PROBLEMATIC = metrics.gauge('checker_problematic_folders', 'Problematic folders found by the last check.')
+
+
+class DestinationIndex:
+    """
+    In-memory index of the folders of the dest directory. Instead of checking every folder with its own stat, the
+    parent of the folder gets listed once with os.scandir and the names of its subfolders are kept in a set, so every
+    later lookup of a sibling is a set lookup. Folders are keyed by their parts relative to the root. If the parent of
+    a folder does not exist, the folder is known to be missing without touching the destination at all.
+
+    :param root: The path of the dest directory.
+    """
+    def __init__(self, root: Path):
+        self.root = root
+        # Relative parts of a listed folder -> normcased names of its subfolders. None if the folder does not exist.
+        self._listings: Dict[Tuple[str, ...], Optional[Set[str]]] = {}
+        # Number of folders listed with os.scandir.
+        self.scandir_calls = 0
+
+    def listing(self, rel: Tuple[str, ...]) -> Optional[Set[str]]:
+        """
+        Gets the names of the subfolders of a folder, listing it if it is the first time it is requested.
+
+        :param rel: The parts of the folder relative to the root.
+        :return: A set with the normcased names of the subfolders, None if the folder does not exist.
+        """
+        try:
+            return self._listings[rel]
+        except KeyError:
+            pass
+
+        if rel and not self.has_folder(rel):
+            names = None
+        else:
+            self.scandir_calls += 1
+            try:
+                with os.scandir(self.root.joinpath(*rel)) as entries:
+                    names = {os.path.normcase(entry.name) for entry in entries if entry.is_dir()}
+            except (FileNotFoundError, NotADirectoryError):
+                names = None
+        self._listings[rel] = names
+        return names
+
+    def has_folder(self, rel: Tuple[str, ...]) -> bool:
+        """
+        Checks if a folder exists in the destination.
+
+        :param rel: The parts of the folder relative to the root.
+        :return: True if the folder exists, False otherwise.
+        """
+        if not rel:
+            return self.root.is_dir()
+        names = self.listing(rel[:-1])
+        return names is not None and os.path.normcase(rel[-1]) in names
+
+
+class FindingKind(Enum):
+    """
+    The kinds of findings of the StructureChecker. Each one corresponds to one of its lists.
+    """
+    #: A folder missing in dest. Goes in problematic_folders.
+    PROBLEMATIC = 'problematic'
+    #: A folder present in dest. Goes in target_founds.
+    TARGET_FOUND = 'target_found'
+    #: A data folder. Goes in data_folders.
+    DATA_FOLDER = 'data_folder'
+    #: A data folder missing in dest that should be created. Goes in create_data_folders.
+    CREATE_DATA_FOLDER = 'create_data_folder'
+    #: A folder inside a data folder. Goes in skipped_folders.
+    SKIPPED = 'skipped'
+
+
+class Finding(NamedTuple):
+    """
+    A single finding of the StructureChecker.
+    """
+    kind: FindingKind
+    #: The folder in src.
+    src: Path
+    #: The equivalent folder in dest. For skipped folders, the data folder that contains the folder instead.
+    dest: Path
+
 
 class StructureChecker:
     """
@@ -26,23 +118,56 @@ class StructureChecker:
 
     :param src: The path of the source directory.
     :param dest: The path of the destination directory.
+    :param track_skipped: If True (the default), the folders inside data folders are still listed so that they end up
+        in skipped_folders. If False, the walk does not descend into data folders at all and skipped_folders stays
+        empty.
+    :param index_dest: If True, instead of checking every folder in dest with its own stat, dest folders are listed
+        once into a DestinationIndex and looked up from there. Meant for slow network mounts.
+    :param scan: If True (the default), the check runs on construction and the findings get collected in the lists
+        of the checker. If False nothing is done until iter_findings or check_folders is called. Scanning stays the
+        default because the lists are what every existing caller reads, DataFolderCopier, DataFolderPacker and
+        build_plan included when they get no stream of findings: an unscanned checker would make them silently work
+        on empty lists. Code using iter_findings should pass scan=False.
+    :param profile: Optional path of a file where check_folders dumps the cProfile stats of its run.
+    :param workers: Number of workers the walk is split across. With more than 1, the folders of the first
+        split_depth levels of src are walked by the checker itself and the subtree of every folder below them is
+        checked by a worker. The findings come out in the same order as with a single worker.
+    :param split_depth: Number of levels of src walked before splitting the walk into subtrees.
+    :param executor: 'thread' (the default) or 'process'. Threads are enough when the walk is dominated by the
+        latency of the file system. Processes also parallelize the Python side of the walk, but the log messages and
+        metrics of the workers stay in the worker processes.
     """
-    def __init__(self, src: Path, dest: Path):
+    def __init__(self, src: Path, dest: Path, track_skipped: bool = True, index_dest: bool = False,
+                 scan: bool = True, profile: Optional[Path] = None, workers: int = 1, split_depth: int = 1,
+                 executor: str = 'thread'):
         self.src = src
         self.src_len = len(src.parts)
         self.dest = dest
         self.dest_len = len(dest.parts)
 
         self.valid_names = ['measurement', 'simulation']
+        self.track_skipped = track_skipped
+        self.index_dest = index_dest
+        self.dest_index: Optional[DestinationIndex] = None
+        self.profile = profile
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown executor: {executor}')
+        self.workers = workers
+        self.split_depth = split_depth
+        self.executor = executor
+        # Number of folders looked up in dest by the current walk.
+        self.dest_lookups = 0
+        self._debug = logger.isEnabledFor(logging.DEBUG)
 
         self.problematic_folders: List[Tuple[Path, Path]] = []
         self.data_folders: List[Path] = []
         self.create_data_folders: List[Tuple[Path, Path]] = []
         self.target_founds: List[Tuple[Path, Path]] = []
         self.skipped_folders: List[Path] = []
-        logger.info(f'starting folder check')
-        self.check_folders()
-        logger.info(f'folder check complete')
+        if scan:
+            logger.info(f'starting folder check')
+            self.check_folders()
+            logger.info(f'folder check complete')
 
     def reset_internal_variables(self) -> None:
         """
@@ -61,44 +186,245 @@ class StructureChecker:
         :param path: The src you want to convert to dest path.
         :return: The converted dest path.
         """
-        path_parts = path.parts[self.src_len:]
-        target_path = self.dest
-        for part in path_parts:
-            target_path = target_path.joinpath(part)
-        return target_path
+        return self.dest.joinpath(*path.parts[self.src_len:])
+
+    def dest_has_folder(self, rel: Tuple[str, ...], target_path: Path) -> bool:
+        """
+        Checks if the equivalent of a src folder exists in dest, either with the destination index or with a stat.
+
+        :param rel: The parts of the folder relative to src (and dest).
+        :param target_path: The dest path of the folder.
+        :return: True if the folder exists in dest.
+        """
+        self.dest_lookups += 1
+        if self.dest_index is not None:
+            return self.dest_index.has_folder(rel)
+        return target_path.is_dir()
+
+    def walk_folders(self, root: Optional[Path] = None, root_data_folder: Optional[Path] = None) \
+            -> Iterator[Tuple[Path, Tuple[str, ...], Optional[Path]]]:
+        """
+        Walks every folder inside src (or inside root) using os.scandir. Folders are yielded in the same order as
+        src.glob('**/*'): first all the children of a folder, then the subtree of each child in turn. Files are
+        discarded without any stat call and symlinks to folders are yielded but not followed.
+
+        The data folder enclosing the current folder is carried down the walk, so finding it costs nothing instead of
+        a scan over all data folders found so far. If track_skipped is False the walk stops descending at data folders.
+
+        :param root: Optional folder inside src to walk instead of the whole src. root itself is not yielded.
+        :param root_data_folder: The data folder that contains root, if any.
+        :return: A generator of tuples with the folder, its parts relative to src and the data folder that contains it
+            (None if it is not inside a data folder).
+        """
+        if root is None:
+            root = self.src
+        stack: List[Tuple[Path, Tuple[str, ...], Optional[Path]]] = [(root, root.parts[self.src_len:],
+                                                                      root_data_folder)]
+        listings = walked = 0
+        try:
+            while stack:
+                folder, folder_rel, data_folder = stack.pop()
+                listings += 1
+                subfolders = self._list_subfolders(folder, folder_rel, data_folder)
+                if subfolders is None:
+                    continue
+
+                walked += len(subfolders)
+                to_visit = []
+                for item, rel, enclosing, descend in subfolders:
+                    yield item, rel, data_folder
+                    if descend:
+                        to_visit.append((item, rel, enclosing))
+                stack.extend(reversed(to_visit))
+        finally:
+            SRC_LISTINGS.inc(listings)
+            FOLDERS_WALKED.inc(walked)
+
+    def _list_subfolders(self, folder: Path, folder_rel: Tuple[str, ...], data_folder: Optional[Path]) \
+            -> Optional[List[Tuple[Path, Tuple[str, ...], Optional[Path], bool]]]:
+        """
+        Lists the subfolders of a folder of the walk. Shared by walk_folders and _split, so that the sequential and the
+        parallel walks follow the same rules.
+
+        :param folder: The folder to list.
+        :param folder_rel: Its parts relative to src.
+        :param data_folder: The data folder that contains it, if any.
+        :return: A list of tuples with every subfolder, its parts relative to src, the data folder that contains its
+            children and whether the walk descends into it. None if the folder could not be read.
+        """
+        try:
+            with os.scandir(folder) as entries:
+                children = [(entry.name, entry.is_symlink()) for entry in entries if entry.is_dir()]
+        except PermissionError as e:
+            logger.warning(f'{folder} could not be read: {e}')
+            return None
+
+        subfolders = []
+        for name, is_symlink in children:
+            item = folder / name
+            if data_folder is not None:
+                enclosing = data_folder
+            elif name in self.valid_names:
+                enclosing = item
+            else:
+                enclosing = None
+            descend = not is_symlink and (enclosing is None or self.track_skipped)
+            subfolders.append((item, folder_rel + (name,), enclosing, descend))
+        return subfolders
+
+    def iter_findings(self, root: Optional[Path] = None, root_data_folder: Optional[Path] = None) \
+            -> Iterator[Finding]:
+        """
+        Runs the folder check lazily, yielding every finding as soon as it is discovered. Nothing is stored in the
+        lists of the checker. A data folder that is missing in dest yields a CREATE_DATA_FOLDER finding right before
+        its DATA_FOLDER one, so a consumer can create it before acting on its contents.
+
+        :param root: Optional folder inside src to check instead of the whole src. root itself is not checked.
+        :param root_data_folder: The data folder that contains root, if any.
+        :return: A generator of findings.
+        """
+        self.dest_index = DestinationIndex(self.dest) if self.index_dest else None
+        self.dest_lookups = 0
+        # Checked once per walk, so that the per folder debug messages cost nothing when they are not logged.
+        self._debug = logger.isEnabledFor(logging.DEBUG)
+
+        try:
+            if self.workers > 1:
+                yield from self._iter_parallel_findings(root, root_data_folder)
+            else:
+                for item, rel, data_folder in self.walk_folders(root, root_data_folder):
+                    yield from self.classify(item, rel, data_folder)
+        finally:
+            DEST_LOOKUPS.inc(self.dest_lookups)
+            if self.dest_index is not None:
+                DEST_LISTINGS.inc(self.dest_index.scandir_calls)
+            else:
+                DEST_STATS.inc(self.dest_lookups)
+
+    def _iter_parallel_findings(self, root: Optional[Path], root_data_folder: Optional[Path]) -> Iterator[Finding]:
+        """
+        The parallel version of the walk of iter_findings. The first split_depth levels are walked and classified
+        here, submitting the subtree of every folder below them to the pool as soon as it is found. The findings of
+        the subtrees are then yielded in order, each one when its worker is done with it.
+        """
+        if root is None:
+            root = self.src
+        pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        with pool_class(self.workers) as pool:
+            segments: List[Union[Finding, 'Future[List[Finding]]']] = []
+            self._split(pool, root, root.parts[self.src_len:], root_data_folder, self.split_depth, segments)
+            try:
+                for segment in segments:
+                    if isinstance(segment, Finding):
+                        yield segment
+                    else:
+                        yield from segment.result()
+            finally:
+                for segment in segments:
+                    if isinstance(segment, Future):
+                        segment.cancel()
+
+    def _split(self, pool: Executor, folder: Path, folder_rel: Tuple[str, ...], data_folder: Optional[Path],
+               depth: int, segments: List[Union[Finding, 'Future[List[Finding]]']]) -> None:
+        """
+        Lists and classifies the subfolders of folder, adding their findings to segments. Then, in order, the subtree
+        of every subfolder gets split further (if depth is above 1) or submitted to the pool, and its future added to
+        segments. Follows the same rules as walk_folders about which subfolders are descended into.
+        """
+        subfolders = self._list_subfolders(folder, folder_rel, data_folder)
+        if subfolders is None:
+            return
+        SRC_LISTINGS.inc()
+        FOLDERS_WALKED.inc(len(subfolders))
+
+        to_visit = []
+        for item, rel, enclosing, descend in subfolders:
+            segments.extend(self.classify(item, rel, data_folder))
+            if descend:
+                to_visit.append((item, rel, enclosing))
+
+        for item, rel, enclosing in to_visit:
+            if depth > 1:
+                self._split(pool, item, rel, enclosing, depth - 1, segments)
+            else:
+                segments.append(pool.submit(check_subtree, self.src, self.dest, item, enclosing, self.track_skipped,
+                                            self.index_dest))
+
+    def classify(self, item: Path, rel: Tuple[str, ...], data_folder: Optional[Path]) -> Iterator[Finding]:
+        """
+        Applies the rules of the check to a single folder.
+
+        :param item: The folder in src.
+        :param rel: Its parts relative to src.
+        :param data_folder: The data folder that contains it, if any.
+        :return: A generator with the findings of the folder.
+        """
+        if data_folder is not None:
+            if self._debug:
+                logger.debug(f'{item} has been skipped since its related to: {data_folder}.')
+            yield Finding(FindingKind.SKIPPED, item, data_folder)
+
+        elif item.name in self.valid_names:
+            if self._debug:
+                logger.debug(f'{item} added to data_folders.')
+            target_path = self.dest.joinpath(*rel)
+            if not self.dest_has_folder(rel, target_path):
+                if self._debug:
+                    logger.debug(f'{item} is being created in dest.')
+                yield Finding(FindingKind.CREATE_DATA_FOLDER, item, target_path)
+            yield Finding(FindingKind.DATA_FOLDER, item, target_path)
+
+        else:
+            target_path = self.dest.joinpath(*rel)
+            if self.dest_has_folder(rel, target_path):
+                if self._debug:
+                    logger.debug(f'for item:{item} the target: {target_path} has been found :)')
+                yield Finding(FindingKind.TARGET_FOUND, item, target_path)
+            else:
+                logger.error(f'{item} has not been found in {target_path}')
+                yield Finding(FindingKind.PROBLEMATIC, item, target_path)
+
+    def collect(self, finding: Finding) -> None:
+        """
+        Stores a finding in its list.
+
+        :param finding: The finding to store.
+        """
+        kind = finding.kind
+        if kind is FindingKind.SKIPPED:
+            self.skipped_folders.append(finding.src)
+        elif kind is FindingKind.DATA_FOLDER:
+            self.data_folders.append(finding.src)
+        elif kind is FindingKind.CREATE_DATA_FOLDER:
+            self.create_data_folders.append((finding.src, finding.dest))
+        elif kind is FindingKind.TARGET_FOUND:
+            self.target_founds.append((finding.src, finding.dest))
+        else:
+            self.problematic_folders.append((finding.src, finding.dest))
 
     def check_folders(self) -> None:
         """
-        Runs the folder check.
-        """
-        self.reset_internal_variables()
-
-        for item in self.src.glob('**/*'):
-            if item.is_dir():
-                skip = False
-                for data_folder in self.data_folders:
-                    if item.is_relative_to(data_folder):
-                        logger.debug(f'{item} has been skipped since its related to: {data_folder}.')
-                        skip = True
-                        self.skipped_folders.append(item)
-                        break
-                if not skip:
-                    if item not in self.data_folders:
-                        if item.name in self.valid_names:
-                            self.data_folders.append(item)
-                            logger.debug(f'{item} added to data_folders.')
-
-                            target_path = self.convert_src_to_dest(item)
-                            if not target_path.is_dir():
-                                self.create_data_folders.append((item, target_path))
-                                logger.debug(f'{item} is being created in dest.')
-
-                        else:
-                            target_path = self.convert_src_to_dest(item)
-                            if target_path.is_dir():
-                                self.target_founds.append((item, target_path))
-                                logger.debug(f'for item:{item} the target: {target_path} has been found :)')
-                            else:
-                                self.problematic_folders.append((item, target_path))
-                                logger.error(f'{item} has not been found in {target_path}')
+        Runs the folder check, collecting every finding in the lists of the checker. Runs under cProfile if the checker
+        has a profile path.
+        """
+        with metrics.profiled(self.profile), CHECK_SECONDS.time():
+            self.reset_internal_variables()
+            for finding in self.iter_findings():
+                self.collect(finding)
+        PROBLEMATIC.set(len(self.problematic_folders))
+
+
+def check_subtree(src: Path, dest: Path, root: Path, root_data_folder: Optional[Path], track_skipped: bool = True,
+                  index_dest: bool = False) -> List[Finding]:
+    """
+    Checks the subtree of a single folder of src. Used by the workers of the parallel walk of StructureChecker; it is
+    a module level function so that it can be run in a process pool.
 
+    :param src: The path of the source directory.
+    :param dest: The path of the destination directory.
+    :param root: The folder inside src to check. root itself is not checked.
+    :param root_data_folder: The data folder that contains root, if any.
+    :return: The findings of the subtree, in walk order.
+    """
+    checker = StructureChecker(src, dest, track_skipped=track_skipped, index_dest=index_dest, scan=False)
+    return list(checker.iter_findings(root, root_data_folder))
@@ -0,0 +1,564 @@
+"""
+Copy engine for the backup tool. It takes the findings of a StructureChecker and copies the contents of every data
+folder into its dest equivalent, creating the data folders listed in create_data_folders first.
+
+Files are copied by a bounded pool of threads. Each copy uses the zero-copy paths of the kernel when they are
+available (os.copy_file_range, then os.sendfile) and falls back to chunked copies through a large, per thread, reusable
+buffer. Files are written to a hidden temporary '.part' file with a unique name (see part_path) that is renamed once
+complete, so an interrupted copy never leaves a truncated file with the final name behind.
+
+A file is skipped if its dest equivalent already exists with the same size and modification time. Copies keep the
+modification time of the source for that reason. In incremental mode, when a Manifest is given, files are compared
+with what the manifest recorded in the previous run instead, so unchanged files cost no I/O in dest.
+
+Optionally, src files get hashed before being copied (see hasher.py). The hashes are stored in the manifest and are used
+to copy identical files only once: any other file with the same content is hardlinked to the first copy in dest. The
+same hashes are reused by the optional verification pass, which hashes the dest files once the copy is done.
+
+Copies can be slowed down by a Throttle (see throttle.py), so they do not compete with live acquisition for the storage.
+"""
+
+import os
+import time
+import uuid
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from pathlib import Path
+from typing import Iterator, Tuple, Optional, Dict, List, Iterable
+
+from log import *
+from checker import StructureChecker, Finding, FindingKind
+from manifest import Manifest, ManifestEntry
+from hasher import FileHasher
+from throttle import Throttle
+
+logger = log_logger('filechecker.copier')
+
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Errors meaning that a zero-copy call is not supported for this pair of files, so the next method should be tried.
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+_buffers = threading.local()
+
+
+def _get_buffer(buffer_size: int) -> memoryview:
+    """
+    Gets the copy buffer of the current thread, so that every worker allocates it only once.
+    """
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != buffer_size:
+        buffer = memoryview(bytearray(buffer_size))
+        _buffers.buffer = buffer
+    return buffer
+
+
+def _copy_file_range(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    """
+    Copies with os.copy_file_range starting at offset.
+
+    :return: The offset up to which the file has been copied.
+    """
+    while offset < size:
+        copied = os.copy_file_range(src_fd, dest_fd, size - offset, offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+
+def _sendfile(src_fd: int, dest_fd: int, size: int, offset: int) -> int:
+    """
+    Copies with os.sendfile starting at offset.
+
+    :return: The offset up to which the file has been copied.
+    """
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    while offset < size:
+        sent = os.sendfile(dest_fd, src_fd, offset, min(size - offset, 1 << 30))
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+
+def _throttled(copy, src_fd: int, dest_fd: int, size: int, offset: int, throttle: Throttle) -> int:
+    """
+    Calls a zero-copy function once per chunk of the throttle, waiting for the throttle before each one.
+
+    :return: The offset up to which the file has been copied.
+    """
+    while offset < size:
+        end = min(size, offset + throttle.chunk_size)
+        throttle.acquire(end - offset)
+        start = time.perf_counter()
+        copied = copy(src_fd, dest_fd, end, offset)
+        throttle.observe(time.perf_counter() - start, copied - offset)
+        if copied < end:
+            return copied
+        offset = copied
+    return offset
+
+
+def _copy_chunks(src_fd: int, dest_fd: int, offset: int, buffer_size: int, throttle: Optional[Throttle] = None) -> int:
+    """
+    Copies the rest of the file in chunks through the buffer of the thread. With a throttle, the chunks are of its
+    chunk size and each one waits for the throttle before being written.
+
+    :return: The offset up to which the file has been copied.
+    """
+    buffer = _get_buffer(buffer_size)
+    if throttle is not None:
+        buffer = buffer[:throttle.chunk_size]
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    while True:
+        read = os.readv(src_fd, [buffer])
+        if read == 0:
+            break
+        if throttle is not None:
+            throttle.acquire(read)
+            start = time.perf_counter()
+        written = 0
+        while written < read:
+            written += os.write(dest_fd, buffer[written:read])
+        if throttle is not None:
+            throttle.observe(time.perf_counter() - start, read)
+        offset += read
+    return offset
+
+
+def part_path(dest: Path) -> Path:
+    """
+    Gets the temporary path a file is written to before being renamed to dest. The name is hidden and unique, so two
+    concurrent writes never share it, even in a folder holding both x and x.part.
+    """
+    return dest.with_name(f'.{dest.name}.{uuid.uuid4().hex}.part')
+
+
+def copy_file(src: Path, dest: Path, buffer_size: int = BUFFER_SIZE, throttle: Optional[Throttle] = None) -> int:
+    """
+    Copies a single file, keeping its modification time. The data is written to a temporary file next to dest first
+    (see part_path) and renamed into place once complete.
+
+    :param src: The file to copy.
+    :param dest: The path of the copy.
+    :param buffer_size: The size of the buffer used when zero-copy calls are not available.
+    :param throttle: Optional throttle limiting the speed of the copy.
+    :return: The number of bytes copied.
+    """
+    if throttle is not None:
+        throttle.acquire(0)
+    part = part_path(dest)
+    src_fd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        st = os.fstat(src_fd)
+        dest_fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            size = st.st_size
+            offset = 0
+            for method in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+                if method is None or offset >= size:
+                    continue
+                copy = _copy_file_range if method is os.copy_file_range else _sendfile
+                try:
+                    if throttle is None:
+                        offset = copy(src_fd, dest_fd, size, offset)
+                    else:
+                        offset = _throttled(copy, src_fd, dest_fd, size, offset, throttle)
+                    break
+                except OSError as e:
+                    if e.errno not in _FALLBACK_ERRNOS:
+                        raise
+            # Zero-copy calls stop at the size the file had when it was opened, reading until EOF picks up the rest.
+            offset = _copy_chunks(src_fd, dest_fd, offset, buffer_size, throttle)
+        finally:
+            os.close(dest_fd)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    finally:
+        os.close(src_fd)
+
+    try:
+        os.utime(part, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(part, dest)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    return offset
+
+
+class CopyStats:
+    """
+    Keeps track of what a copy run did. Safe to update from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.errors = 0
+        self.linked = 0
+        self.verify_errors = 0
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    def add_copied(self, size: int) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+
+    def add_linked(self) -> None:
+        with self._lock:
+            self.linked += 1
+
+    def add_skipped(self) -> None:
+        with self._lock:
+            self.skipped += 1
+
+    def add_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def stop(self) -> None:
+        self.end = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return max(end - self.start, 1e-9)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / self.elapsed / 1e6
+
+    def __str__(self) -> str:
+        return (f'{self.files} files ({self.bytes / 1e6:.1f} MB) copied in {self.elapsed:.2f} s, '
+                f'{self.files_per_second:.1f} files/s, {self.mb_per_second:.1f} MB/s. '
+                f'{self.linked} duplicated files hardlinked, {self.skipped} files up to date, {self.errors} errors, '
+                f'{self.verify_errors} verification errors.')
+
+
+class DataFolderCopier:
+    """
+    Copies the contents of the data folders found by a StructureChecker into dest.
+
+    :param checker: A StructureChecker that has already run its check.
+    :param workers: Number of threads copying files.
+    :param buffer_size: Size of the buffer of every thread for chunked copies.
+    :param max_pending: Maximum number of files waiting to be copied at any time. Bounds the memory used when the
+        walk is faster than the copies. Defaults to 4 times the number of workers.
+    :param manifest: Optional manifest of the previous runs. If passed the copier runs in incremental mode: files are
+        compared against the manifest and every copied file gets recorded in it.
+    :param dedup: If True, files are hashed before copying them and files with the same content as one that is
+        already in dest get hardlinked to it instead of copied. Needs a manifest, since hardlinked files keep the
+        modification time of the first copy and cannot be compared against src by stat.
+    :param verify: If True, files are hashed before copying them and, once everything is copied, the dest files get
+        hashed again and compared.
+    :param hasher: Optional FileHasher to use for dedup and verify. One with default settings is created if needed.
+    :param throttle: Optional throttle limiting the bandwidth and operations per second of the copies and hardlinks.
+    """
+    def __init__(self, checker: StructureChecker, workers: int = 8, buffer_size: int = BUFFER_SIZE,
+                 max_pending: Optional[int] = None, manifest: Optional[Manifest] = None, dedup: bool = False,
+                 verify: bool = False, hasher: Optional[FileHasher] = None, throttle: Optional[Throttle] = None):
+        if dedup and manifest is None:
+            raise ValueError('dedup needs a manifest.')
+
+        self.checker = checker
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending if max_pending is not None else 4 * workers
+        self.manifest = manifest
+        self.dedup = dedup
+        self.verify = verify
+        self.hasher = hasher
+        self.throttle = throttle
+
+        # Content hash -> dest file holding it, for files copied during this run.
+        self._copied_hashes: Dict[str, Path] = {}
+        # Content hash -> event set once the file with that content being copied by another thread is done.
+        self._copying_hashes: Dict[str, threading.Event] = {}
+        self._hashes_lock = threading.Lock()
+        # (dest file, hash of its src) of every file written during this run, used by the verification pass.
+        self._written: List[Tuple[Path, str]] = []
+
+    @staticmethod
+    def create_data_folder(dest_folder: Path) -> None:
+        """
+        Creates a data folder in dest. Its parent must already exist in dest.
+        """
+        try:
+            dest_folder.mkdir(exist_ok=True)
+            logger.info(f'{dest_folder} created.')
+        except FileNotFoundError:
+            logger.error(f'{dest_folder} could not be created since its parent does not exist in dest.')
+
+    def iter_data_folders(self, findings: Optional[Iterable[Finding]] = None) -> Iterator[Tuple[Path, Path]]:
+        """
+        Goes through the data folders that have to be copied, creating the missing ones in dest.
+
+        :param findings: Optional stream of findings, usually from StructureChecker.iter_findings, to copy data
+            folders while the walk is still running. If None, the lists of the checker are used.
+        :return: A generator of tuples with every data folder and its dest equivalent.
+        """
+        if findings is None:
+            for _, dest_folder in self.checker.create_data_folders:
+                self.create_data_folder(dest_folder)
+            for data_folder in self.checker.data_folders:
+                yield data_folder, self.checker.convert_src_to_dest(data_folder)
+        else:
+            for finding in findings:
+                if finding.kind is FindingKind.CREATE_DATA_FOLDER:
+                    self.create_data_folder(finding.dest)
+                elif finding.kind is FindingKind.DATA_FOLDER:
+                    yield finding.src, finding.dest
+
+    def iter_files(self, src_folder: Path, dest_folder: Path, stats: Optional[CopyStats] = None) \
+            -> Iterator[Tuple[Path, Path, str, os.stat_result]]:
+        """
+        Walks a data folder, creating its subfolders in dest as they are found. A folder that cannot be created in dest
+        or read in src is logged and skipped with everything inside it, and so is a file that cannot be stat'ed.
+
+        :param src_folder: The data folder in src.
+        :param dest_folder: The equivalent folder in dest.
+        :param stats: If passed, the skipped folders and files are counted as errors in it.
+        :return: A generator of tuples with the src file, its dest path, its path relative to src (with '/' as
+            separator) and the stat of the src file.
+        """
+        stack = [(src_folder, dest_folder, '/'.join(src_folder.parts[self.checker.src_len:]))]
+        while stack:
+            src_dir, dest_dir, rel_dir = stack.pop()
+            try:
+                dest_dir.mkdir(exist_ok=True)
+                with os.scandir(src_dir) as it:
+                    entries = list(it)
+            except OSError as e:
+                if stats is not None:
+                    stats.add_error()
+                logger.error(f'{src_dir} not copied: {e}')
+                continue
+            for entry in entries:
+                rel = f'{rel_dir}/{entry.name}'
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((Path(entry.path), dest_dir / entry.name, rel))
+                    elif entry.is_file():
+                        yield Path(entry.path), dest_dir / entry.name, rel, entry.stat()
+                except OSError as e:
+                    if stats is not None:
+                        stats.add_error()
+                    logger.error(f'{entry.path} not copied: {e}')
+
+    def needs_copy(self, rel: str, src_stat: os.stat_result, dest: Path, record: bool = True) -> bool:
+        """
+        Checks if a file needs to be copied. In incremental mode the src stat is compared with the manifest. Files
+        missing from the manifest (and every file without one) get their size and modification time compared with
+        their dest equivalent.
+
+        :param rel: The path of the file relative to src.
+        :param src_stat: The stat of the src file.
+        :param dest: The dest path of the file.
+        :param record: If True, files found unchanged in dest but missing from the manifest get recorded in it.
+        :return: True if the file is new or changed.
+        """
+        if self.manifest is not None:
+            entry = self.manifest.get(rel)
+            if entry is not None:
+                return entry.size != src_stat.st_size or entry.mtime_ns != src_stat.st_mtime_ns \
+                    or entry.inode != src_stat.st_ino
+
+        try:
+            dest_stat = dest.stat()
+        except FileNotFoundError:
+            return True
+        changed = dest_stat.st_size != src_stat.st_size or dest_stat.st_mtime_ns != src_stat.st_mtime_ns
+        if not changed and record and self.manifest is not None:
+            # The file was backed up before the manifest existed, record it so the next run does not need dest.
+            self.manifest.record(ManifestEntry(rel, src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_ino))
+        return changed
+
+    def iter_changed_files(self, stats: Optional[CopyStats] = None, findings: Optional[Iterable[Finding]] = None) \
+            -> Iterator[Tuple[Path, Path, str, os.stat_result]]:
+        """
+        Walks every data folder found by the checker and yields only the files that are new or have changed.
+
+        :param stats: If passed, unchanged files are counted as skipped in it.
+        :param findings: Optional stream of findings, see iter_data_folders.
+        :return: A generator of tuples like the ones of iter_files.
+        """
+        for data_folder, dest_folder in self.iter_data_folders(findings):
+            if not dest_folder.is_dir():
+                logger.error(f'{data_folder} not copied since {dest_folder} does not exist.')
+                continue
+
+            for src, dest, rel, src_stat in self.iter_files(data_folder, dest_folder, stats):
+                if self.needs_copy(rel, src_stat, dest):
+                    yield src, dest, rel, src_stat
+                elif stats is not None:
+                    stats.add_skipped()
+
+    def find_duplicate(self, file_hash: str, size: int) -> Optional[Path]:
+        """
+        Looks for a file in dest with the given content, first among the files copied during this run and then in
+        the manifest. If another thread is copying a file with the same content, waits for it to finish.
+
+        :param file_hash: The hash of the content.
+        :param size: The size of the content, used to double check the dest file.
+        :return: The dest file, None if there is none.
+        """
+        with self._hashes_lock:
+            duplicate = self._copied_hashes.get(file_hash)
+            copying = self._copying_hashes.get(file_hash) if duplicate is None else None
+            if duplicate is None and copying is None:
+                # Claim the content, any other thread finding it waits for this copy instead of copying it again.
+                self._copying_hashes[file_hash] = threading.Event()
+        if copying is not None:
+            copying.wait()
+            with self._hashes_lock:
+                duplicate = self._copied_hashes.get(file_hash)
+        if duplicate is None and self.manifest is not None:
+            entry = self.manifest.find_hash(file_hash)
+            if entry is not None:
+                duplicate = self.checker.dest.joinpath(*entry.path.split('/'))
+        if duplicate is not None:
+            try:
+                if duplicate.stat().st_size == size:
+                    return duplicate
+            except FileNotFoundError:
+                pass
+        return None
+
+    @staticmethod
+    def link_file(existing: Path, dest: Path) -> None:
+        """
+        Hardlinks dest to an existing file, replacing dest if it exists.
+        """
+        part = part_path(dest)
+        os.link(existing, part)
+        try:
+            os.replace(part, dest)
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
+
+    def _copy_one(self, src: Path, dest: Path, rel: str, src_stat: os.stat_result, stats: CopyStats) -> None:
+        file_hash = None
+        try:
+            if self.dedup or self.verify:
+                file_hash = self.hasher.hash_file(src, src_stat.st_size)
+
+            duplicate = self.find_duplicate(file_hash, src_stat.st_size) if self.dedup else None
+            linked = False
+            if duplicate is not None:
+                try:
+                    if self.throttle is not None:
+                        self.throttle.acquire(0)
+                    self.link_file(duplicate, dest)
+                    linked = True
+                    stats.add_linked()
+                    logger.debug(f'{dest} hardlinked to {duplicate}.')
+                except OSError as e:
+                    logger.warning(f'{dest} could not be hardlinked to {duplicate}, copying it instead: {e}')
+            if not linked:
+                size = copy_file(src, dest, self.buffer_size, self.throttle)
+                stats.add_copied(size)
+                logger.debug(f'{src} copied to {dest}.')
+        except OSError as e:
+            stats.add_error()
+            logger.error(f'{src} could not be copied to {dest}: {e}')
+            self._release_hash(file_hash)
+            return
+        except BaseException:
+            # Counted by copy. The threads waiting for this content must not wait forever.
+            self._release_hash(file_hash)
+            raise
+
+        if file_hash is not None:
+            with self._hashes_lock:
+                self._copied_hashes.setdefault(file_hash, dest)
+                self._written.append((dest, file_hash))
+            self._release_hash(file_hash)
+        if self.manifest is not None:
+            self.manifest.record(ManifestEntry(rel, src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_ino,
+                                               file_hash))
+
+    def _release_hash(self, file_hash: Optional[str]) -> None:
+        """
+        Wakes up the threads waiting for a file with the given content to be copied.
+        """
+        with self._hashes_lock:
+            event = self._copying_hashes.pop(file_hash, None)
+        if event is not None:
+            event.set()
+
+    def verify_copies(self, stats: Optional[CopyStats] = None) -> List[Path]:
+        """
+        Hashes every dest file written during the run and compares it with the hash of its src file.
+
+        :param stats: If passed, mismatches are counted in it.
+        :return: The dest files whose content does not match their src, or that could not be read.
+        """
+        mismatches = []
+        expected = dict(self._written)
+
+        def unreadable(dest: Path, error: OSError) -> None:
+            mismatches.append(dest)
+            logger.error(f'{dest} could not be verified: {error}')
+
+        for dest, dest_hash in self.hasher.hash_files((dest for dest, _ in self._written), on_error=unreadable):
+            if dest_hash != expected[dest]:
+                mismatches.append(dest)
+                logger.error(f'{dest} does not match its source.')
+        if stats is not None:
+            stats.verify_errors += len(mismatches)
+        logger.info(f'{len(self._written)} files verified, {len(mismatches)} mismatches.')
+        return mismatches
+
+    def copy(self, findings: Optional[Iterable[Finding]] = None) -> CopyStats:
+        """
+        Copies every data folder found by the checker.
+
+        :param findings: Optional stream of findings, usually from StructureChecker.iter_findings. If passed, data
+            folders get copied as soon as the walk finds them instead of using the lists of the checker.
+        :return: The statistics of the run.
+        """
+        stats = CopyStats()
+        self._copied_hashes = {}
+        self._copying_hashes = {}
+        self._written = []
+        own_hasher = self.hasher is None and (self.dedup or self.verify)
+        if own_hasher:
+            self.hasher = FileHasher(workers=self.workers)
+
+        pending = threading.BoundedSemaphore(self.max_pending)
+
+        def done(src: Path, future: Future) -> None:
+            pending.release()
+            # Errors other than OSError are not expected by _copy_one, they would be lost with the future otherwise.
+            error = future.exception()
+            if error is not None:
+                stats.add_error()
+                logger.error(f'{src} could not be copied: {error!r}', exc_info=error)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for src, dest, rel, src_stat in self.iter_changed_files(stats, findings):
+                pending.acquire()
+                executor.submit(self._copy_one, src, dest, rel, src_stat, stats).add_done_callback(partial(done, src))
+
+        if self.manifest is not None:
+            self.manifest.flush()
+        if self.verify:
+            self.verify_copies(stats)
+        if own_hasher:
+            self.hasher.close()
+            self.hasher = None
+        stats.stop()
+        logger.info(f'copy complete: {stats}')
+        return stats
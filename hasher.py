@@ -0,0 +1,140 @@
+"""
+Content hashing for the backup tool. Files are split in fixed size chunks that get hashed in parallel by a pool of
+threads with BLAKE2b. hashlib releases the GIL while hashing large buffers, so the threads do run in parallel. The hash
+of a file is the BLAKE2b hash of the size of the file followed by the digests of its chunks, in order. Hashes only
+depend on the content of the file (and CHUNK_SIZE), never on the number of workers.
+"""
+
+import os
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
+from pathlib import Path
+from typing import Optional, Iterable, Iterator, Tuple, List, Callable
+
+CHUNK_SIZE = 16 * 1024 * 1024
+DIGEST_SIZE = 32
+
+
+def hash_chunk(path: Path, offset: int, length: int) -> bytes:
+    """
+    Hashes a single chunk of a file.
+
+    :param path: The file.
+    :param offset: Where the chunk starts.
+    :param length: The length of the chunk.
+    :return: The digest of the chunk.
+    """
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(remaining, 4 * 1024 * 1024))
+            if not data:
+                break
+            h.update(data)
+            remaining -= len(data)
+    return h.digest()
+
+
+def combine_chunk_digests(size: int, digests: Iterable[bytes]) -> str:
+    """
+    Combines the digests of the chunks of a file into the hash of the file.
+
+    :param size: The size of the file.
+    :param digests: The digests of the chunks, in order.
+    :return: The hash of the file as an hex string.
+    """
+    h = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=DIGEST_SIZE)
+    for digest in digests:
+        h.update(digest)
+    return h.hexdigest()
+
+
+class FileHasher:
+    """
+    Hashes files splitting them in chunks across a pool of threads.
+
+    :param workers: Number of threads hashing chunks.
+    :param chunk_size: Size of the chunks. Hashes are only comparable between hashers with the same chunk size.
+    :param executor: Optional executor to use instead of creating one.
+    """
+    def __init__(self, workers: int = 4, chunk_size: int = CHUNK_SIZE, executor: Optional[Executor] = None):
+        self.chunk_size = chunk_size
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self) -> 'FileHasher':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Shuts down the pool of threads if the hasher created it.
+        """
+        if self._own_executor:
+            self.executor.shutdown()
+
+    def hash_file(self, path: Path, size: Optional[int] = None) -> str:
+        """
+        Hashes a file. Can be called from several threads at once, but not from inside the executor of the hasher.
+
+        :param path: The file to hash.
+        :param size: The size of the file, if already known.
+        :return: The hash of the file as an hex string.
+        """
+        if size is None:
+            size = os.stat(path).st_size
+        if size <= self.chunk_size:
+            return combine_chunk_digests(size, [hash_chunk(path, 0, size)])
+
+        futures = [self.executor.submit(hash_chunk, path, offset, min(self.chunk_size, size - offset))
+                   for offset in range(0, size, self.chunk_size)]
+        return combine_chunk_digests(size, (future.result() for future in futures))
+
+    def hash_files(self, paths: Iterable[Path], window: int = 64,
+                   on_error: Optional[Callable[[Path, OSError], None]] = None) -> Iterator[Tuple[Path, str]]:
+        """
+        Hashes several files, the chunks of all of them sharing the pool of threads.
+
+        :param paths: The files to hash.
+        :param window: Maximum number of files being hashed at the same time.
+        :param on_error: Called with the path and the error of every file that cannot be read, which is then left out.
+            If None, the errors are raised.
+        :return: A generator of tuples with every file and its hash, in the same order as paths.
+        """
+        in_flight = deque()
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+            except OSError as e:
+                if on_error is None:
+                    raise
+                on_error(path, e)
+                continue
+            futures = [self.executor.submit(hash_chunk, path, offset, min(self.chunk_size, size - offset))
+                       for offset in range(0, max(size, 1), self.chunk_size)]
+            in_flight.append((path, size, futures))
+            if len(in_flight) >= window:
+                yield from self._combine(*in_flight.popleft(), on_error)
+
+        while in_flight:
+            yield from self._combine(*in_flight.popleft(), on_error)
+
+    @staticmethod
+    def _combine(path: Path, size: int, futures: List['Future[bytes]'],
+                 on_error: Optional[Callable[[Path, OSError], None]]) -> Iterator[Tuple[Path, str]]:
+        """
+        Waits for the chunks of a file of hash_files, yielding the file and its hash unless it could not be read.
+        """
+        try:
+            digests = [future.result() for future in futures]
+        except OSError as e:
+            if on_error is None:
+                raise
+            on_error(path, e)
+            return
+        yield path, combine_chunk_digests(size, digests)
@@ -0,0 +1,279 @@
+"""
+Live version of the structure checker. After one initial scan, the LiveStructureChecker subscribes to the filesystem
+events of both src and dest through watchdog and keeps problematic_folders, target_founds, data_folders and
+create_data_folders up to date incrementally, so a folder missing in the backup is reported as soon as it appears
+instead of at the next full rescan.
+
+The rules are the same as the ones of the StructureChecker. Folders inside data folders are not tracked, so
+skipped_folders always stays empty.
+"""
+
+import threading
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Set, Optional, Callable, List, Tuple
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler, FileSystemEvent
+
+from log import *
+from checker import StructureChecker, Finding, FindingKind
+
+logger = log_logger('filechecker.live')
+
+
+class TreeEventHandler(FileSystemEventHandler):
+    """
+    Forwards the folder events of a tree to a pair of callbacks. Moves are treated as a deletion of both paths (the
+    move may have replaced the destination) followed by a creation. Deletions are forwarded for files too, since some
+    platforms cannot tell if a deleted path was a folder.
+
+    :param created: Called with the path of every created folder.
+    :param deleted: Called with the path of every deleted item.
+    """
+    def __init__(self, created: Callable[[Path], None], deleted: Callable[[Path], None]):
+        super().__init__()
+        self.created = created
+        self.deleted = deleted
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        if event.is_directory:
+            self.created(Path(event.src_path))
+
+    def on_deleted(self, event: FileSystemEvent) -> None:
+        self.deleted(Path(event.src_path))
+
+    def on_moved(self, event: FileSystemEvent) -> None:
+        self.deleted(Path(event.src_path))
+        if event.is_directory:
+            self.deleted(Path(event.dest_path))
+            self.created(Path(event.dest_path))
+
+
+class LiveStructureChecker(StructureChecker):
+    """
+    StructureChecker that keeps its findings up to date with filesystem events. Call start to run the initial scan
+    and begin watching, and stop to stop watching. The lists of findings are snapshots built when they are accessed,
+    so they can be read from any thread.
+
+    :param src: The path of the source directory.
+    :param dest: The path of the destination directory.
+    :param alert: Optional function called with the src and dest paths of every folder that becomes problematic after
+        the initial scan.
+    :param index_dest: Use a DestinationIndex for the initial scan. Later updates always check dest directly.
+    """
+    def __init__(self, src: Path, dest: Path, alert: Optional[Callable[[Path, Path], None]] = None,
+                 index_dest: bool = False):
+        self._lock = threading.RLock()
+        self._problematic: Dict[Path, Path] = {}
+        self._found: Dict[Path, Path] = {}
+        self._data: Dict[Path, Path] = {}
+        self._create: Dict[Path, Path] = {}
+        # Tracked folder -> its tracked subfolders. Used to update whole subtrees without walking them again.
+        self._children: Dict[Path, Set[Path]] = {}
+        self._live = False
+
+        self.alert = alert
+        self.observer: Optional[Observer] = None
+        super().__init__(src, dest, track_skipped=False, index_dest=index_dest, scan=False)
+
+    @property
+    def problematic_folders(self) -> List[Tuple[Path, Path]]:
+        with self._lock:
+            return list(self._problematic.items())
+
+    @problematic_folders.setter
+    def problematic_folders(self, value: List[Tuple[Path, Path]]) -> None:
+        with self._lock:
+            self._problematic = dict(value)
+
+    @property
+    def target_founds(self) -> List[Tuple[Path, Path]]:
+        with self._lock:
+            return list(self._found.items())
+
+    @target_founds.setter
+    def target_founds(self, value: List[Tuple[Path, Path]]) -> None:
+        with self._lock:
+            self._found = dict(value)
+
+    @property
+    def data_folders(self) -> List[Path]:
+        with self._lock:
+            return list(self._data)
+
+    @data_folders.setter
+    def data_folders(self, value: List[Path]) -> None:
+        with self._lock:
+            self._data = {folder: self.convert_src_to_dest(folder) for folder in value}
+
+    @property
+    def create_data_folders(self) -> List[Tuple[Path, Path]]:
+        with self._lock:
+            return list(self._create.items())
+
+    @create_data_folders.setter
+    def create_data_folders(self, value: List[Tuple[Path, Path]]) -> None:
+        with self._lock:
+            self._create = dict(value)
+
+    def reset_internal_variables(self) -> None:
+        with self._lock:
+            super().reset_internal_variables()
+            self._children = {}
+
+    def collect(self, finding: Finding) -> None:
+        kind = finding.kind
+        with self._lock:
+            if kind is FindingKind.SKIPPED:
+                return
+            if kind is FindingKind.CREATE_DATA_FOLDER:
+                self._create[finding.src] = finding.dest
+                return
+
+            if kind is FindingKind.DATA_FOLDER:
+                self._data[finding.src] = finding.dest
+            elif kind is FindingKind.TARGET_FOUND:
+                self._found[finding.src] = finding.dest
+            else:
+                self._problematic[finding.src] = finding.dest
+                if self._live and self.alert is not None:
+                    self.alert(finding.src, finding.dest)
+            self._children.setdefault(finding.src.parent, set()).add(finding.src)
+
+    def start(self) -> None:
+        """
+        Starts watching src and dest and runs the initial scan. Watching starts first so that nothing that changes
+        during the scan is missed.
+        """
+        self.observer = Observer()
+        self.observer.schedule(TreeEventHandler(self.src_created, self.src_deleted), str(self.src), recursive=True)
+        self.observer.schedule(TreeEventHandler(self.dest_changed, self.dest_changed), str(self.dest), recursive=True)
+        self.observer.start()
+
+        logger.info(f'starting folder check')
+        self.check_folders()
+        self.dest_index = None
+        self._live = True
+        logger.info(f'folder check complete, watching {self.src} and {self.dest}')
+
+    def stop(self) -> None:
+        """
+        Stops watching src and dest.
+        """
+        self._live = False
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def __enter__(self) -> 'LiveStructureChecker':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def enclosing_data_folder(self, path: Path) -> Optional[Path]:
+        """
+        Finds the data folder that contains a src path, walking up its parents.
+
+        :return: The data folder, None if the path is not inside one.
+        """
+        with self._lock:
+            for parent in islice(path.parents, len(path.parts) - self.src_len):
+                if parent in self._data:
+                    return parent
+        return None
+
+    def src_created(self, path: Path) -> None:
+        """
+        Checks a folder created (or moved) into src, together with everything inside it. Folders that are already
+        tracked are ignored: a created event is sent for every level of a nested mkdir, but the walk started by the
+        first one has found them all.
+
+        :param path: The new folder.
+        """
+        rel = path.parts[self.src_len:]
+        if not rel or path.parts[:self.src_len] != self.src.parts:
+            return
+        with self._lock:
+            if path in self._problematic or path in self._found or path in self._data:
+                return
+            if self.enclosing_data_folder(path) is not None:
+                return
+            if not path.is_dir():
+                return
+            for finding in self.classify(path, rel, None):
+                self.collect(finding)
+            if path not in self._data:
+                for item, item_rel, data_folder in self.walk_folders(path):
+                    for finding in self.classify(item, item_rel, data_folder):
+                        self.collect(finding)
+
+    def src_deleted(self, path: Path) -> None:
+        """
+        Forgets a folder deleted (or moved out of) src, together with everything inside it.
+
+        :param path: The deleted folder.
+        """
+        with self._lock:
+            self._remove_tree(path)
+
+    def dest_changed(self, path: Path) -> None:
+        """
+        Checks again the src folders whose dest equivalent is path or is inside path.
+
+        :param path: The folder created or deleted in dest.
+        """
+        rel = path.parts[self.dest_len:]
+        if not rel or path.parts[:self.dest_len] != self.dest.parts:
+            return
+        with self._lock:
+            stack = [self.src.joinpath(*rel)]
+            while stack:
+                folder = stack.pop()
+                self._recheck(folder)
+                stack.extend(self._children.get(folder, ()))
+
+    def _recheck(self, folder: Path) -> None:
+        """
+        Checks again if the dest equivalent of a tracked folder exists, moving it between lists if needed.
+        """
+        if folder in self._data:
+            dest = self._data[folder]
+            if dest.is_dir():
+                self._create.pop(folder, None)
+            elif folder not in self._create:
+                logger.debug(f'{folder} is being created in dest.')
+                self._create[folder] = dest
+
+        elif folder in self._found:
+            dest = self._found[folder]
+            if not dest.is_dir():
+                del self._found[folder]
+                self._problematic[folder] = dest
+                logger.error(f'{folder} has not been found in {dest}')
+                if self.alert is not None:
+                    self.alert(folder, dest)
+
+        elif folder in self._problematic:
+            dest = self._problematic[folder]
+            if dest.is_dir():
+                del self._problematic[folder]
+                self._found[folder] = dest
+                logger.info(f'for item:{folder} the target: {dest} has been found :)')
+
+    def _remove_tree(self, path: Path) -> None:
+        """
+        Removes a folder and all its tracked subfolders from the findings.
+        """
+        siblings = self._children.get(path.parent)
+        if siblings is not None:
+            siblings.discard(path)
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            for findings in (self._problematic, self._found, self._data, self._create):
+                findings.pop(folder, None)
+            stack.extend(self._children.pop(folder, ()))
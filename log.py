@@ -3,28 +3,155 @@ Logging files taken from instrumentserver.
 """
 
 import sys
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+from typing import Dict
 
-logging.basicConfig(level=logging.DEBUG)
+# Format of the lines of the log files. log_reader.LogLineParser depends on it.
+FILE_FORMAT = "%(asctime)s\t| %(name)s\t| %(levelname)s\t| %(message)s"
+FILE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+# Keys of the records written with file_format='json'. log_reader.JsonLineParser depends on them.
+JSON_KEYS = ('time', 'name', 'level', 'message')
 
-def setup_logging(add_stream_handler=True, log_file=None, name='filechecker', stream_handler_level=logging.DEBUG):
+# Name of the logger -> the QueueListener writing its records, for the loggers set up with use_queue.
+_listeners: Dict[str, logging.handlers.QueueListener] = {}
 
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as a single line of JSON with the keys of JSON_KEYS: the epoch time of the record, the name
+    of the logger, the level name and the message (with the traceback of the exception, if any). Newlines and '|' in
+    the message are kept as they are, escaped by JSON.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            message = f'{message}\n{record.exc_text}'
+        if record.stack_info:
+            message = f'{message}\n{self.formatStack(record.stack_info)}'
+        return json.dumps({'time': record.created, 'name': record.name, 'level': record.levelname,
+                           'message': message})
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that does not flush the file after every record. Lines are kept in a buffer of buffer_size
+    bytes, which gets written when full, every flush_interval seconds from a background thread, and right away for
+    records of flush_level or higher. The size of the file is tracked instead of asked to the file, which would flush
+    it. Sizes are counted in characters.
+
+    :param filename: The log file.
+    :param max_bytes: Size at which the file is rotated. 0 never rotates it.
+    :param backup_count: Number of rotated files kept.
+    :param buffer_size: Size of the buffer, in bytes.
+    :param flush_interval: Maximum time, in seconds, a line waits in the buffer. 0 disables the background flushes.
+    :param flush_level: Records of this level or higher are flushed right away.
+    """
+    def __init__(self, filename, max_bytes: int = 0, backup_count: int = 0, buffer_size: int = 64 * 1024,
+                 flush_interval: float = 1.0, flush_level: int = logging.WARNING):
+        self.buffer_size = buffer_size
+        self.flush_level = flush_level
+        self._size = 0
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+        self.flush_interval = flush_interval
+        self._closed = threading.Event()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_periodically, name='BufferedRotatingFileHandler',
+                             daemon=True).start()
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding,
+                      errors=self.errors)
+        self._size = stream.seek(0, 2)
+        return stream
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self._size > 0 and self._size + len(msg) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(msg)
+            self._size += len(msg)
+            if record.levelno >= self.flush_level:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._closed.set()
+        super().close()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for a queue read by a QueueListener of the same process. The records of messages that are already a
+    string (like the f-strings used everywhere in this package) are queued as they are, instead of being formatted
+    and copied. The handlers of the listener format them anyway.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args or record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+def setup_logging(add_stream_handler=True, log_file=None, name='filechecker', stream_handler_level=logging.DEBUG,
+                  use_queue=False, max_bytes=0, backup_count=0, buffer_size=64 * 1024, flush_interval=1.0,
+                  file_format='text'):
+    """
+    Sets up the handlers of a logger. The log file has the format FILE_FORMAT, or one JSON object per line (see
+    JsonFormatter) if file_format is 'json'. log_reader detects which one a file uses.
+
+    With use_queue, the logger only puts its records in a queue and a QueueListener thread formats them and writes
+    them to the handlers, so the code logging never waits for the disk or the console. The file is then written by a
+    BufferedRotatingFileHandler (see its docstring for buffer_size and flush_interval). Call stop_logging to write
+    whatever is still queued; it is also called when the interpreter exits.
+
+    The level of the logger is set to stream_handler_level, so that logging calls below it return right away.
+
+    :param max_bytes: Size at which the log file is rotated. 0, the default, never rotates it.
+    :param backup_count: Number of rotated log files kept.
+    :param file_format: 'text' (the default) or 'json'.
+    """
     logger = logging.getLogger(name)
 
-    for h in logger.handlers:
+    stop_logging(name)
+    for h in list(logger.handlers):
         logger.removeHandler(h)
-        del h
+        h.close()
 
+    handlers = []
     if log_file is not None:
-        fmt = logging.Formatter(
-            "%(asctime)s\t| %(name)s\t| %(levelname)s\t| %(message)s",
-            datefmt='%Y-%m-%d %H:%M:%S',
-        )
-        fh = logging.FileHandler(log_file)
+        if file_format == 'json':
+            fmt = JsonFormatter()
+        elif file_format == 'text':
+            fmt = logging.Formatter(FILE_FORMAT, datefmt=FILE_DATE_FORMAT)
+        else:
+            raise ValueError(f'Unknown log file format: {file_format}')
+        if use_queue:
+            fh = BufferedRotatingFileHandler(log_file, max_bytes, backup_count, buffer_size, flush_interval)
+        elif max_bytes:
+            fh = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+        else:
+            fh = logging.FileHandler(log_file)
         fh.setFormatter(fmt)
         fh.setLevel(stream_handler_level)
-        logger.addHandler(fh)
+        handlers.append(fh)
 
     if add_stream_handler:
         fmt = logging.Formatter(
@@ -34,13 +161,47 @@ def setup_logging(add_stream_handler=True, log_file=None, name='filechecker', st
         stream_handler = logging.StreamHandler(sys.stderr)
         stream_handler.setFormatter(fmt)
         stream_handler.setLevel(stream_handler_level)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
+
+    logger.setLevel(stream_handler_level)
+    if use_queue:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
+        logger.addHandler(_QueueHandler(records))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
 
     logger.info(f"Logging set up for {name}.")
 
 
+def stop_logging(name='filechecker'):
+    """
+    Stops the QueueListener of a logger set up with use_queue, once it has written every queued record, and closes its
+    handlers. The logger is left without handlers. Does nothing for other loggers.
+    """
+    listener = _listeners.pop(name, None)
+    if listener is not None:
+        logger = logging.getLogger(name)
+        for h in list(logger.handlers):
+            if isinstance(h, logging.handlers.QueueHandler):
+                logger.removeHandler(h)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def _stop_all():
+    for name in list(_listeners):
+        stop_logging(name)
+
+
+# Registered after the logging module registers logging.shutdown, so it runs before it.
+atexit.register(_stop_all)
+
+
 def log_logger(name='filechecker'):
     """Get the (root) logger for the package."""
     return logging.getLogger(name)
-
-
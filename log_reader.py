@@ -4,77 +4,715 @@ Have the permissions the slack app needs to have so that this works.
 
 import os
 import re
+import json
 import time
+import glob
+import heapq
+import fnmatch
+import threading
+from collections import OrderedDict, deque
+from functools import partial
 import importlib.util
 from importlib.machinery import ModuleSpec
 from pathlib import Path
-from typing import Optional, Dict, Generator, Union, List
+from typing import Optional, Dict, Union, List, Tuple, NamedTuple, Callable, Set, Any, Deque
 
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileSystemEvent
+from watchdog.events import FileSystemEventHandler, FileSystemEvent, FileModifiedEvent
 
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from slack_sdk.web.client import SlackResponse
 
+import metrics
+from log import FILE_DATE_FORMAT
+from sinks import NotificationSink, JsonlFileSink, WebhookSink, MemorySink
+
 # TODO: Test what happens when different fields in the config file are not present.
 
+LINES_READ = metrics.counter('log_reader_lines_total', 'Log lines read from the tracked files.')
+LINES_UNPARSED = metrics.counter('log_reader_unparsed_lines_total', 'Log lines that did not follow the format.')
+MESSAGES_SUBMITTED = metrics.counter('log_reader_messages_total', 'Log lines with a configured level.')
+EVENT_SECONDS = metrics.histogram('log_reader_event_seconds', 'Time to read, parse and forward the lines of an event.')
+QUEUE_DEPTH = metrics.gauge('slack_queue_depth', 'Messages waiting to be posted to Slack.')
+POST_SECONDS = metrics.histogram('slack_post_seconds', 'Duration of the posts to Slack, retries included.')
+POST_RETRIES = metrics.counter('slack_post_retries_total', 'Posts to Slack retried after an error or rate limit.')
+POSTS_DROPPED = metrics.counter('slack_posts_dropped_total', 'Posts to Slack given up on.')
+CHECKPOINTS = metrics.counter('log_reader_checkpoints_total', 'Saves of the state file.')
+CATCH_UP_LINES = metrics.counter('log_reader_catch_up_lines_total', 'Backlog lines read when starting.')
+CATCH_UP_SUMMARIZED = metrics.counter('log_reader_catch_up_summarized_total',
+                                      'Backlog lines with a configured level sent in a summary instead of one by one.')
+
+# Levels from the most to the least severe, to pick where a summary of several levels goes.
+LEVELS = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
+
+
+class LogRecord(NamedTuple):
+    """
+    A parsed line of a log file.
+    """
+    time: float
+    asctime: str
+    name: str
+    level: str
+    message: str
+
+    def format(self) -> str:
+        """
+        Formats the record for sending it as a message.
+        """
+        return f'{self.asctime}: {self.level}: {self.message}'
+
+
+class LogLineParser:
+    """
+    Parses the lines written by the file handler of log.setup_logging, with the format
+    "%(asctime)s\\t| %(name)s\\t| %(levelname)s\\t| %(message)s". Lines are split with a single str.split and the
+    timestamp is decoded by fixed offsets when date_fmt is the default one. Timestamps get converted to epoch time once
+    per hour with time.mktime and cached, the minutes and seconds are added arithmetically. Other date formats fall
+    back to time.strptime, with a cache of the last timestamp.
+
+    :param date_fmt: The string format of the timestamps.
+    """
+    # Fields of the default date format: '%Y-%m-%d %H:%M:%S'.
+    _TIMESTAMP_LENGTH = 19
+
+    def __init__(self, date_fmt: str = FILE_DATE_FORMAT):
+        self.date_fmt = date_fmt
+        self._fixed = date_fmt == FILE_DATE_FORMAT
+        self._hours: Dict[str, float] = {}
+        self._last_asctime: Optional[str] = None
+        self._last_time = 0.0
+
+    def parse_time(self, asctime: str) -> float:
+        """
+        Converts a timestamp to epoch time.
+
+        :param asctime: The timestamp, following date_fmt.
+        :return: The time since the epoch, in seconds. Raises ValueError if the timestamp is not valid.
+        """
+        if asctime == self._last_asctime:
+            return self._last_time
+
+        if self._fixed and len(asctime) == self._TIMESTAMP_LENGTH and asctime[13] == ':' and asctime[16] == ':':
+            hour = asctime[:13]
+            hour_time = self._hours.get(hour)
+            if hour_time is None:
+                hour_time = time.mktime((int(asctime[0:4]), int(asctime[5:7]), int(asctime[8:10]),
+                                         int(asctime[11:13]), 0, 0, 0, 0, -1))
+                if len(self._hours) > 1024:
+                    self._hours.clear()
+                self._hours[hour] = hour_time
+            line_time = hour_time + int(asctime[14:16]) * 60 + int(asctime[17:19])
+        else:
+            line_time = time.mktime(time.strptime(asctime, self.date_fmt))
+
+        self._last_asctime = asctime
+        self._last_time = line_time
+        return line_time
+
+    def parse(self, line: str) -> Optional[LogRecord]:
+        """
+        Parses a single line.
+
+        :param line: The line, without its newline character.
+        :return: The record, or None if the line does not follow the format.
+        """
+        sections = line.split('|', 3)
+        if len(sections) < 4:
+            return None
+        asctime = sections[0].strip()
+        try:
+            line_time = self.parse_time(asctime)
+        except (ValueError, OverflowError):
+            return None
+        message = sections[3]
+        if message[:1] == ' ':
+            message = message[1:]
+        return LogRecord(line_time, asctime, sections[1].strip(), sections[2].strip(), message)
+
+
+class JsonLineParser:
+    """
+    Parses the lines written by the file handler of log.setup_logging with file_format='json': one JSON object per
+    line with the keys 'time' (epoch seconds), 'name', 'level' and 'message'. The timestamp is formatted with date_fmt
+    for the messages once per second, not once per line.
+
+    :param date_fmt: The string format of the timestamps in the messages.
+    """
+    def __init__(self, date_fmt: str = FILE_DATE_FORMAT):
+        self.date_fmt = date_fmt
+        self._decode = json.JSONDecoder().decode
+        self._last_second: Optional[int] = None
+        self._last_asctime = ''
+
+    def parse(self, line: str) -> Optional[LogRecord]:
+        """
+        Parses a single line.
+
+        :param line: The line, without its newline character.
+        :return: The record, or None if the line is not a JSON record.
+        """
+        try:
+            data = self._decode(line)
+            line_time = data['time']
+            second = int(line_time)
+            if second != self._last_second:
+                self._last_asctime = time.strftime(self.date_fmt, time.localtime(second))
+                self._last_second = second
+            return LogRecord(line_time, self._last_asctime, data['name'], data['level'], data['message'])
+        except (ValueError, KeyError, TypeError, OverflowError):
+            return None
+
+
+def detect_parser(lines: List[str], date_fmt: str = FILE_DATE_FORMAT) -> Optional[Union[LogLineParser,
+                                                                                         JsonLineParser]]:
+    """
+    Picks the parser for the format of a file from its first non-empty line: JSON records start with '{', anything
+    else is taken as the text format.
+
+    :param lines: Lines read from the file.
+    :param date_fmt: The string format of the timestamps.
+    :return: A new parser, or None if every line is empty.
+    """
+    for line in lines:
+        if line.strip():
+            return JsonLineParser(date_fmt) if line.lstrip().startswith('{') else LogLineParser(date_fmt)
+    return None
+
+
+def load_state(path: Optional[Path]) -> Dict[str, Tuple[int, int, Optional[float]]]:
+    """
+    Loads the saved reading positions of the tracked files.
+
+    :param path: The path of the state file. If None or if the file does not exist, an empty state is returned.
+    :return: Dictionary with the tracked files as keys, and tuples with their inode, the offset up to which they
+        have been read and the last time they were updated as values. The time is None in state files saved before
+        it was recorded.
+    """
+    if path is None or not path.is_file():
+        return {}
+    try:
+        with open(path) as f:
+            return {file: (int(entry[0]), int(entry[1]), float(entry[2]) if len(entry) > 2 else None)
+                    for file, entry in json.load(f).items()}
+    except (ValueError, TypeError, IndexError) as e:
+        print(f'Error: state file {path} could not be read, starting from scratch: {e}')
+        return {}
+
+
+def save_state(path: Path, state: Dict[str, Tuple], sync: bool = False) -> None:
+    """
+    Saves the reading positions of the tracked files atomically: the state is written to a temporary file that then
+    replaces the state file, so a crash never leaves a half written state behind.
+
+    :param path: The path of the state file.
+    :param state: Dictionary with the tracked files as keys, and tuples with their inode, offset and, optionally, last
+        update time as values.
+    :param sync: If True, the temporary file is fsynced before replacing the state file, so that the new state
+        survives a crash of the machine too.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def iter_tracked_files(config: dict) -> List[str]:
+    """
+    Gets the files of config['files'] that would be tracked right now: the files given by name and the existing files
+    matching the patterns.
+    """
+    files = []
+    for file in config['files']:
+        if glob.has_magic(os.path.basename(file)):
+            files.extend(sorted(glob.glob(file)))
+        else:
+            files.append(file)
+    return files
+
+
+def current_offsets(config: dict) -> Dict[str, Tuple[int, int]]:
+    """
+    Gets the inode and size of the tracked files that exist, to be passed as the initial_offsets of a
+    LogReaderEventHandler created later.
+    """
+    offsets = {}
+    for file in iter_tracked_files(config):
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            continue
+        offsets[file] = (st.st_ino, st.st_size)
+    return offsets
+
+
+def normalize_path(path: str) -> str:
+    """
+    Gets the form of a path used to compare it with others: absolute, normalized and, on Windows, lowercase.
+    """
+    return os.path.normcase(os.path.abspath(path))
+
+
+class SlackDispatcher:
+    """
+    Sends messages to Slack from a background thread, so that whoever submits a message never waits for the network.
+
+    Pending messages are kept per channel. Every post takes all the messages pending for a channel, in order, and
+    joins them into a single message (up to max_chars characters, the rest waits for the next post). Posts to the same
+    channel are spaced by at least min_interval seconds, the rate limit Slack applies to chat.postMessage. When Slack
+    answers with a rate limit error, no post is made until its Retry-After time has passed. Other errors from the
+    network or from Slack's servers are retried with exponential backoff, up to max_retries times. A channel Slack does
+    not find is looked up again with relookup, if given, and the messages pending for it move to the new id.
+
+    If resolve is given, messages are submitted with whatever it takes (e.g. the name of the channel) instead of the id
+    of the channel, and resolve gets called from the background thread, so that looking the names up in Slack does not
+    make the caller wait either.
+
+    :param client: The Slack client used to post the messages.
+    :param min_interval: Minimum time, in seconds, between two posts to the same channel.
+    :param max_chars: Maximum length of a post made by joining several messages.
+    :param max_retries: Number of times a failed post is retried before dropping it.
+    :param backoff: Wait, in seconds, before the first retry. Doubles with every retry.
+    :param relookup: Optional function called with the id of a channel that was not found. Returns the id to post to
+        instead, or None to drop the messages.
+    :param resolve: Optional function called with the channel and the text of every submitted message. Returns the id
+        of the channel and the text to post, or None to drop the message.
+    """
+    def __init__(self, client: WebClient, min_interval: float = 1.0, max_chars: int = 3500, max_retries: int = 5,
+                 backoff: float = 1.0, relookup: Optional[Callable[[str], Optional[str]]] = None,
+                 resolve: Optional[Callable[[Any, str], Optional[Tuple[str, str]]]] = None):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_chars = max_chars
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.relookup = relookup
+        self.resolve = resolve
+
+        self._condition = threading.Condition()
+        # Messages waiting for resolve, in order.
+        self._incoming: Deque[Tuple[Any, str]] = deque()
+        self._resolving = False
+        # Channel id -> messages waiting to be posted, in order.
+        self._pending: Dict[str, List[str]] = {}
+        # Channel id -> monotonic time of the earliest next post.
+        self._next_post: Dict[str, float] = {}
+        self._blocked_until = 0.0
+        self._posting = False
+        self._stopping = False
+
+        self._thread = threading.Thread(target=self._run, name='SlackDispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, channel: Any, text: str) -> None:
+        """
+        Queues a message. Returns immediately.
+
+        :param channel: The id of the channel to post to, or what resolve takes if it was given.
+        :param text: The message.
+        """
+        with self._condition:
+            if self.resolve is None:
+                self._pending.setdefault(channel, []).append(text)
+            else:
+                self._incoming.append((channel, text))
+            QUEUE_DEPTH.inc()
+            self._condition.notify()
 
-def reverse_readline(filename, buf_size=8192) -> Generator:
-    """A generator that returns the lines of a file in reverse order
-
-    taken from: https://stackoverflow.com/questions/2301789/how-to-read-a-file-in-reverse-order
-    """
-    with open(filename) as fh:
-        segment = None
-        offset = 0
-        fh.seek(0, os.SEEK_END)
-        file_size = remaining_size = fh.tell()
-        while remaining_size > 0:
-            offset = min(file_size, offset + buf_size)
-            fh.seek(file_size - offset)
-            buffer = fh.read(min(remaining_size, buf_size))
-            remaining_size -= buf_size
-            lines = buffer.split('\n')
-            # The first line of the buffer is probably not a complete line so
-            # we'll save it and append it to the last line of the next buffer
-            # we read
-            if segment is not None:
-                # If the previous chunk starts right from the beginning of line
-                # do not concat the segment to the last line of new chunk.
-                # Instead, yield the segment first
-                if buffer[-1] != '\n':
-                    lines[-1] += segment
+    def pending(self) -> int:
+        """
+        Number of messages waiting to be posted.
+        """
+        with self._condition:
+            return len(self._incoming) + sum(len(messages) for messages in self._pending.values())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every queued message has been posted (or dropped).
+
+        :param timeout: Maximum time to wait, in seconds. None waits forever.
+        :return: True if everything was posted, False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._incoming and not self._resolving
+                                            and not self._posting, timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Posts everything that is still queued and stops the background thread.
+
+        :param timeout: Maximum time to wait for the queued messages, in seconds. None waits forever.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _take_ready(self) -> Optional[Tuple[str, str]]:
+        """
+        Takes the next post to make, if any channel is ready. Must be called with the condition held.
+
+        :return: A tuple with the channel id and the text of the post, or None.
+        """
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return None
+        for channel_id, messages in self._pending.items():
+            if self._next_post.get(channel_id, 0.0) > now:
+                continue
+            text = messages[0]
+            taken = 1
+            while taken < len(messages) and len(text) + 1 + len(messages[taken]) <= self.max_chars:
+                text = text + '\n' + messages[taken]
+                taken += 1
+            if taken == len(messages):
+                del self._pending[channel_id]
+            else:
+                del messages[:taken]
+            QUEUE_DEPTH.dec(taken)
+            return channel_id, text
+        return None
+
+    def _next_wake_up(self) -> Optional[float]:
+        """
+        Time to wait until some pending channel is ready. Must be called with the condition held.
+        """
+        if not self._pending:
+            return None
+        now = time.monotonic()
+        ready_at = min(self._next_post.get(channel_id, 0.0) for channel_id in self._pending)
+        return max(ready_at, self._blocked_until) - now
+
+    def _resolve_incoming(self) -> None:
+        """
+        Resolves the submitted messages one by one, without holding the condition, and adds them to the pending ones.
+        """
+        while True:
+            with self._condition:
+                if not self._incoming:
+                    return
+                channel, text = self._incoming.popleft()
+                self._resolving = True
+
+            resolved = self.resolve(channel, text)
+            with self._condition:
+                self._resolving = False
+                if resolved is None:
+                    QUEUE_DEPTH.dec()
                 else:
-                    yield segment
-            segment = lines[0]
-            for index in range(len(lines) - 1, 0, -1):
-                if lines[index]:
-                    yield lines[index]
-        # Don't yield None if the file was empty
-        if segment is not None:
-            yield segment
+                    self._pending.setdefault(resolved[0], []).append(resolved[1])
+                self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            self._resolve_incoming()
+            with self._condition:
+                post = self._take_ready()
+                while post is None and not self._incoming:
+                    if self._stopping and not self._pending:
+                        return
+                    self._condition.wait(self._next_wake_up())
+                    post = self._take_ready()
+                if post is None:
+                    continue
+                self._posting = True
+
+            channel_id, text = post
+            with POST_SECONDS.time():
+                self._post(channel_id, text)
+            with self._condition:
+                self._next_post[channel_id] = time.monotonic() + self.min_interval
+                self._posting = False
+                self._condition.notify_all()
+
+    def _post(self, channel_id: str, text: str) -> Optional[SlackResponse]:
+        """
+        Posts a message, waiting and retrying on rate limits and on transient errors.
+        """
+        attempt = 0
+        rate_limited = 0
+        relooked = False
+        while True:
+            try:
+                return self.client.chat_postMessage(channel=channel_id, text=text)
+            except SlackApiError as e:
+                status = e.response.status_code
+                if e.response.get('error') == 'channel_not_found' and self.relookup is not None and not relooked:
+                    relooked = True
+                    new_id = self.relookup(channel_id)
+                    if new_id is not None and new_id != channel_id:
+                        with self._condition:
+                            moved = self._pending.pop(channel_id, None)
+                            if moved is not None:
+                                self._pending.setdefault(new_id, []).extend(moved)
+                        channel_id = new_id
+                        continue
+                if status == 429 and rate_limited < 4 * self.max_retries:
+                    headers = {key.lower(): value for key, value in e.response.headers.items()}
+                    retry_after = float(headers.get('retry-after', self.backoff))
+                    with self._condition:
+                        self._blocked_until = time.monotonic() + retry_after
+                    time.sleep(retry_after)
+                    rate_limited += 1
+                    POST_RETRIES.inc()
+                    continue
+                if status < 500:
+                    print(f'Error: {e}')
+                    POSTS_DROPPED.inc()
+                    return None
+                error: Exception = e
+            except OSError as e:
+                error = e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                print(f'Error: message to {channel_id} dropped after {self.max_retries} retries: {error}')
+                POSTS_DROPPED.inc()
+                return None
+            POST_RETRIES.inc()
+            time.sleep(self.backoff * 2 ** (attempt - 1))
 
 
-class SlackCommunicator:
+class SlackDirectory:
     """
-    Object in charge of sending messages to slack. Used to send messages from other objects.
+    Maps user and channel names of the Slack workplace to their ids, without downloading the whole workplace up front.
+
+    Names are looked up lazily: when a name is not cached, the users or channels get listed page by page with cursor
+    pagination, caching every entry seen, and the listing stops as soon as the name is found. Names that are not found
+    after a complete listing are remembered as missing for miss_ttl seconds so they do not trigger a listing on every
+    message. The cache is saved to disk, so a restart with a warm cache does not make any API calls.
+
+    Every entry keeps the time it was last seen in a listing. Entries older than ttl seconds are dropped when the cache
+    is loaded and looked up again when needed. Entries Slack no longer knows about can also be dropped with forget.
+
+    :param client: The Slack client.
+    :param cache_path: Optional path of the file where the cache is saved.
+    :param ttl: Time, in seconds, an entry is valid for. Default, one day.
+    :param miss_ttl: Time, in seconds, a name not found is remembered as missing.
+    :param page_size: Number of entries requested per page.
     """
+    # Kind -> (client method, key of the entries in the response).
+    _KINDS = {'users': ('users_list', 'members'), 'channels': ('conversations_list', 'channels')}
+
+    def __init__(self, client: WebClient, cache_path: Optional[Path] = None, ttl: float = 24 * 3600,
+                 miss_ttl: float = 300, page_size: int = 200):
+        self.client = client
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.page_size = page_size
 
-    def __init__(self, config: dict):
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, str]] = {'users': {}, 'channels': {}}
+        # Kind -> name -> time (time.time) the entry was last seen in a listing.
+        self.listed: Dict[str, Dict[str, float]] = {'users': {}, 'channels': {}}
+        self._missing: Dict[Tuple[str, str], float] = {}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Loads the cache from disk, if it exists, leaving out the entries older than ttl.
         """
-        Constructor for SlackCommunicator.
+        if self.cache_path is None or not self.cache_path.is_file():
+            return
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            now = time.time()
+            for kind in self._KINDS:
+                listed = cache.get('listed', {}).get(kind, {})
+                self.entries[kind] = {name: id for name, id in cache[kind].items()
+                                      if now - listed.get(name, 0) < self.ttl}
+                self.listed[kind] = {name: listed[name] for name in self.entries[kind]}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f'Error: Slack cache {self.cache_path} could not be read: {e}')
 
-        :param config: The complete configuration dictionary taken from the configuration file.
+    def save(self) -> None:
         """
-        self.config = config
-        self.client = WebClient(token=config['token'])
+        Saves the cache to disk atomically.
+        """
+        if self.cache_path is None:
+            return
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({**self.entries, 'listed': self.listed}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _pages(self, kind: str):
+        """
+        Lists the users or channels page by page, retrying when rate limited.
+
+        :return: A generator with the entries of every page.
+        """
+        method, key = self._KINDS[kind]
+        cursor = None
+        while True:
+            for attempt in range(5):
+                try:
+                    response = getattr(self.client, method)(cursor=cursor, limit=self.page_size)
+                    break
+                except SlackApiError as e:
+                    if e.response.status_code != 429 or attempt == 4:
+                        raise
+                    headers = {k.lower(): v for k, v in e.response.headers.items()}
+                    time.sleep(float(headers.get('retry-after', 1)))
+            yield response[key]
+            cursor = (response.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return
+
+    def refresh(self, kind: str, name: Optional[str] = None) -> Optional[str]:
+        """
+        Lists the users or channels, updating the cache.
+
+        :param kind: 'users' or 'channels'.
+        :param name: If given, the listing stops as soon as this name is found.
+        :return: The id of name, None if it was not found or not given.
+        """
+        found = None
+        entries = self.entries[kind]
+        listed = self.listed[kind]
+        now = time.time()
+        for page in self._pages(kind):
+            for entry in page:
+                entries[entry['name']] = entry['id']
+                listed[entry['name']] = now
+                if entry['name'] == name:
+                    found = entry['id']
+            if found is not None:
+                break
+        self.save()
+        return found
+
+    def lookup(self, kind: str, name: str) -> Optional[str]:
+        """
+        Gets the id of a user or channel, listing them from Slack only if the name is not cached or its entry is older
+        than ttl.
+
+        :param kind: 'users' or 'channels'.
+        :param name: The name of the user or channel.
+        :return: The id, None if there is no user or channel with that name.
+        """
+        with self._lock:
+            found = self.entries[kind].get(name)
+            if found is not None and time.time() - self.listed[kind].get(name, 0) < self.ttl:
+                return found
+            missing_since = self._missing.get((kind, name))
+            if missing_since is not None and time.monotonic() - missing_since < self.miss_ttl:
+                return None
+
+            found = self.refresh(kind, name)
+            if found is None:
+                self.entries[kind].pop(name, None)
+                self.listed[kind].pop(name, None)
+                self._missing[(kind, name)] = time.monotonic()
+            return found
+
+    def forget(self, kind: str, id: str) -> List[str]:
+        """
+        Drops the cached entries of an id, for example one that Slack answered was not found, so that the next lookup
+        of their names lists them again.
+
+        :param kind: 'users' or 'channels'.
+        :param id: The id to forget.
+        :return: The names that had that id.
+        """
+        with self._lock:
+            entries = self.entries[kind]
+            names = [name for name, entry_id in entries.items() if entry_id == id]
+            for name in names:
+                del entries[name]
+                self.listed[kind].pop(name, None)
+            return names
+
+    def relookup(self, kind: str, id: str) -> Optional[str]:
+        """
+        Forgets an id that Slack answered was not found (for a channel, renamed or deleted and created again) and looks
+        its name up again.
+
+        :param kind: 'users' or 'channels'.
+        :param id: The id that was not found.
+        :return: The new id, None if the name is not found.
+        """
+        for name in self.forget(kind, id):
+            try:
+                return self.lookup(kind, name)
+            except SlackApiError as e:
+                print(f'Error: {e}')
+        return None
+
+    def resolve(self, message_config: dict, message: str) -> Optional[Tuple[str, str]]:
+        """
+        Looks up the channel of a message and the users it tags, listing them from Slack if they are not cached.
+
+        :param message_config: The config dictionary of the message, see SlackCommunicator.send_message.
+        :param message: The string to send.
+        :return: A tuple with the id of the channel and the message with the tags. None if the channel is not found.
+        """
+        try:
+            channel_id = self.channel_id(message_config['channel'])
+        except SlackApiError as e:
+            print(f'Error: {e}')
+            return None
+        if channel_id is None:
+            print(f'Error: channel {message_config["channel"]} not found, message not sent: {message}')
+            return None
+
+        if 'tag' in message_config:
+            tags_str = ''
+            for user in message_config['tag']:
+                if user == 'all':
+                    tags_str = tags_str + '<!channel>, '
+                    continue
+                try:
+                    user_id = self.user_id(user)
+                except SlackApiError as e:
+                    user_id = None
+                    print(f'Error: {e}')
+                if user_id is None:
+                    print(f'Error: user {user} not found, not tagging it.')
+                else:
+                    tags_str = tags_str + f'<@{user_id}>, '
+            message = tags_str + message
+        return channel_id, message
+
+    def user_id(self, name: str) -> Optional[str]:
+        return self.lookup('users', name)
+
+    def channel_id(self, name: str) -> Optional[str]:
+        return self.lookup('channels', name)
 
-        self.users: Dict[str, str] = {}
-        self.channels: Dict[str, str] = {}
 
-        self.load_users()
-        self.load_channels()
+class SlackCommunicator(NotificationSink):
+    """
+    Object in charge of sending messages to slack. Used to send messages from other objects.
+    """
+
+    def __init__(self, config: dict, asynchronous: bool = True, client: Optional[WebClient] = None,
+                 cache_path: Optional[Path] = None):
+        """
+        Constructor for SlackCommunicator. Users and channels are not downloaded up front, they are looked up the first
+        time they are needed through a SlackDirectory.
+
+        :param config: The complete configuration dictionary taken from the configuration file.
+        :param asynchronous: If True (the default), messages are queued in a SlackDispatcher and send_message
+            returns immediately, the names of the channels and users being looked up by the dispatcher thread. If
+            False, send_message looks them up and posts the message itself, waiting for the responses.
+        :param client: Optional Slack client to use instead of creating one with the token in the config.
+        :param cache_path: Optional path of the file where the ids of users and channels are cached.
+        """
+        self.closed = True
+        super().__init__(config)
+        self.client = client if client is not None else WebClient(token=config['token'])
+        self.directory = SlackDirectory(self.client, cache_path, ttl=config.get('slack_cache_ttl', 24) * 3600)
+        # The dispatcher only gets functions of the directory, so that it does not keep the communicator alive.
+        self.dispatcher = SlackDispatcher(self.client, relookup=partial(self.directory.relookup, 'channels'),
+                                          resolve=self.directory.resolve) if asynchronous else None
+        self.closed = False
 
         self.send_message(":robot_face: _beep boop_ :robot_face: ENGAGED :robot_face: _beep boop_ :robot_face:")
 
@@ -82,31 +720,47 @@ class SlackCommunicator:
         """
         Sends closing message to slack.
         """
+        self.close()
+
+    def close(self) -> None:
+        """
+        Sends every queued message and the closing message to slack.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
         self.send_message(':skull: _boop beep_ :skull: DISENGAGED :skull: _boop beep_ :skull:')
 
+    @property
+    def users(self) -> Dict[str, str]:
+        """
+        The cached users, mapping their names to their ids.
+        """
+        return self.directory.entries['users']
+
+    @property
+    def channels(self) -> Dict[str, str]:
+        """
+        The cached channels, mapping their names to their ids.
+        """
+        return self.directory.entries['channels']
+
     def load_users(self) -> None:
         """
-        Goes through all the users in the Slack workplace and creates a dictionary mapping the users name to their ids.
+        Goes through all the users in the Slack workplace and caches their ids.
         Raises a SlackApiError if there is an error trying to get the users.
         """
-        try:
-            for result in self.client.users_list():
-                for user in result['members']:
-                    self.users[user['name']] = user['id']
-        except SlackApiError as e:
-            raise e
+        self.directory.refresh('users')
 
     def load_channels(self) -> None:
         """
-        Goes through all the channels in the Slack workplace and creates a dictionary mapping the users name to their ids.
+        Goes through all the channels in the Slack workplace and caches their ids.
         Raises a SlackApiError if there is an error trying to get the channels.
         """
-        try:
-            for result in self.client.conversations_list():
-                for channel in result["channels"]:
-                    self.channels[channel["name"]] = channel['id']
-        except SlackApiError as e:
-            raise e
+        self.directory.refresh('channels')
 
     def send_message(self, message: str, message_config: Optional[dict] = None) -> \
             Optional[SlackResponse]:
@@ -117,20 +771,32 @@ class SlackCommunicator:
         :param message_config: Optional config dictionary. This dictionary should have the field 'channel' with the
             channel name to which to send the message. It can also have the field 'tag' with a list of users names that
             should be tagged in the message. If 'all' is in the tag list, the channel itself will be tagged.
-        :return: The response from Slack after sending the message.
+        :return: The response from Slack after sending the message. None if the message was queued or if there was an
+            error.
         """
         if message_config is None:
             message_config = self.config['status']
+        if self.dispatcher is not None:
+            # The names get looked up by the dispatcher thread, so the caller never waits for Slack.
+            self.dispatcher.submit(message_config, message)
+            return None
 
-        channel_id = self.channels[message_config['channel']]
-        if 'tag' in message_config:
-            tags_str = ''
-            for user in message_config['tag']:
-                if user == 'all':
-                    tags_str = tags_str + '<!channel>, '
-                else:
-                    tags_str = tags_str + f'<@{self.users[user]}>, '
-            message = tags_str + message
+        resolved = self.directory.resolve(message_config, message)
+        if resolved is None:
+            return None
+        channel_id, message = resolved
+        try:
+            return self.client.chat_postMessage(channel=channel_id, text=message, )
+        except SlackApiError as e:
+            print(f'Error: {e}')
+            if e.response.get('error') != 'channel_not_found':
+                return None
+
+        # The channel was renamed, or deleted and created again. Look it up and try once more.
+        channel_id = self.directory.relookup('channels', channel_id)
+        if channel_id is None:
+            print(f'Error: channel {message_config["channel"]} not found, message not sent: {message}')
+            return None
         try:
             return self.client.chat_postMessage(channel=channel_id, text=message, )
         except SlackApiError as e:
@@ -138,30 +804,494 @@ class SlackCommunicator:
             return None
 
 
+class _Repeats:
+    """
+    State of a message being aggregated.
+    """
+    __slots__ = ('start', 'count', 'record')
+
+    def __init__(self, start: float, record: LogRecord):
+        self.start = start
+        self.count = 0
+        self.record = record
+
+
+class MessageAggregator:
+    """
+    Sits between the parsing of the log lines and the SlackCommunicator to suppress repeated messages.
+
+    Messages are fingerprinted by their level, module name and text with the numbers replaced, so that "timeout after
+    3 s" and "timeout after 5 s" count as the same message. The first message of a fingerprint is sent right away and
+    opens a window; repetitions within the window are only counted. Once the window is over, a single summary saying
+    how many times the message was repeated is sent.
+
+    Windows are configured per level with the key 'dedup_window', in seconds, of the level sections of the config
+    dictionary. Levels without it are not aggregated. The number of fingerprints tracked at the same time is bounded:
+    when full, the least recently seen one is closed early, sending its summary. The ends of the windows are kept in a
+    min-heap, so flush_expired only looks at the windows that are over.
+
+    :param config: The complete configuration dictionary taken from the configuration file. The optional key
+        'dedup_max_entries' sets the maximum number of fingerprints tracked (default 10000).
+    :param communicator: The sink the messages and summaries are sent through.
+    :param clock: Function returning the current time, in seconds.
+    """
+    _NUMBERS = re.compile(r'0x[0-9a-fA-F]+|\d+(?:\.\d+)?')
+
+    def __init__(self, config: dict, communicator: NotificationSink, clock=time.monotonic):
+        self.config = config
+        self.communicator = communicator
+        self.clock = clock
+        self.max_entries = config.get('dedup_max_entries', 10000)
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str, str], _Repeats]' = OrderedDict()
+        # Heap of (end, sequence number, key, entry) with one item per window opened. Items of windows that were
+        # closed early or replaced are dropped when they get to the top.
+        self._ends: List[Tuple[float, int, Tuple[str, str, str], _Repeats]] = []
+        self._sequence = 0
+        # Optional function called when a window opens that ends before every other open window, so that whoever
+        # calls flush_expired can wake up earlier.
+        self.on_deadline: Optional[Callable[[], None]] = None
+
+    def fingerprint(self, record: LogRecord) -> Tuple[str, str, str]:
+        """
+        Gets the key identifying repetitions of a message.
+        """
+        return record.level, record.name, self._NUMBERS.sub('#', record.message)
+
+    def submit(self, record: LogRecord) -> None:
+        """
+        Sends a message unless it is a repetition within its window.
+
+        :param record: The parsed log line. Its level must be in the config.
+        """
+        level_config = self.config[record.level]
+        window = level_config.get('dedup_window')
+        if not window:
+            self.communicator.send_message(record.format(), level_config)
+            return
+
+        key = self.fingerprint(record)
+        now = self.clock()
+        summaries = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.start < window:
+                entry.count += 1
+                self._entries.move_to_end(key)
+                return
+
+            if entry is not None:
+                summaries.append((entry, now))
+            entry = self._entries[key] = _Repeats(now, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                summaries.append((evicted, now))
+            self._sequence += 1
+            heapq.heappush(self._ends, (now + window, self._sequence, key, entry))
+            earliest = self._ends[0][3] is entry
+            if len(self._ends) > 2 * len(self._entries) + 64:
+                self._ends = [item for item in self._ends if self._entries.get(item[2]) is item[3]]
+                heapq.heapify(self._ends)
+
+        if earliest and self.on_deadline is not None:
+            self.on_deadline()
+        self.communicator.send_message(record.format(), level_config)
+        for entry, end in summaries:
+            self._send_summary(entry, end)
+
+    def flush_expired(self) -> Optional[float]:
+        """
+        Sends the summaries of every window that is over.
+
+        :return: Seconds until the next open window ends, None if there are no open windows.
+        """
+        now = self.clock()
+        expired = []
+        with self._lock:
+            while self._ends:
+                end, _, key, entry = self._ends[0]
+                if self._entries.get(key) is not entry:
+                    heapq.heappop(self._ends)
+                elif end <= now:
+                    heapq.heappop(self._ends)
+                    del self._entries[key]
+                    expired.append(entry)
+                else:
+                    break
+            next_end = self._ends[0][0] if self._ends else None
+        for entry in expired:
+            self._send_summary(entry, now)
+        return None if next_end is None else next_end - now
+
+    def flush_all(self) -> None:
+        """
+        Closes every open window, sending the summaries of the ones with repetitions, so that none is lost on
+        shutdown.
+        """
+        now = self.clock()
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._ends = []
+        for entry in entries:
+            self._send_summary(entry, now)
+
+    def _send_summary(self, entry: _Repeats, end: float) -> None:
+        if entry.count == 0:
+            return
+        record = entry.record
+        self.communicator.send_message(
+            f'{record.format()} (repeated {entry.count} times in the last {end - entry.start:.0f} seconds)',
+            self.config[record.level])
+
+
 class LogReaderEventHandler(FileSystemEventHandler):
     """
     Custom event handler for watchdog. When a modified file gets triggered, checks that the modified file is in the
     config dictionary and reports updates of new lines in slack depending on the configuration.
-    Any lines that have been written before initializing this object will not be reported.
+
+    For every tracked file the handler keeps its inode and the byte offset up to which it has been read, and only
+    reads the bytes appended after that offset. A file whose inode changes (rotated) or that gets smaller than the
+    offset (truncated) is read again from the start. Files without a saved offset start at their current end (or at
+    their initial offset, if given): any lines that have been written before will not be reported.
+
+    If a state file is given, the offsets and the last update times are checkpointed in it, so that after a restart the
+    lines written while the handler was not running get reported too (see catch_up). Checkpoints are batched: the
+    state is saved, and fsynced, right after the first change and then at most once every 'checkpoint_interval'
+    seconds of the config (default 1). Call checkpoint regularly, LogWatcher does, so that the last changes get saved.
+
+    Offsets are checkpointed once their lines have been handed to the communicator, not once the messages have been
+    posted. With an asynchronous communicator (or repetitions counted in an aggregation window), a crash loses the
+    messages that were still waiting to be sent: their delivery is at most once. Lines read since the last checkpoint
+    are reported again after a crash. LogWatcher closes the communicator, sending its queue, before the last
+    checkpoint.
     """
 
-    def __init__(self, config: dict, communicator: SlackCommunicator, date_fmt: str = '%Y-%m-%d %H:%M:%S'):
+    def __init__(self, config: dict, communicator: NotificationSink, date_fmt: str = FILE_DATE_FORMAT,
+                 state_path: Optional[Path] = None, initial_offsets: Optional[Dict[str, Tuple[int, int]]] = None):
         """
         Constructor for LogReaderEventHandler.
 
         :param config: The complete configuration dictionary taken from the configuration file.
-        :param communicator: An instance of SlackCommunicator.
+        :param communicator: The sink messages are sent to, usually a SlackCommunicator.
         :param date_fmt: The string format of the date format. Default, '%Y-%m-%d %H:%M:%S'.
+        :param state_path: Optional path of the file where the reading offsets are saved.
+        :param initial_offsets: Optional offsets, from current_offsets, for the files without a saved offset. Used to
+            start from where the files were before a slow start up instead of from their current end.
         """
         super().__init__()
         self.config = config
         self.communicator = communicator
 
         self.date_fmt = date_fmt
+        # Dictionary with the tracked files as keys, and the parser for their format as values. The format of a file
+        # is detected from the first lines read from it, and again after it gets rotated.
+        self.parsers: Dict[str, Union[LogLineParser, JsonLineParser]] = {}
+        self.aggregator = MessageAggregator(config, communicator)
+        # Optional function called when whoever runs the deadlines has something new to schedule: the first change
+        # waiting for a checkpoint or an aggregation window ending before the others. Plain updates of tracked files
+        # do not call it.
+        self.on_update: Optional[Callable[[], None]] = None
+        self.aggregator.on_deadline = self._notify
+        self.state_path = state_path
+
+        # Dictionary with the tracked files as keys, and the last time they were modified as values.
+        # Gets created with current time.
+        self.files: Dict[str, float] = {}
+        # Dictionary with the tracked files as keys, and their entry of config['files'] as values.
+        self.file_configs: Dict[str, dict] = {}
+        # Dictionary with the tracked files as keys, and the key of their entry in config['files'] as values.
+        self.config_keys: Dict[str, str] = {}
+        # Dictionary with the keys of config['files'] as keys, and the last time any of their files was modified as
+        # values. Periods apply to these, so a pattern gets a single deadline whatever the number of files matching it.
+        self.updates: Dict[str, float] = {}
+        # Dictionary with the tracked files as keys, and tuples with their inode and read offset as values.
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        # Tracked files that matched a pattern. They stop being tracked when they are deleted or moved away.
+        self.matched: Set[str] = set()
+
+        # Index of the tracked files by their normalized path, which is what events are looked up with.
+        self._index: Dict[str, str] = {}
+        # Dictionary with the normalized directories of the patterns as keys, and lists of tuples with the normalized
+        # file name pattern and its key in config['files'] as values.
+        self.patterns: Dict[str, List[Tuple[str, str]]] = {}
+        # Dictionary with the normalized directories to watch as keys, and the directories as values.
+        self.directories: Dict[str, str] = {}
 
-        # Dictionary with the tracked files as keys, and their last reported lines time as values.
-        # Used to know when to stop reading the file. Gets created with current time.
-        self.files = {x: time.time() for x in config['files'].keys()}
+        self.checkpoint_interval = config.get('checkpoint_interval', 1.0)
+        # The first checkpoint records where the files without a saved offset started.
+        self._dirty = state_path is not None
+        # Set once on_update has been told about a pending checkpoint, until it gets saved.
+        self._checkpoint_notified = False
+        self._next_checkpoint = 0.0
+        self._state_lock = threading.Lock()
+
+        self._saved = load_state(state_path)
+        self._initial_offsets = initial_offsets if initial_offsets is not None else {}
+        for file, file_conf in config['files'].items():
+            directory, name = os.path.split(file)
+            directory = directory or '.'
+            self.directories[normalize_path(directory)] = directory
+            if glob.has_magic(name):
+                self.patterns.setdefault(normalize_path(directory), []).append((os.path.normcase(name), file))
+                for path in sorted(glob.glob(file)):
+                    self.track(path, file)
+            else:
+                self.track(file, file)
+            if file not in self.updates:
+                # A pattern without any file yet.
+                self.updates[file] = time.time()
+
+    def track(self, path: str, key: str, new: bool = False) -> str:
+        """
+        Starts tracking a file.
+
+        :param path: The file.
+        :param key: Its key in config['files'], the file itself or the pattern it matched.
+        :param new: True if the file appeared after the constructor. New files are read from the start, files that
+            existed already from their current end, unless the state file has an offset for them.
+        :return: The path.
+        """
+        self._index[normalize_path(path)] = path
+        self.file_configs[path] = self.config['files'][key]
+        self.config_keys[path] = key
+        if path != key:
+            self.matched.add(path)
+        saved = self._saved.get(path)
+        self.files[path] = saved[2] if saved is not None and saved[2] is not None else time.time()
+        self.updates[key] = max(self.updates.get(key, 0.0), self.files[path])
+        if saved is not None:
+            self.offsets[path] = saved[:2]
+        elif path in self._initial_offsets:
+            self.offsets[path] = self._initial_offsets[path]
+        elif not new:
+            try:
+                st = os.stat(path)
+                self.offsets[path] = (st.st_ino, st.st_size)
+            except FileNotFoundError:
+                # The file will be read from the start once it gets created.
+                pass
+        return path
+
+    def untrack(self, path: str) -> None:
+        """
+        Stops tracking a file. The last update time of its entry in config['files'] is kept.
+        """
+        self._index.pop(normalize_path(path), None)
+        for tracked in (self.file_configs, self.config_keys, self.files, self.offsets, self.parsers, self._saved):
+            tracked.pop(path, None)
+        self.matched.discard(path)
+        self._dirty = self.state_path is not None
+
+    def _notify(self) -> None:
+        if self.on_update is not None:
+            self.on_update()
+
+    def lookup(self, path: str) -> Optional[str]:
+        """
+        Gets the tracked file an event path refers to. Untracked files matching a pattern start being tracked.
+
+        :param path: The path of the event.
+        :return: The tracked file, or None if the path is not tracked.
+        """
+        key = normalize_path(path)
+        tracked = self._index.get(key)
+        if tracked is None and self.patterns:
+            directory, name = os.path.split(key)
+            for pattern, file in self.patterns.get(directory, ()):
+                if fnmatch.fnmatchcase(name, pattern):
+                    return self.track(path, file, new=True)
+        return tracked
+
+    def read_new_lines(self, path: str) -> List[str]:
+        """
+        Reads the complete lines appended to a tracked file since the last read and moves its offset forward. A
+        trailing line without its newline yet is left to be read by the next call.
+
+        :param path: The tracked file.
+        :return: The new lines, without their newline characters.
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return []
+
+        inode, offset = self.offsets.get(path, (st.st_ino, 0))
+        if inode != st.st_ino or st.st_size < offset:
+            print(f'{path} has been rotated or truncated, reading it from the start.')
+            inode, offset = st.st_ino, 0
+            self.parsers.pop(path, None)
+        if st.st_size == offset:
+            self.offsets[path] = (inode, offset)
+            return []
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        end = data.rfind(b'\n') + 1
+        self.offsets[path] = (inode, offset + end)
+        return data[:end].decode('utf-8', errors='replace').splitlines()
+
+    def checkpoint(self, force: bool = False) -> Optional[float]:
+        """
+        Saves the state file if anything changed since the last save, unless the last save was less than
+        checkpoint_interval seconds ago.
+
+        :param force: Save any change right away.
+        :return: Seconds until the pending changes can be saved, None if there are none.
+        """
+        if self.state_path is None:
+            return None
+        with self._state_lock:
+            if not self._dirty:
+                return None
+            now = time.monotonic()
+            if not force and now < self._next_checkpoint:
+                return self._next_checkpoint - now
+            self._dirty = False
+            self._checkpoint_notified = False
+            self._next_checkpoint = now + self.checkpoint_interval
+            # Copies of dictionaries are atomic, the observer thread might be updating them.
+            offsets = self.offsets.copy()
+            files = self.files.copy()
+            save_state(self.state_path, {file: (*offset, files.get(file)) for file, offset in offsets.items()},
+                       sync=True)
+        CHECKPOINTS.inc()
+        return None
+
+    def _iter_backlog(self, path: str, block_size: int = 1024 * 1024):
+        """
+        Reads the complete lines after the offset of a tracked file in blocks, moving the offset forward after each
+        block.
+
+        :return: A generator of lists with the lines of every block.
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        inode, offset = self.offsets.get(path, (st.st_ino, 0))
+        if inode != st.st_ino or st.st_size < offset:
+            print(f'{path} has been rotated or truncated while not running, reading it from the start.')
+            inode, offset = st.st_ino, 0
+            self.parsers.pop(path, None)
+        if st.st_size == offset:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            rest = b''
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                data = rest + block
+                end = data.rfind(b'\n') + 1
+                rest = data[end:]
+                if end == 0:
+                    continue
+                offset += end
+                self.offsets[path] = (inode, offset)
+                yield data[:end].decode('utf-8', errors='replace').splitlines()
+
+    def _skip_backlog(self, path: str, block_size: int = 64 * 1024) -> None:
+        """
+        Moves the offset of a tracked file past its last complete line, without reading the lines before it.
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        inode, offset = self.offsets.get(path, (st.st_ino, 0))
+        if inode != st.st_ino or st.st_size < offset:
+            inode, offset = st.st_ino, 0
+            self.parsers.pop(path, None)
+        end = st.st_size
+        with open(path, 'rb') as f:
+            while end > offset:
+                start = max(offset, end - block_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    offset = start + newline + 1
+                    break
+                end = start
+        self.offsets[path] = (inode, offset)
+        self._dirty = True
+
+    def catch_up(self) -> int:
+        """
+        Reads, in a single pass per file, the lines written to the tracked files since their offsets: the lines written
+        while the handler was not running if there is a state file, and during the start up if initial offsets were
+        given. Should be called before the observer starts.
+
+        The config key 'catch_up_mode' selects what happens with those lines:
+
+            * 'forward' (default): at most 'catch_up_max_lines' (default 100) lines with a configured level are sent
+              per file as usual. The rest are counted and sent as a single summary per file.
+            * 'summary': only the summary is sent.
+            * 'skip': the lines are not read, the files are read from their current end like without a state file.
+
+        The summary goes to the config of the most severe level in it, with the counts per level and the last line.
+
+        :return: The number of lines read.
+        """
+        mode = self.config.get('catch_up_mode', 'forward')
+        if mode not in ('forward', 'summary', 'skip'):
+            raise ValueError(f'Unknown catch_up_mode: {mode}')
+        max_lines = self.config.get('catch_up_max_lines', 100) if mode == 'forward' else 0
+
+        total = 0
+        for path in list(self.offsets):
+            if mode == 'skip':
+                self._skip_backlog(path)
+                continue
+
+            forwarded = read = 0
+            counts: Dict[str, int] = {}
+            last: Optional[LogRecord] = None
+            for lines in self._iter_backlog(path):
+                read += len(lines)
+                parser = self.parsers.get(path)
+                if parser is None:
+                    parser = detect_parser(lines, self.date_fmt)
+                    if parser is None:
+                        continue
+                    self.parsers[path] = parser
+                for line in lines:
+                    record = parser.parse(line)
+                    if record is None or record.level not in self.config:
+                        continue
+                    if forwarded < max_lines:
+                        self.aggregator.submit(record)
+                        forwarded += 1
+                    else:
+                        counts[record.level] = counts.get(record.level, 0) + 1
+                        last = record
+
+            if read:
+                self.files[path] = time.time()
+                self.updates[self.config_keys[path]] = self.files[path]
+                self._dirty = True
+                LINES_READ.inc(read)
+                CATCH_UP_LINES.inc(read)
+                MESSAGES_SUBMITTED.inc(forwarded)
+            if counts:
+                summarized = sum(counts.values())
+                CATCH_UP_SUMMARIZED.inc(summarized)
+                levels = sorted(counts, key=lambda level: LEVELS.index(level) if level in LEVELS else len(LEVELS))
+                by_level = ', '.join(f'{counts[level]} {level}' for level in levels)
+                more = ' more' if forwarded else ''
+                self.communicator.send_message(
+                    f'{path}: {summarized}{more} lines written while the log reader was not running ({by_level}). '
+                    f'Last one: {last.format()}', self.config[levels[0]])
+            total += read
+
+        self.checkpoint(force=True)
+        return total
 
     # TODO: add some kind of check that the log file has the correct structure, what happens if sections have other
     #  sections that I am not expecting.
@@ -171,29 +1301,119 @@ class LogReaderEventHandler(FileSystemEventHandler):
         keeping track and sends the new log lines into the specified Slack channels. The log messages should be
         separated by the character '|', the first section should be time following the format of the parameter
         data_fmt, the second the name of the module writing the line, the third the level of the log message and
-        lastly the fourth the message itself .
+        lastly the fourth the message itself. Files written with log.setup_logging(file_format='json') have one JSON
+        record per line instead; the format of every file is detected from its first line. Lines that do not follow the
+        format are ignored.
 
         :param event: The on_modified event.
         """
-        src_path = str(event.src_path)
-
         # A file that's not the log file in the same directory might trigger on_modified.
-        if src_path in self.files:
-            reverse_line_generator = reverse_readline(src_path)
+        src_path = None if event.is_directory else self.lookup(str(event.src_path))
+        if src_path is not None:
             new_time = time.time()
-            for line in reverse_line_generator:
-                sections = line.split("|")
-                line_time = time.mktime(time.strptime(re.sub(r'\t+', '', sections[0]), self.date_fmt))
-
-                # Stop iterating when we get to a message older than the last time we checked
-                if line_time <= self.files[src_path]:
-                    break
+            start = time.perf_counter()
+            lines = self.read_new_lines(src_path)
+            parser = self.parsers.get(src_path)
+            if parser is None:
+                parser = detect_parser(lines, self.date_fmt)
+                if parser is None:
+                    # Nothing but empty lines, the format gets detected on the next read.
+                    lines = []
+                else:
+                    self.parsers[src_path] = parser
+            unparsed = submitted = 0
+            for line in lines:
+                record = parser.parse(line)
+                if record is None:
+                    unparsed += 1
+                    continue
 
-                category = re.sub(r'\t+| +', '', sections[2])
-                if category in self.config:
-                    self.communicator.send_message(sections[0] + ':' + sections[2] + ':' + sections[3],
-                                                   self.config[category])
+                if record.level in self.config:
+                    self.aggregator.submit(record)
+                    submitted += 1
+            if lines:
+                LINES_READ.inc(len(lines))
+                LINES_UNPARSED.inc(unparsed)
+                MESSAGES_SUBMITTED.inc(submitted)
+                EVENT_SECONDS.observe(time.perf_counter() - start)
             self.files[src_path] = new_time
+            self.updates[self.config_keys[src_path]] = new_time
+            if self.state_path is not None:
+                self._dirty = True
+                if self.checkpoint() is not None and not self._checkpoint_notified:
+                    self._checkpoint_notified = True
+                    self._notify()
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        """
+        Gets called when a file gets created in a monitoring directory. Handled like a modification, so that files
+        matching a pattern get tracked, and read, as soon as they appear.
+
+        :param event: The on_created event.
+        """
+        self.on_modified(event)
+
+    def on_deleted(self, event: FileSystemEvent) -> None:
+        """
+        Gets called when a file gets deleted in a monitoring directory. Files that matched a pattern stop being
+        tracked; files given by name in the config are expected to come back and stay tracked.
+
+        :param event: The on_deleted event.
+        """
+        if event.is_directory:
+            return
+        path = self._index.get(normalize_path(str(event.src_path)))
+        if path is not None and path in self.matched:
+            self.untrack(path)
+
+    def on_moved(self, event: FileSystemEvent) -> None:
+        """
+        Gets called when a file gets renamed in a monitoring directory. A file that matched a pattern stops being
+        tracked under its old name, like when deleted. If the new name is tracked, or matches a pattern, the file is
+        read from where it was left under its old name, or from the start if it was not tracked.
+
+        :param event: The on_moved event.
+        """
+        if event.is_directory:
+            return
+        path = self._index.get(normalize_path(str(event.src_path)))
+        offset = self.offsets.get(path) if path is not None else None
+        if path is not None and path in self.matched:
+            self.untrack(path)
+        dest_path = self.lookup(str(event.dest_path))
+        if dest_path is not None:
+            if offset is not None:
+                self.offsets[dest_path] = offset
+            self.on_modified(FileModifiedEvent(str(event.dest_path)))
+
+
+def make_sink(config: dict, conf_path: Path) -> NotificationSink:
+    """
+    Creates the notification sink specified by the 'sink' key of the config dictionary. The key can be missing or
+    'slack' for Slack, or a dictionary with the key 'type' and the options of the sink:
+
+        * {'type': 'jsonl', 'path': <file>}: JsonlFileSink.
+        * {'type': 'webhook', 'url': <url>}: WebhookSink.
+        * {'type': 'memory'}: MemorySink.
+
+    :param config: The complete configuration dictionary taken from the configuration file.
+    :param conf_path: The path of the config file, used for the default paths of the Slack cache.
+    """
+    sink_config = config.get('sink', 'slack')
+    if isinstance(sink_config, str):
+        sink_config = {'type': sink_config}
+
+    sink_type = sink_config['type']
+    if sink_type == 'slack':
+        cache_path = Path(config.get('slack_cache', conf_path.with_name(conf_path.stem + '_slack_cache.json')))
+        return SlackCommunicator(config, cache_path=cache_path)
+    if sink_type == 'jsonl':
+        return JsonlFileSink(Path(sink_config['path']), config)
+    if sink_type == 'webhook':
+        return WebhookSink(sink_config['url'], config)
+    if sink_type == 'memory':
+        return MemorySink(config)
+    raise ValueError(f'Unknown sink type: {sink_type}')
 
 
 class LogWatcher:
@@ -201,7 +1421,7 @@ class LogWatcher:
     Keeps track of whatever log files are in the files key of the config dictionary and post any updates in a slack
     channel in real time. See config file documentation on how to write it. To use just create an instance of this
     object in a script, pass it the path of the config file and call the run function. The LogWatcher will run
-    indefinitely.
+    until its stop function is called.
     """
     def __init__(self, conf_path: Path, resend_period: Union[int, float] = 1):
         """
@@ -221,37 +1441,102 @@ class LogWatcher:
 
         self.config = mod.config
 
-        self.communicator = SlackCommunicator(self.config)
+        # Taken before creating the sink, which can take a while for Slack, so that the lines written in the meantime
+        # are not skipped.
+        initial_offsets = current_offsets(self.config)
+        self.communicator = make_sink(self.config, conf_path)
+
+        self.metrics_exporter: Optional[metrics.MetricsExporter] = None
+        if 'metrics_file' in self.config:
+            self.metrics_exporter = metrics.MetricsExporter(Path(self.config['metrics_file']),
+                                                            self.config.get('metrics_interval', 15))
 
-        self.event_handler = LogReaderEventHandler(self.config, self.communicator)
+        state_path = Path(self.config.get('state_file', conf_path.with_name(conf_path.stem + '_state.json')))
+        self.event_handler = LogReaderEventHandler(self.config, self.communicator, state_path=state_path,
+                                                   initial_offsets=initial_offsets)
         self.observer = Observer()
-        self.last_message_sent = {}
-        for file in self.config['files'].keys():
-            self.observer.schedule(self.event_handler, str(Path(file).parent), recursive=False)
-            self.last_message_sent[file] = time.time()
+        # One watch per directory: events of every file in it are dispatched by the handler.
+        for directory in self.event_handler.directories.values():
+            self.observer.schedule(self.event_handler, directory, recursive=False)
+        # Dictionary with the keys of config['files'] with a period as keys, and the last time a message about them
+        # was sent as values.
+        self.last_message_sent = {key: time.time() for key, file_conf in self.config['files'].items()
+                                  if 'period' in file_conf}
 
         self.resend_period = resend_period * 3600
 
+        self._stopping = threading.Event()
+        # Set when run should wake up before its next deadline.
+        self._wake_up = threading.Event()
+        self.event_handler.on_update = self._wake_up.set
+
+    def next_deadline(self, key: str) -> float:
+        """
+        Gets the time at which a message should be sent if the files of an entry of config['files'] do not receive
+        any update before. For a pattern, the last update of any file matching it counts.
+
+        :param key: A key of config['files'] with a period.
+        :return: The time, since the epoch.
+        """
+        period = self.config['files'][key]['period'] * 3600
+        return max(self.event_handler.updates[key] + period, self.last_message_sent[key] + self.resend_period)
+
+    def stop(self) -> None:
+        """
+        Makes run return. Can be called from any thread.
+        """
+        self._stopping.set()
+        self._wake_up.set()
+
     def run(self) -> None:
         """
-        Starts the watchdog observer
+        Starts the watchdog observer and sleeps until the next deadline, or until a tracked file gets modified.
+
+        The deadlines of the entries of config['files'] with a period are kept in a min-heap with one item per entry, a
+        pattern being a single entry. Updates do not touch the heap: when the item of an entry gets to the top, its
+        deadline is computed again from its last update, and the message is only sent if that deadline has passed.
+        Otherwise the item is pushed back with the new deadline. The cost of every wake-up only depends on the
+        deadlines that are due, not on the number of files.
         """
+        self._stopping.clear()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.start()
+        self.event_handler.catch_up()
         self.observer.start()
         try:
-            while True:
+            file_configs = self.config['files']
+            deadlines = [(self.next_deadline(key), key) for key in self.last_message_sent]
+            heapq.heapify(deadlines)
+
+            while not self._stopping.is_set():
+                self._wake_up.clear()
                 current_t = time.time()
-                for file, file_conf in self.config['files'].items():
-                    if 'period' in file_conf:
-                        last_update = self.event_handler.files[file]
-
-                        if current_t - last_update > file_conf['period'] * 3600 \
-                                and current_t - self.last_message_sent[file] > self.resend_period:
-                            message_conf = file_conf.copy()
-                            del message_conf['period']
-                            self.communicator.send_message(
-                                f'{file} has not received an update after {file_conf["period"]} hrs', message_conf)
-                            self.last_message_sent[file] = current_t
-                time.sleep(1)
+                while deadlines and deadlines[0][0] <= current_t:
+                    _, key = heapq.heappop(deadlines)
+                    if self.next_deadline(key) <= current_t:
+                        message_conf = file_configs[key].copy()
+                        del message_conf['period']
+                        self.communicator.send_message(
+                            f'{key} has not received an update after {file_configs[key]["period"]} hrs',
+                            message_conf)
+                        self.last_message_sent[key] = current_t
+                    heapq.heappush(deadlines, (self.next_deadline(key), key))
+
+                timeout = deadlines[0][0] - current_t if deadlines else None
+                next_summary = self.event_handler.aggregator.flush_expired()
+                if next_summary is not None and (timeout is None or next_summary < timeout):
+                    timeout = next_summary
+                next_checkpoint = self.event_handler.checkpoint()
+                if next_checkpoint is not None and (timeout is None or next_checkpoint < timeout):
+                    timeout = next_checkpoint
+                self._wake_up.wait(timeout)
         finally:
             self.observer.stop()
             self.observer.join()
+            # The summaries of the open windows get queued, then closing the communicator sends everything queued, so
+            # the last checkpoint does not skip what was not sent.
+            self.event_handler.aggregator.flush_all()
+            self.communicator.close()
+            self.event_handler.checkpoint(force=True)
+            if self.metrics_exporter is not None:
+                self.metrics_exporter.stop()
@@ -0,0 +1,143 @@
+"""
+Persistent manifest of the files backed up by the copy engine. The manifest is an SQLite database living in the root
+of the dest directory that records, for every copied file, its path relative to the root, size, modification time (in
+nanoseconds), inode and optionally a content hash, as they were in src when the file was copied.
+
+With a manifest, deciding if a file changed since the last run only needs the stat of the src file, which the walk gets
+for free, and a lookup in the database. The dest directory is not touched at all for unchanged files.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, NamedTuple, List, Iterator
+
+from log import *
+
+logger = log_logger('filechecker.manifest')
+
+MANIFEST_NAME = '.backup_manifest.sqlite'
+
+
+class ManifestEntry(NamedTuple):
+    """
+    A file as it was recorded in the manifest.
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    hash: Optional[str] = None
+
+
+class Manifest:
+    """
+    SQLite backed manifest. Can be used from several threads: new entries are buffered and written in batches, one
+    transaction per batch.
+
+    :param path: The path of the database file. Gets created if it does not exist.
+    :param batch_size: Number of new entries that are buffered before writing them to the database.
+    """
+    def __init__(self, path: Path, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending: List[ManifestEntry] = []
+
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                           'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS files_hash ON files (hash)')
+
+    @classmethod
+    def for_dest(cls, dest: Path, **kwargs) -> 'Manifest':
+        """
+        Opens the manifest living in the root of a dest directory.
+
+        :param dest: The dest directory.
+        """
+        return cls(dest.joinpath(MANIFEST_NAME), **kwargs)
+
+    def __enter__(self) -> 'Manifest':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        """
+        Gets the entry of a file.
+
+        :param path: The path of the file relative to the root, with '/' as separator.
+        :return: The entry, None if the file is not in the manifest.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT path, size, mtime_ns, inode, hash FROM files WHERE path = ?',
+                                     (path,)).fetchone()
+        return ManifestEntry(*row) if row is not None else None
+
+    def find_hash(self, hash: str) -> Optional[ManifestEntry]:
+        """
+        Finds a file with the given content hash.
+
+        :param hash: The hash to look for.
+        :return: The entry of one of the files with that hash, None if there is none. Entries that are still
+            buffered are not searched.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT path, size, mtime_ns, inode, hash FROM files WHERE hash = ? LIMIT 1',
+                                     (hash,)).fetchone()
+        return ManifestEntry(*row) if row is not None else None
+
+    def __iter__(self) -> Iterator[ManifestEntry]:
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute('SELECT path, size, mtime_ns, inode, hash FROM files ORDER BY path').fetchall()
+        return (ManifestEntry(*row) for row in rows)
+
+    def is_unchanged(self, path: str, size: int, mtime_ns: int, inode: int) -> bool:
+        """
+        Checks if a file is recorded in the manifest with the same size, modification time and inode.
+        """
+        entry = self.get(path)
+        return entry is not None and entry.size == size and entry.mtime_ns == mtime_ns and entry.inode == inode
+
+    def record(self, entry: ManifestEntry) -> None:
+        """
+        Adds or replaces the entry of a file. The entry is written with the next batch.
+        """
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size:
+                self._write_pending()
+
+    def flush(self) -> None:
+        """
+        Writes every buffered entry to the database.
+        """
+        with self._lock:
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        self._conn.execute('BEGIN')
+        self._conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, hash) '
+                               'VALUES (?, ?, ?, ?, ?)', self._pending)
+        self._conn.execute('COMMIT')
+        logger.debug(f'{len(self._pending)} entries written to {self.path}.')
+        self._pending = []
+
+    def close(self) -> None:
+        """
+        Writes the buffered entries and closes the database.
+        """
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,328 @@
+"""
+Instrumentation of the checker and the log forwarder: counters, gauges and latency histograms kept in a registry that
+can be exported in the Prometheus text format or as a JSON snapshot.
+
+Recording is off until metrics.enable() is called (MetricsExporter.start does it), and every metric method returns
+right away while it is off. The instrumented code also records in batches (once per walk, per event, per post) rather
+than once per folder or per line, so the cost is negligible either way.
+
+Metrics are created at import time by the modules that record them::
+
+    import metrics
+
+    LINES = metrics.counter('log_reader_lines_total', 'Log lines read.')
+    LINES.inc(len(lines))
+"""
+
+import os
+import json
+import time
+import bisect
+import cProfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Union, Iterator
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    """
+    Base of the metrics.
+
+    :param registry: The registry the metric belongs to.
+    :param name: The name of the metric, following the Prometheus conventions.
+    :param help: A one line description.
+    """
+    type = ''
+
+    def __init__(self, registry: 'Registry', name: str, help: str):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self) -> Dict[str, float]:
+        """
+        Gets the samples of the metric, keyed by the name of each one in the Prometheus text format.
+        """
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+    """
+    type = 'counter'
+
+    def __init__(self, registry: 'Registry', name: str, help: str):
+        super().__init__(registry, name, help)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> Dict[str, float]:
+        return {self.name: self.value}
+
+    def reset(self) -> None:
+        self.value = 0.0
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+    """
+    type = 'gauge'
+
+    def __init__(self, registry: 'Registry', name: str, help: str):
+        super().__init__(registry, name, help)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def samples(self) -> Dict[str, float]:
+        return {self.name: self.value}
+
+    def reset(self) -> None:
+        self.value = 0.0
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, usually durations in seconds, counted in cumulative buckets.
+
+    :param buckets: The upper bounds of the buckets, sorted. An implicit +Inf bucket is added.
+    """
+    type = 'histogram'
+
+    def __init__(self, registry: 'Registry', name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        Observes the time spent inside the with block.
+        """
+        if not self.registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> Dict[str, float]:
+        samples = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples[f'{self.name}_bucket{{le="{bound}"}}'] = cumulative
+        samples[f'{self.name}_bucket{{le="+Inf"}}'] = self.count
+        samples[f'{self.name}_sum'] = self.sum
+        samples[f'{self.name}_count'] = self.count
+        return samples
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Registry:
+    """
+    Keeps the metrics by name. Asking twice for the same name returns the same metric.
+
+    :param enabled: If False, the metrics of the registry ignore everything they are asked to record.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs) -> Metric:
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {metric.type}')
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def reset(self) -> None:
+        """
+        Sets every metric back to zero.
+        """
+        for metric in list(self.metrics.values()):
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        """
+        Gets every metric in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(f'{sample} {_format(value)}' for sample, value in metric.samples().items())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """
+        Gets every metric as a JSON serializable dictionary.
+        """
+        snapshot: dict = {'time': time.time(), 'metrics': {}}
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            if isinstance(metric, Histogram):
+                value: Union[float, dict] = {'count': metric.count, 'sum': metric.sum,
+                                             'buckets': dict(zip([str(b) for b in metric.buckets] + ['+Inf'],
+                                                                 metric.counts))}
+            else:
+                value = metric.samples()[name]
+            snapshot['metrics'][name] = value
+        return snapshot
+
+    def write(self, path: Path) -> None:
+        """
+        Writes every metric to a file, as a JSON snapshot if its suffix is '.json' and in the Prometheus text format
+        otherwise (e.g. for the textfile collector of the node exporter). The file is replaced atomically.
+        """
+        if path.suffix == '.json':
+            content = json.dumps(self.snapshot(), indent=2)
+        else:
+            content = self.to_prometheus()
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsExporter:
+    """
+    Enables the registry and writes it to a file every interval seconds from a background thread, and once more when
+    stopped. Usable as a context manager.
+
+    :param path: The file to write. See Registry.write for the format.
+    :param interval: Seconds between writes.
+    :param registry: The registry to export, the default one if None.
+    """
+    def __init__(self, path: Path, interval: float = 15.0, registry: Optional[Registry] = None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry if registry is not None else REGISTRY
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.registry.enabled = True
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='MetricsExporter', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.registry.write(self.path)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self.registry.write(self.path)
+
+    def __enter__(self) -> 'MetricsExporter':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+@contextmanager
+def profiled(path: Optional[Path]) -> Iterator[None]:
+    """
+    Runs the with block under cProfile and dumps the stats to path, to be read with pstats or snakeviz. Does nothing if
+    path is None.
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(path))
+
+
+#: The registry used by the instrumented modules.
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str) -> Counter:
+    return REGISTRY.counter(name, help)
+
+
+def gauge(name: str, help: str) -> Gauge:
+    return REGISTRY.gauge(name, help)
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def enable() -> None:
+    REGISTRY.enabled = True
+
+
+def disable() -> None:
+    REGISTRY.enabled = False
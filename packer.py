@@ -0,0 +1,454 @@
+"""
+Packing mode of the backup tool, for data folders made of many small files. Copying those one by one over a network
+share is dominated by the metadata round trips of every file, so instead each data folder is streamed into a single
+tar archive written next to where the folder would be in dest, e.g. dest/project/simulation.tar.gz.
+
+The tar stream is cut into chunks of chunk_size bytes that a pool of threads compresses in parallel (zlib and lzma
+release the GIL), each one as an independent gzip member or xz stream. Concatenated members are still a valid
+.tar.gz / .tar.xz, so the archive opens with tar or tarfile as usual. A sidecar index (the archive name plus '.index')
+records where every chunk starts, in the archive and in the tar stream, and where the data of every file is in the tar
+stream, so read_file and extract_file only decompress the chunks holding the file they are asked for.
+
+The index has the same JSON lines layout as the backup plans: a header, then one line per chunk and one per file.
+"""
+
+import os
+import io
+import json
+import lzma
+import zlib
+import stat
+import bisect
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Iterable, Iterator, Dict, Tuple, Deque, Callable
+
+from log import *
+from checker import StructureChecker, Finding, FindingKind
+from copier import CopyStats, part_path
+
+logger = log_logger('filechecker.packer')
+
+INDEX_VERSION = 1
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Codec -> (suffix of the archive, default level).
+CODECS = {'gzip': ('.tar.gz', 6), 'xz': ('.tar.xz', 6)}
+
+
+class Chunk(NamedTuple):
+    """
+    A compressed chunk of the archive: its position in the archive and the part of the tar stream it holds.
+    """
+    offset: int
+    size: int
+    data_offset: int
+    data_size: int
+
+
+class PackedFile(NamedTuple):
+    """
+    A file of the archive: its name in the tar and where its data is in the tar stream.
+    """
+    name: str
+    offset: int
+    size: int
+    mtime_ns: int
+
+
+class ArchiveIndex:
+    """
+    The sidecar index of an archive.
+
+    :param codec: The codec of the chunks, one of CODECS.
+    :param chunks: The chunks, in order.
+    :param files: The files, keyed by their name in the tar.
+    """
+    def __init__(self, codec: str, chunks: Optional[List[Chunk]] = None, files: Optional[Dict[str, PackedFile]] = None):
+        self.codec = codec
+        self.chunks = chunks if chunks is not None else []
+        self.files = files if files is not None else {}
+
+    @property
+    def compressed_size(self) -> int:
+        return sum(chunk.size for chunk in self.chunks)
+
+    @property
+    def data_size(self) -> int:
+        return sum(chunk.data_size for chunk in self.chunks)
+
+    def save(self, path: Path) -> None:
+        """
+        Saves the index, replacing path atomically.
+        """
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': INDEX_VERSION, 'codec': self.codec, 'chunks': len(self.chunks),
+                                'files': len(self.files)}) + '\n')
+            for chunk in self.chunks:
+                f.write(json.dumps({'c': list(chunk)}) + '\n')
+            for file in self.files.values():
+                f.write(json.dumps({'f': file.name, 'o': file.offset, 's': file.size, 'm': file.mtime_ns}) + '\n')
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ArchiveIndex':
+        """
+        Loads an index saved with save.
+
+        :raises ValueError: If the file is not a complete index of a known version.
+        """
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != INDEX_VERSION:
+                raise ValueError(f'{path} has an unknown index version: {header.get("version")}')
+            index = cls(header['codec'])
+            for line in f:
+                entry = json.loads(line)
+                if 'c' in entry:
+                    index.chunks.append(Chunk(*entry['c']))
+                else:
+                    index.files[entry['f']] = PackedFile(entry['f'], entry['o'], entry['s'], entry['m'])
+        if len(index.chunks) != header['chunks'] or len(index.files) != header['files']:
+            raise ValueError(f'{path} is incomplete.')
+        return index
+
+
+def index_path(archive_path: Path) -> Path:
+    return archive_path.with_name(archive_path.name + '.index')
+
+
+def compress(codec: str, level: int, data: bytes) -> bytes:
+    """
+    Compresses data into a standalone gzip member or xz stream.
+    """
+    if codec == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'gzip':
+        return zlib.decompress(data, 31)
+    return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+class _ChunkedWriter(io.RawIOBase):
+    """
+    File object that tarfile writes the tar stream to. The stream is cut into chunks that get compressed by the pool
+    and written to the archive in order, with at most max_pending chunks in memory.
+    """
+    def __init__(self, archive, index: ArchiveIndex, level: int, chunk_size: int, pool: ThreadPoolExecutor,
+                 max_pending: int):
+        super().__init__()
+        self.archive = archive
+        self.index = index
+        self.level = level
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.max_pending = max_pending
+        self.position = 0
+        self._buffer = bytearray()
+        self._data_offset = 0
+        self._archive_offset = 0
+        self._pending: Deque[Tuple[Future, int, int]] = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.position += len(data)
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, data: bytes) -> None:
+        future = self.pool.submit(compress, self.index.codec, self.level, data)
+        self._pending.append((future, self._data_offset, len(data)))
+        self._data_offset += len(data)
+        while len(self._pending) > self.max_pending:
+            self._write_oldest()
+
+    def _write_oldest(self) -> None:
+        future, data_offset, data_size = self._pending.popleft()
+        compressed = future.result()
+        self.archive.write(compressed)
+        self.index.chunks.append(Chunk(self._archive_offset, len(compressed), data_offset, data_size))
+        self._archive_offset += len(compressed)
+
+    def finish(self) -> None:
+        """
+        Compresses what is left in the buffer and waits for every chunk to be written.
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._write_oldest()
+
+
+def iter_folder(folder: Path, on_error: Optional[Callable[[str, OSError], None]] = None) \
+        -> Iterator[Tuple[str, str, os.stat_result]]:
+    """
+    Walks a folder depth first, in sorted order, yielding every folder (the folder itself first) and regular file.
+    Like the copier, symlinks to files are followed and packed as regular files while symlinks to folders are not.
+    Those and any other entry (dangling symlinks, sockets, ...) are skipped with a warning.
+
+    :param folder: The folder to walk.
+    :param on_error: Called with the path and the error of every folder that cannot be read and every file that
+        cannot be stat'ed, which are then skipped with everything inside them. If None, the errors are raised.
+    :return: A generator of tuples with the path, its name in the tar (starting with the name of folder, with '/' as
+        separator) and its stat.
+    """
+    stack = [(str(folder), folder.name)]
+    while stack:
+        path, name = stack.pop()
+        try:
+            st = os.stat(path, follow_symlinks=False)
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            if on_error is None:
+                raise
+            on_error(path, e)
+            continue
+        yield path, name, st
+        folders = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append((entry.path, f'{name}/{entry.name}'))
+                elif entry.is_file():
+                    yield entry.path, f'{name}/{entry.name}', entry.stat()
+                else:
+                    logger.warning(f'{entry.path} skipped since it is not a regular file or folder.')
+            except OSError as e:
+                if on_error is None:
+                    raise
+                on_error(entry.path, e)
+        stack.extend(reversed(folders))
+
+
+def pack_folder(folder: Path, archive_path: Path, pool: ThreadPoolExecutor, codec: str = 'gzip',
+                level: Optional[int] = None, chunk_size: int = CHUNK_SIZE, max_pending: int = 8,
+                on_error: Optional[Callable[[str, OSError], None]] = None) -> ArchiveIndex:
+    """
+    Packs a folder into a compressed tar archive and writes its index next to it. The archive is written to a hidden
+    '.part' file (see copier.part_path) and renamed into place once complete. The index is written afterwards by
+    ArchiveIndex.save, which renames it into place from a '.tmp' file.
+
+    :param folder: The folder to pack. Its name is the top folder of the archive.
+    :param archive_path: The path of the archive.
+    :param pool: The pool compressing the chunks.
+    :param codec: One of CODECS.
+    :param level: The compression level, the default of the codec if None.
+    :param chunk_size: Size of the chunks of the tar stream compressed independently.
+    :param max_pending: Maximum number of chunks being compressed or waiting to be written.
+    :param on_error: Called with the path and the error of every folder or file that cannot be read, which is then
+        left out of the archive. If None, the errors are raised.
+    :return: The index of the archive.
+    """
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec: {codec}')
+    level = level if level is not None else CODECS[codec][1]
+    index = ArchiveIndex(codec)
+    part = part_path(archive_path)
+    try:
+        with open(part, 'wb') as archive:
+            writer = _ChunkedWriter(archive, index, level, chunk_size, pool, max_pending)
+            with tarfile.open(fileobj=writer, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                for path, name, st in iter_folder(folder, on_error):
+                    info = tarfile.TarInfo(name)
+                    # Whole seconds, a fractional mtime would need a PAX header per file. The index keeps the
+                    # nanoseconds, for extract_file.
+                    info.mtime = st.st_mtime_ns // 10 ** 9
+                    info.mode = st.st_mode & 0o7777
+                    if stat.S_ISDIR(st.st_mode):
+                        info.type = tarfile.DIRTYPE
+                        tar.addfile(info)
+                        continue
+                    try:
+                        f = open(path, 'rb')
+                    except OSError as e:
+                        if on_error is None:
+                            raise
+                        on_error(path, e)
+                        continue
+                    with f:
+                        # The size is the one of the open file, the file might still be growing.
+                        info.size = os.fstat(f.fileno()).st_size
+                        tar.addfile(info, f)
+                    # tarfile pads the data to a multiple of the block size.
+                    padded = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                    index.files[name] = PackedFile(name, tar.offset - padded, info.size, st.st_mtime_ns)
+            writer.finish()
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, archive_path)
+    index.save(index_path(archive_path))
+    return index
+
+
+def _iter_file_data(archive_path: Path, name: str, index: ArchiveIndex) -> Iterator[bytes]:
+    file = index.files.get(name)
+    if file is None:
+        raise KeyError(f'{name} is not in {archive_path}')
+    end = file.offset + file.size
+    first = bisect.bisect_right([chunk.data_offset for chunk in index.chunks], file.offset) - 1
+    with open(archive_path, 'rb') as archive:
+        for chunk in index.chunks[max(first, 0):]:
+            if chunk.data_offset >= end:
+                break
+            archive.seek(chunk.offset)
+            data = decompress(index.codec, archive.read(chunk.size))
+            yield data[max(file.offset - chunk.data_offset, 0):end - chunk.data_offset]
+
+
+def read_file(archive_path: Path, name: str, index: Optional[ArchiveIndex] = None) -> bytes:
+    """
+    Reads a single file of an archive, decompressing only the chunks holding it.
+
+    :param archive_path: The archive.
+    :param name: The name of the file in the tar, e.g. 'simulation/run1/output.h5'.
+    :param index: The index of the archive, loaded from its sidecar file if None.
+    :raises KeyError: If the file is not in the archive.
+    """
+    index = index if index is not None else ArchiveIndex.load(index_path(archive_path))
+    return b''.join(_iter_file_data(archive_path, name, index))
+
+
+def extract_file(archive_path: Path, name: str, dest: Path, index: Optional[ArchiveIndex] = None) -> None:
+    """
+    Extracts a single file of an archive to dest, one chunk at a time, restoring its modification time.
+
+    :param archive_path: The archive.
+    :param name: The name of the file in the tar.
+    :param dest: The path of the extracted file.
+    :param index: The index of the archive, loaded from its sidecar file if None.
+    :raises KeyError: If the file is not in the archive.
+    """
+    index = index if index is not None else ArchiveIndex.load(index_path(archive_path))
+    with open(dest, 'wb') as f:
+        for data in _iter_file_data(archive_path, name, index):
+            f.write(data)
+    mtime_ns = index.files[name].mtime_ns
+    os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+
+class DataFolderPacker:
+    """
+    Packs every data folder found by a StructureChecker into an archive in dest, in place of copying its files. The
+    archive of dest/project/simulation is dest/project/simulation.tar.gz (or .tar.xz), and the parent must exist in
+    dest. A data folder whose files all match the index of its archive, by size and modification time, is not packed
+    again.
+
+    :param checker: A StructureChecker. Its lists are used by pack when no findings are passed.
+    :param codec: One of CODECS.
+    :param level: The compression level, the default of the codec if None.
+    :param workers: Number of threads compressing chunks.
+    :param chunk_size: Size of the chunks of the tar stream compressed independently. Reading a single file
+        decompresses at least one chunk.
+    """
+    def __init__(self, checker: StructureChecker, codec: str = 'gzip', level: Optional[int] = None,
+                 workers: int = 4, chunk_size: int = CHUNK_SIZE):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown codec: {codec}')
+        self.checker = checker
+        self.codec = codec
+        self.level = level
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def archive_path(self, dest_folder: Path) -> Path:
+        return dest_folder.with_name(dest_folder.name + CODECS[self.codec][0])
+
+    def iter_data_folders(self, findings: Optional[Iterable[Finding]] = None) -> Iterator[Tuple[Path, Path]]:
+        """
+        :return: A generator of tuples with every data folder and its dest equivalent.
+        """
+        if findings is None:
+            for data_folder in self.checker.data_folders:
+                yield data_folder, self.checker.convert_src_to_dest(data_folder)
+        else:
+            for finding in findings:
+                if finding.kind is FindingKind.DATA_FOLDER:
+                    yield finding.src, finding.dest
+
+    @staticmethod
+    def is_up_to_date(folder: Path, archive_path: Path) -> bool:
+        """
+        Checks if the index of an archive lists exactly the files of folder, with the same sizes and modification
+        times. A folder that cannot be walked completely is never up to date.
+        """
+        try:
+            index = ArchiveIndex.load(index_path(archive_path))
+        except (OSError, ValueError):
+            return False
+        if not archive_path.is_file():
+            return False
+        files = index.files
+        count = 0
+        try:
+            for _, name, st in iter_folder(folder):
+                if stat.S_ISDIR(st.st_mode):
+                    continue
+                packed = files.get(name)
+                if packed is None or packed.size != st.st_size or packed.mtime_ns != st.st_mtime_ns:
+                    return False
+                count += 1
+        except OSError:
+            # Packed again, which logs what cannot be read.
+            return False
+        return count == len(files)
+
+    def pack(self, findings: Optional[Iterable[Finding]] = None) -> CopyStats:
+        """
+        Packs every data folder found by the checker. The statistics count the files packed and their size before
+        compression; up to date archives count as skipped.
+
+        :param findings: Optional stream of findings, usually from StructureChecker.iter_findings.
+        :return: The statistics of the run.
+        """
+        stats = CopyStats()
+        compressed = 0
+
+        def skip(path: str, error: OSError) -> None:
+            stats.add_error()
+            logger.error(f'{path} not packed: {error}')
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for data_folder, dest_folder in self.iter_data_folders(findings):
+                archive_path = self.archive_path(dest_folder)
+                if not archive_path.parent.is_dir():
+                    stats.add_error()
+                    logger.error(f'{data_folder} not packed since {archive_path.parent} does not exist.')
+                    continue
+                if self.is_up_to_date(data_folder, archive_path):
+                    stats.add_skipped()
+                    logger.debug(f'{archive_path} is up to date.')
+                    continue
+                try:
+                    index = pack_folder(data_folder, archive_path, pool, self.codec, self.level, self.chunk_size,
+                                        2 * self.workers, skip)
+                except OSError as e:
+                    stats.add_error()
+                    logger.error(f'{data_folder} could not be packed into {archive_path}: {e}')
+                    continue
+                for file in index.files.values():
+                    stats.add_copied(file.size)
+                compressed += index.compressed_size
+                logger.info(f'{data_folder} packed into {archive_path}: {len(index.files)} files, '
+                            f'{len(index.chunks)} chunks.')
+
+        stats.stop()
+        logger.info(f'packing complete: {stats} {compressed / 1e6:.1f} MB written.')
+        return stats
@@ -0,0 +1,363 @@
+"""
+Backup plans. Instead of copying while walking, build_plan turns the findings of a StructureChecker into a BackupPlan:
+the folders to create in dest and the files to copy, with their sizes, plus the totals and an estimate of the time the
+copy will take. Building a plan does not touch dest other than to look at it, so it doubles as a dry run.
+
+Plans are saved as JSON lines (a header followed by one line per folder or file), so they can be reviewed, kept or
+executed later by another process. A PlanExecutor applies a plan with the copy engine of copier.py while appending
+every completed folder and file to a journal. If the run gets interrupted, running the executor again with the same
+journal skips everything the journal records as done, so only the files that were not complete get copied again.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Iterable, Set, Tuple
+
+from log import *
+from checker import StructureChecker, Finding, FindingKind
+from copier import DataFolderCopier, CopyStats, copy_file, BUFFER_SIZE
+from manifest import Manifest, ManifestEntry
+from throttle import Throttle
+
+logger = log_logger('filechecker.plan')
+
+PLAN_VERSION = 1
+
+
+class PlannedFile(NamedTuple):
+    """
+    A file to copy. The path is relative to src (and dest), with '/' as separator.
+    """
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class BackupPlan:
+    """
+    The folders to create and the files to copy from src to dest.
+
+    :param src: The path of the source directory.
+    :param dest: The path of the destination directory.
+    :param folders: Folders to create in dest, relative to it with '/' as separator. Parents come before their
+        subfolders.
+    :param files: Files to copy.
+    :param plan_id: Identifier of the plan, used to match journals with their plan. A new one is generated if None.
+    :param created: Epoch time at which the plan was built.
+    """
+    def __init__(self, src: Path, dest: Path, folders: Optional[List[str]] = None,
+                 files: Optional[List[PlannedFile]] = None, plan_id: Optional[str] = None,
+                 created: Optional[float] = None):
+        self.src = src
+        self.dest = dest
+        self.folders = folders if folders is not None else []
+        self.files = files if files is not None else []
+        self.plan_id = plan_id if plan_id is not None else uuid.uuid4().hex
+        self.created = created if created is not None else time.time()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(file.size for file in self.files)
+
+    def estimate_seconds(self, mb_per_second: float = 100.0, files_per_second: float = 500.0) -> float:
+        """
+        Estimates how long the copy takes: the time to transfer the bytes plus a fixed cost per file.
+
+        :param mb_per_second: Throughput of the copy, in MB/s. CopyStats.mb_per_second of a previous run is a good
+            value.
+        :param files_per_second: Rate at which files are created when they are small, see CopyStats.files_per_second.
+        """
+        return self.total_bytes / 1e6 / mb_per_second + len(self.files) / files_per_second
+
+    def summary(self, mb_per_second: float = 100.0, files_per_second: float = 500.0) -> str:
+        """
+        One line description of the plan, for dry runs.
+        """
+        return (f'{len(self.folders)} folders to create, {len(self.files)} files to copy '
+                f'({self.total_bytes / 1e9:.2f} GB), estimated '
+                f'{self.estimate_seconds(mb_per_second, files_per_second) / 60:.1f} minutes.')
+
+    def save(self, path: Path) -> None:
+        """
+        Saves the plan as JSON lines. The file is replaced atomically.
+        """
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': PLAN_VERSION, 'id': self.plan_id, 'created': self.created,
+                                'src': str(self.src), 'dest': str(self.dest), 'folders': len(self.folders),
+                                'files': len(self.files), 'bytes': self.total_bytes}) + '\n')
+            for folder in self.folders:
+                f.write(json.dumps({'d': folder}) + '\n')
+            for file in self.files:
+                f.write(json.dumps({'f': file.path, 's': file.size, 'm': file.mtime_ns}) + '\n')
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'BackupPlan':
+        """
+        Loads a plan saved with save.
+        """
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != PLAN_VERSION:
+                raise ValueError(f'{path} is not a backup plan of version {PLAN_VERSION}.')
+            plan = cls(Path(header['src']), Path(header['dest']), plan_id=header['id'], created=header['created'])
+            for line in f:
+                entry = json.loads(line)
+                if 'd' in entry:
+                    plan.folders.append(entry['d'])
+                else:
+                    plan.files.append(PlannedFile(entry['f'], entry['s'], entry['m']))
+        if len(plan.folders) != header['folders'] or len(plan.files) != header['files']:
+            raise ValueError(f'{path} is incomplete.')
+        return plan
+
+
+def build_plan(checker: StructureChecker, findings: Optional[Iterable[Finding]] = None,
+               manifest: Optional[Manifest] = None) -> BackupPlan:
+    """
+    Builds the plan of a backup. Walks every data folder found by the checker, listing the folders missing in dest
+    and the files that are new or changed (see DataFolderCopier.needs_copy). Files inside folders missing in dest are
+    taken as new without looking for them in dest.
+
+    :param checker: A StructureChecker. Its lists are used if findings is None.
+    :param findings: Optional stream of findings, usually from StructureChecker.iter_findings.
+    :param manifest: Optional manifest of the previous runs, to compare the files against. It is only read, never
+        written to.
+    :return: The plan.
+    """
+    copier = DataFolderCopier(checker, manifest=manifest)
+    plan = BackupPlan(checker.src, checker.dest)
+
+    if findings is None:
+        data_folders: Iterable[Tuple[Path, Path]] = (
+            (data_folder, checker.convert_src_to_dest(data_folder)) for data_folder in checker.data_folders)
+        missing = {dest_folder for _, dest_folder in checker.create_data_folders}
+    else:
+        missing = set()
+        data_folders = _iter_data_folders(findings, missing)
+
+    for data_folder, dest_folder in data_folders:
+        if dest_folder in missing:
+            if not dest_folder.parent.is_dir():
+                logger.error(f'{data_folder} not planned since the parent of {dest_folder} does not exist.')
+                continue
+            dest_exists = False
+        else:
+            dest_exists = True
+        _plan_data_folder(copier, plan, data_folder, dest_folder, dest_exists)
+
+    logger.info(f'plan built: {plan.summary()}')
+    return plan
+
+
+def _iter_data_folders(findings: Iterable[Finding], missing: Set[Path]) -> Iterable[Tuple[Path, Path]]:
+    """
+    Yields the data folders of a stream of findings, adding the ones missing in dest to missing before they are
+    yielded.
+    """
+    for finding in findings:
+        if finding.kind is FindingKind.CREATE_DATA_FOLDER:
+            missing.add(finding.dest)
+        elif finding.kind is FindingKind.DATA_FOLDER:
+            yield finding.src, finding.dest
+
+
+def _plan_data_folder(copier: DataFolderCopier, plan: BackupPlan, data_folder: Path, dest_folder: Path,
+                      dest_exists: bool) -> None:
+    """
+    Adds the folders and files of a single data folder to the plan.
+    """
+    src_len = len(plan.src.parts)
+    stack = [(data_folder, dest_folder, '/'.join(data_folder.parts[src_len:]), dest_exists)]
+    while stack:
+        src_dir, dest_dir, rel_dir, exists = stack.pop()
+        if exists and src_dir is not data_folder:
+            exists = dest_dir.is_dir()
+        try:
+            with os.scandir(src_dir) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error(f'{src_dir} not planned: {e}')
+            continue
+        if not exists:
+            plan.folders.append(rel_dir)
+        for entry in entries:
+            rel = f'{rel_dir}/{entry.name}'
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((Path(entry.path), dest_dir / entry.name, rel, exists))
+                elif entry.is_file():
+                    st = entry.stat()
+                    if not exists or copier.needs_copy(rel, st, dest_dir / entry.name, record=False):
+                        plan.files.append(PlannedFile(rel, st.st_size, st.st_mtime_ns))
+            except OSError as e:
+                logger.error(f'{entry.path} not planned: {e}')
+
+
+class PlanExecutor:
+    """
+    Applies a BackupPlan, keeping an append-only journal of what is done. The first line of the journal has the id of
+    the plan; every later line records a folder created or a file copied. A journal left behind by an interrupted run
+    is read on start and everything it records is skipped. A last line cut short by the interruption is ignored.
+
+    :param plan: The plan to apply.
+    :param journal_path: The path of the journal.
+    :param workers: Number of threads copying files.
+    :param buffer_size: Size of the buffer of every thread for chunked copies.
+    :param manifest: Optional manifest where every copied file gets recorded.
+    :param throttle: Optional throttle limiting the speed of the copies, see throttle.py.
+    :param sync_every: The journal is fsynced every sync_every entries, and at the end of the run. Lines are always
+        flushed to the operating system as soon as they are written, so only a crash of the machine can lose the
+        ones written since the last sync, and those files just get copied again.
+    """
+    def __init__(self, plan: BackupPlan, journal_path: Path, workers: int = 8, buffer_size: int = BUFFER_SIZE,
+                 manifest: Optional[Manifest] = None, sync_every: int = 100, throttle: Optional[Throttle] = None):
+        self.plan = plan
+        self.journal_path = journal_path
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.manifest = manifest
+        self.sync_every = sync_every
+        self.throttle = throttle
+
+        self._lock = threading.Lock()
+        self._journal = None
+        self._unsynced = 0
+
+    def read_journal(self) -> Tuple[Set[str], Set[str]]:
+        """
+        Reads what a previous run of the plan completed.
+
+        :return: A tuple with the folders created and the files copied. Both empty if there is no journal, or if the
+            run that wrote it did not get to write its first line.
+        """
+        folders: Set[str] = set()
+        files: Set[str] = set()
+        if not self.journal_path.exists():
+            return folders, files
+        with open(self.journal_path, encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        if len(lines) < 2:
+            return folders, files
+        header = json.loads(lines[0])
+        if header.get('plan') != self.plan.plan_id:
+            raise ValueError(f'{self.journal_path} is the journal of another plan.')
+        # The last element is empty if the journal ends in a newline and an incomplete line otherwise.
+        for line in lines[1:-1]:
+            entry = json.loads(line)
+            if 'd' in entry:
+                folders.add(entry['d'])
+            else:
+                files.add(entry['f'])
+        return folders, files
+
+    def remaining(self) -> BackupPlan:
+        """
+        Gets the part of the plan that the journal does not record as done, for example for a summary before
+        resuming.
+        """
+        folders, files = self.read_journal()
+        return BackupPlan(self.plan.src, self.plan.dest,
+                          [folder for folder in self.plan.folders if folder not in folders],
+                          [file for file in self.plan.files if file.path not in files],
+                          self.plan.plan_id, self.plan.created)
+
+    def _append(self, entry: dict) -> None:
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            self._journal.write(line)
+            self._journal.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                os.fsync(self._journal.fileno())
+                self._unsynced = 0
+
+    def _copy_one(self, file: PlannedFile, stats: CopyStats) -> None:
+        src = self.plan.src.joinpath(*file.path.split('/'))
+        dest = self.plan.dest.joinpath(*file.path.split('/'))
+        try:
+            src_stat = os.stat(src) if self.manifest is not None else None
+            size = copy_file(src, dest, self.buffer_size, self.throttle)
+        except OSError as e:
+            stats.add_error()
+            logger.error(f'{src} could not be copied to {dest}: {e}')
+            return
+        stats.add_copied(size)
+        if self.manifest is not None:
+            self.manifest.record(ManifestEntry(file.path, src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_ino))
+        self._append({'f': file.path})
+
+    def execute(self) -> CopyStats:
+        """
+        Applies the plan, resuming from the journal if there is one. Folders are created first, in order, then the
+        files get copied by the pool of threads. Files recorded in the journal count as skipped in the statistics.
+
+        :return: The statistics of the run.
+        """
+        stats = CopyStats()
+        done_folders, done_files = self.read_journal()
+        if done_folders or done_files:
+            logger.info(f'resuming {self.plan.plan_id}: {len(done_folders)} folders and {len(done_files)} files '
+                        f'already done.')
+
+        resuming = False
+        if self.journal_path.exists():
+            content = self.journal_path.read_bytes()
+            complete = content.rfind(b'\n') + 1
+            resuming = complete > 0
+            if resuming and complete < len(content):
+                # Drops the incomplete line of an interrupted run, which would otherwise corrupt the next one.
+                os.truncate(self.journal_path, complete)
+        self._journal = open(self.journal_path, 'a' if resuming else 'w', encoding='utf-8')
+        self._unsynced = 0
+        try:
+            if not resuming:
+                self._append({'plan': self.plan.plan_id})
+
+            for folder in self.plan.folders:
+                if folder in done_folders:
+                    continue
+                try:
+                    self.plan.dest.joinpath(*folder.split('/')).mkdir(exist_ok=True)
+                except OSError as e:
+                    stats.add_error()
+                    logger.error(f'{folder} could not be created in {self.plan.dest}: {e}')
+                    continue
+                self._append({'d': folder})
+
+            pending = threading.BoundedSemaphore(4 * self.workers)
+
+            def done(file: PlannedFile, future: Future) -> None:
+                pending.release()
+                # Errors other than OSError are not expected by _copy_one, they would be lost with the future otherwise.
+                error = future.exception()
+                if error is not None:
+                    stats.add_error()
+                    logger.error(f'{file.path} could not be copied: {error!r}', exc_info=error)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for file in self.plan.files:
+                    if file.path in done_files:
+                        stats.add_skipped()
+                        continue
+                    pending.acquire()
+                    executor.submit(self._copy_one, file, stats).add_done_callback(partial(done, file))
+        finally:
+            with self._lock:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+            if self.manifest is not None:
+                self.manifest.flush()
+
+        stats.stop()
+        logger.info(f'plan {self.plan.plan_id} executed: {stats}')
+        return stats
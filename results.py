@@ -0,0 +1,181 @@
+"""
+Compact storage for the findings of a StructureChecker.
+
+Keeping the findings in the lists of the checker means two full Path objects per folder, each one with its own parts
+and cached strings. On trees with millions of folders that is most of the memory of a run. CompactFindings interns the
+folders in a prefix tree instead: every folder is a node id with a parent id and a name, stored in flat arrays, and
+each finding is just a kind and a node id. Full paths are only built when a finding is read back. Node ids are 32 bit,
+which is enough for about 2 billion folders.
+"""
+
+from array import array
+from pathlib import Path
+from typing import Dict, Tuple, Iterator, Iterable, Optional
+
+from checker import Finding, FindingKind
+
+_KINDS = list(FindingKind)
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+
+
+class PathTrie:
+    """
+    Prefix tree of relative paths. Node 0 is the root, every other node has a parent node and a name. Ids of nodes
+    never change. Names are kept encoded back to back in a single buffer instead of as separate str objects.
+    """
+    __slots__ = ('_parents', '_name_data', '_name_ends', '_lookup')
+
+    def __init__(self):
+        self._parents = array('i', [-1])
+        self._name_data = bytearray()
+        self._name_ends = array('q', [0])
+        # (parent id, name) -> id, only needed while interning new paths. Dropped by freeze.
+        self._lookup: Optional[Dict[Tuple[int, str], int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def intern(self, parts: Tuple[str, ...]) -> int:
+        """
+        Gets the node of a relative path, adding it (and its missing parents) if needed.
+
+        :param parts: The parts of the path.
+        :return: The id of the node.
+        """
+        if self._lookup is None:
+            raise RuntimeError('PathTrie is frozen, no new paths can be interned.')
+        node = 0
+        lookup = self._lookup
+        for name in parts:
+            key = (node, name)
+            child = lookup.get(key)
+            if child is None:
+                child = len(self._parents)
+                self._parents.append(node)
+                self._name_data += name.encode('utf-8', 'surrogateescape')
+                self._name_ends.append(len(self._name_data))
+                lookup[key] = child
+            node = child
+        return node
+
+    def name(self, node: int) -> str:
+        """
+        Gets the name of a node.
+        """
+        return self._name_data[self._name_ends[node - 1]:self._name_ends[node]].decode('utf-8', 'surrogateescape') \
+            if node > 0 else ''
+
+    def parts(self, node: int) -> Tuple[str, ...]:
+        """
+        Gets the parts of the relative path of a node.
+        """
+        parts = []
+        parents = self._parents
+        while node > 0:
+            parts.append(self.name(node))
+            node = parents[node]
+        return tuple(reversed(parts))
+
+    def freeze(self) -> None:
+        """
+        Drops the lookup table used for interning, which is most of the memory of the tree. Ids and parts keep
+        working but no new paths can be added.
+        """
+        self._lookup = None
+
+
+class CompactFindings:
+    """
+    Memory efficient store for the findings of a StructureChecker. Findings are kept in the order they were added.
+
+    :param src: The src directory of the checker.
+    :param dest: The dest directory of the checker.
+    """
+    __slots__ = ('src', 'dest', 'src_len', 'paths', '_kinds', '_nodes', '_data_nodes')
+
+    def __init__(self, src: Path, dest: Path):
+        self.src = src
+        self.dest = dest
+        self.src_len = len(src.parts)
+        self.paths = PathTrie()
+        self._kinds = array('b')
+        self._nodes = array('i')
+        # Node of the enclosing data folder for skipped folders, -1 for every other finding.
+        self._data_nodes = array('i')
+
+    @classmethod
+    def from_findings(cls, src: Path, dest: Path, findings: Iterable[Finding]) -> 'CompactFindings':
+        """
+        Creates the store from a stream of findings, usually StructureChecker.iter_findings, and freezes it.
+        """
+        store = cls(src, dest)
+        store.extend(findings)
+        store.paths.freeze()
+        return store
+
+    def __len__(self) -> int:
+        return len(self._kinds)
+
+    def add(self, finding: Finding) -> None:
+        """
+        Stores a finding.
+        """
+        src_len = self.src_len
+        self._kinds.append(_KIND_CODES[finding.kind])
+        self._nodes.append(self.paths.intern(finding.src.parts[src_len:]))
+        if finding.kind is FindingKind.SKIPPED:
+            self._data_nodes.append(self.paths.intern(finding.dest.parts[src_len:]))
+        else:
+            self._data_nodes.append(-1)
+
+    def extend(self, findings: Iterable[Finding]) -> None:
+        """
+        Stores several findings.
+        """
+        for finding in findings:
+            self.add(finding)
+
+    def src_path(self, node: int) -> Path:
+        """
+        Builds the src path of a node.
+        """
+        return self.src.joinpath(*self.paths.parts(node))
+
+    def dest_path(self, node: int) -> Path:
+        """
+        Builds the dest path of a node.
+        """
+        return self.dest.joinpath(*self.paths.parts(node))
+
+    def _finding(self, index: int) -> Finding:
+        kind = _KINDS[self._kinds[index]]
+        node = self._nodes[index]
+        if kind is FindingKind.SKIPPED:
+            return Finding(kind, self.src_path(node), self.src_path(self._data_nodes[index]))
+        return Finding(kind, self.src_path(node), self.dest_path(node))
+
+    def __getitem__(self, index: int) -> Finding:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('CompactFindings index out of range')
+        return self._finding(index)
+
+    def __iter__(self) -> Iterator[Finding]:
+        for index in range(len(self)):
+            yield self._finding(index)
+
+    def of_kind(self, kind: FindingKind) -> Iterator[Finding]:
+        """
+        Goes through the findings of a single kind, building their paths on demand.
+        """
+        code = _KIND_CODES[kind]
+        for index, finding_code in enumerate(self._kinds):
+            if finding_code == code:
+                yield self._finding(index)
+
+    def count(self, kind: FindingKind) -> int:
+        """
+        Counts the findings of a single kind without building any path.
+        """
+        return self._kinds.count(_KIND_CODES[kind])
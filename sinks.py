@@ -0,0 +1,148 @@
+"""
+Notification sinks for the log forwarder. A sink is whatever LogReaderEventHandler sends the log messages to. The Slack
+one lives in log_reader.py (SlackCommunicator). The ones here need no token or network access to Slack, which makes them
+useful to run the forwarder offline and to measure it:
+
+    * JsonlFileSink: appends every message as a JSON line to a local file.
+    * WebhookSink: posts every message as JSON to an HTTP endpoint.
+    * MemorySink: keeps every message in memory, with the time it was received.
+"""
+
+import json
+import time
+import queue
+import threading
+import urllib.request
+from pathlib import Path
+from typing import Optional, List, Tuple, Any
+
+
+class NotificationSink:
+    """
+    Interface of the notification sinks.
+
+    :param config: The complete configuration dictionary taken from the configuration file. Messages sent without a
+        message config use its 'status' section.
+    """
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config if config is not None else {}
+
+    def send_message(self, message: str, message_config: Optional[dict] = None) -> Any:
+        """
+        Sends a message.
+
+        :param message: The string to send.
+        :param message_config: Optional config dictionary with the field 'channel' and optionally the field 'tag',
+            like the level sections of the configuration file.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Sends anything still pending and releases the resources of the sink.
+        """
+        pass
+
+    def _resolve(self, message_config: Optional[dict]) -> dict:
+        if message_config is None:
+            message_config = self.config.get('status', {})
+        return message_config
+
+    def _record(self, message: str, message_config: Optional[dict]) -> dict:
+        """
+        Builds the JSON serializable representation of a message.
+        """
+        message_config = self._resolve(message_config)
+        return {'time': time.time(), 'channel': message_config.get('channel'), 'tag': message_config.get('tag', []),
+                'text': message}
+
+
+class JsonlFileSink(NotificationSink):
+    """
+    Appends every message as a line of JSON to a file.
+
+    :param path: The file to write to.
+    :param config: The complete configuration dictionary.
+    """
+    def __init__(self, path: Path, config: Optional[dict] = None):
+        super().__init__(config)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def send_message(self, message: str, message_config: Optional[dict] = None) -> None:
+        line = json.dumps(self._record(message, message_config)) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class WebhookSink(NotificationSink):
+    """
+    Posts every message as a JSON object (see NotificationSink._record) to an HTTP endpoint, from a background thread
+    so that send_message never waits for the network. Failed posts are printed and dropped.
+
+    :param url: The endpoint.
+    :param config: The complete configuration dictionary.
+    :param timeout: Timeout of every post, in seconds.
+    """
+    def __init__(self, url: str, config: Optional[dict] = None, timeout: float = 10.0):
+        super().__init__(config)
+        self.url = url
+        self.timeout = timeout
+        self._queue: 'queue.Queue[Optional[dict]]' = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='WebhookSink', daemon=True)
+        self._thread.start()
+
+    def send_message(self, message: str, message_config: Optional[dict] = None) -> None:
+        self._queue.put(self._record(message, message_config))
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            request = urllib.request.Request(self.url, data=json.dumps(record).encode(),
+                                             headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+            except OSError as e:
+                print(f'Error: message could not be posted to {self.url}: {e}')
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+class MemorySink(NotificationSink):
+    """
+    Keeps every message in memory together with the time.perf_counter() value of when it was received. Meant for tests
+    and load tests.
+
+    :param config: The complete configuration dictionary.
+    """
+    def __init__(self, config: Optional[dict] = None):
+        super().__init__(config)
+        self._condition = threading.Condition()
+        self.messages: List[Tuple[float, str, dict]] = []
+
+    def send_message(self, message: str, message_config: Optional[dict] = None) -> None:
+        received = time.perf_counter()
+        message_config = self._resolve(message_config)
+        with self._condition:
+            self.messages.append((received, message, message_config))
+            self._condition.notify_all()
+
+    def wait_for(self, count: int, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until at least count messages have been received.
+
+        :return: True if they were received, False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self.messages) >= count, timeout)
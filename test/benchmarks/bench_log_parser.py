@@ -0,0 +1,113 @@
+"""
+Compares the lines per second of log_reader.LogLineParser against the per line code path it replaced (re.sub,
+time.strptime, time.mktime and str.split for every line), and against log_reader.JsonLineParser on the same lines
+written in the JSON lines format. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_log_parser.py --lines 200000
+"""
+
+import re
+import json
+import time
+import argparse
+from typing import List
+
+import log_reader
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+
+def synthetic_lines(count: int, lines_per_second: int = 1000) -> List[str]:
+    """
+    Generates log lines in the format of log.setup_logging, lines_per_second lines for every second.
+    """
+    start = time.mktime((2022, 5, 1, 10, 0, 0, 0, 0, -1))
+    return [f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start + i // lines_per_second))}\t| "
+            f"instrument\t| {LEVELS[i % 4]}\t| reading {i} from channel {i % 16}"
+            for i in range(count)]
+
+
+def json_lines(count: int, lines_per_second: int = 1000) -> List[str]:
+    """
+    The same lines as synthetic_lines, in the format of log.setup_logging(file_format='json').
+    """
+    start = time.mktime((2022, 5, 1, 10, 0, 0, 0, 0, -1))
+    return [json.dumps({'time': start + i / lines_per_second, 'name': 'instrument', 'level': LEVELS[i % 4],
+                        'message': f'reading {i} from channel {i % 16}'})
+            for i in range(count)]
+
+
+def old_parse(lines: List[str], date_fmt: str = '%Y-%m-%d %H:%M:%S') -> int:
+    """
+    The parsing done for every line before LogLineParser.
+
+    :return: The number of lines parsed.
+    """
+    parsed = 0
+    for line in lines:
+        sections = line.split("|")
+        line_time = time.mktime(time.strptime(re.sub(r'\t+', '', sections[0]), date_fmt))
+        category = re.sub(r'\t+| +', '', sections[2])
+        message = sections[0] + ':' + sections[2] + ':' + sections[3]
+        parsed += 1
+    return parsed
+
+
+def new_parse(lines: List[str]) -> int:
+    """
+    Parsing with LogLineParser.
+
+    :return: The number of lines parsed.
+    """
+    parse = log_reader.LogLineParser().parse
+    parsed = 0
+    for line in lines:
+        record = parse(line)
+        message = record.format()
+        parsed += 1
+    return parsed
+
+
+def json_parse(lines: List[str]) -> int:
+    """
+    Parsing with JsonLineParser.
+
+    :return: The number of lines parsed.
+    """
+    parse = log_reader.JsonLineParser().parse
+    parsed = 0
+    for line in lines:
+        record = parse(line)
+        message = record.format()
+        parsed += 1
+    return parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--lines-per-second', type=int, default=1000)
+    args = parser.parse_args()
+
+    lines = synthetic_lines(args.lines, args.lines_per_second)
+
+    t0 = time.perf_counter()
+    old_parse(lines)
+    old_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new_parse(lines)
+    new_time = time.perf_counter() - t0
+
+    lines = json_lines(args.lines, args.lines_per_second)
+    t0 = time.perf_counter()
+    json_parse(lines)
+    json_time = time.perf_counter() - t0
+
+    print(f'old code path:  {args.lines / old_time:12.0f} lines/s')
+    print(f'LogLineParser:  {args.lines / new_time:12.0f} lines/s ({old_time / new_time:.1f}x)')
+    print(f'JsonLineParser: {args.lines / json_time:12.0f} lines/s ({old_time / json_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
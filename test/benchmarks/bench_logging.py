@@ -0,0 +1,64 @@
+"""
+Measures how much of the StructureChecker walk goes to logging. Times the walk of a synthetic tree (see generators.py)
+with the logger of the checker set up by log.setup_logging in different ways. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_logging.py --depth 5 --fanout 6
+"""
+
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+import log
+import checker
+from generators import generate_tree
+
+MODES = {
+    'file, DEBUG': {'stream_handler_level': logging.DEBUG},
+    'queue, DEBUG': {'stream_handler_level': logging.DEBUG, 'use_queue': True},
+    'file, INFO': {'stream_handler_level': logging.INFO},
+    'queue, INFO': {'stream_handler_level': logging.INFO, 'use_queue': True},
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        stats = generate_tree(root, args.depth, args.fanout, files=0)
+        print(f'{stats.folders} folders')
+        src, dest = root.joinpath('src'), root.joinpath('dest')
+
+        logging.getLogger('filechecker').setLevel(logging.CRITICAL)
+        best = min(_time(src, dest) for _ in range(args.repeat))
+        print(f'{"no logging":14} {best:.3f} s')
+
+        for name, options in MODES.items():
+            log_file = root.joinpath('bench.log')
+            log.setup_logging(False, str(log_file), **options)
+            best = min(_time(src, dest) for _ in range(args.repeat))
+            t0 = time.perf_counter()
+            log.stop_logging()
+            drain = time.perf_counter() - t0
+            print(f'{name:14} {best:.3f} s  ({drain:.3f} s draining the queue at the end)')
+            for h in list(logging.getLogger('filechecker').handlers):
+                logging.getLogger('filechecker').removeHandler(h)
+                h.close()
+            log_file.unlink()
+
+
+def _time(src: Path, dest: Path) -> float:
+    t0 = time.perf_counter()
+    checker.StructureChecker(src, dest)
+    return time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Copying a data folder of many small files one by one against packing it into a single archive (see packer.py), and
+the scaling of the parallel compression with the number of workers. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_packer.py --files 20000 --latency 0.0005
+
+--latency adds a sleep to every file opened for writing and every rename, to emulate the metadata round trips of a
+network share, which is what packing avoids.
+"""
+
+import os
+import time
+import logging
+import argparse
+import builtins
+import tempfile
+from pathlib import Path
+
+import checker
+import copier
+import packer
+
+WORKERS = [1, 2, 4, 8]
+
+
+def add_latency(latency: float) -> None:
+    """
+    Makes every os.open, open for writing and os.replace call of this process take latency seconds more.
+    """
+    os_open, os_replace, builtin_open = os.open, os.replace, builtins.open
+
+    def slow_os_open(path, flags, *args, **kwargs):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            time.sleep(latency)
+        return os_open(path, flags, *args, **kwargs)
+
+    def slow_replace(*args, **kwargs):
+        time.sleep(latency)
+        return os_replace(*args, **kwargs)
+
+    def slow_open(file, mode='r', *args, **kwargs):
+        if any(c in mode for c in 'wax+'):
+            time.sleep(latency)
+        return builtin_open(file, mode, *args, **kwargs)
+
+    os.open, os.replace, builtins.open = slow_os_open, slow_replace, slow_open
+
+
+def fill(folder: Path, files: int, size: int) -> None:
+    for i in range(files):
+        sub = folder.joinpath(f'run{i // 1000}')
+        if i % 1000 == 0:
+            sub.mkdir(parents=True)
+        # Text-like content so that compression has something to do.
+        sub.joinpath(f'out{i}.txt').write_bytes((f'{i} {i * 0.5} {i ** 2}\n' * (size // 16 + 1))[:size].encode())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=2048, help='Size of every file, in bytes.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every file written.')
+    parser.add_argument('--codecs', nargs='+', default=['gzip', 'xz'])
+    args = parser.parse_args()
+
+    logging.getLogger('filechecker').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        src, dest = root.joinpath('src'), root.joinpath('dest')
+        fill(src.joinpath('project', 'simulation'), args.files, args.size)
+        dest.joinpath('project').mkdir(parents=True)
+        if args.latency:
+            add_latency(args.latency)
+        file_checker = checker.StructureChecker(src, dest)
+        total = args.files * args.size / 1e6
+
+        start = time.perf_counter()
+        copier.DataFolderCopier(file_checker, workers=8).copy()
+        elapsed = time.perf_counter() - start
+        print(f'copy, 8 workers: {elapsed:.2f} s, {args.files / elapsed:.0f} files/s')
+
+        for codec in args.codecs:
+            for workers in WORKERS:
+                archive = dest.joinpath('project', 'simulation' + packer.CODECS[codec][0])
+                packer.index_path(archive).unlink(missing_ok=True)
+                start = time.perf_counter()
+                packer.DataFolderPacker(file_checker, codec, workers=workers).pack()
+                elapsed = time.perf_counter() - start
+                ratio = total / (archive.stat().st_size / 1e6)
+                print(f'pack {codec}, {workers} workers: {elapsed:.2f} s, {args.files / elapsed:.0f} files/s, '
+                      f'{total / elapsed:.1f} MB/s, ratio {ratio:.1f}')
+
+
+if __name__ == '__main__':
+    main()
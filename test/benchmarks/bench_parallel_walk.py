@@ -0,0 +1,80 @@
+"""
+Scaling of the parallel walk of the StructureChecker from 1 to 32 workers, with threads and with processes, on a
+synthetic tree (see generators.py) with many top level project folders. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_parallel_walk.py --projects 200 --latency 0.0005
+
+A local disk answers metadata requests in microseconds, so the walk is bound by Python and threads do not help much.
+--latency adds a sleep to every os.scandir and os.stat call to emulate a network or parallel file system, where the
+walk is bound by the latency of those requests instead.
+"""
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+import checker
+from generators import generate_tree
+
+WORKERS = [1, 2, 4, 8, 16, 32]
+
+
+def add_latency(latency: float) -> None:
+    """
+    Makes every os.scandir and os.stat call of this process (and of the processes it forks) take latency seconds more.
+    """
+    scandir, stat = os.scandir, os.stat
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(latency)
+        return scandir(*args, **kwargs)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(latency)
+        return stat(*args, **kwargs)
+
+    os.scandir, os.stat = slow_scandir, slow_stat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=200, help='Number of top level folders.')
+    parser.add_argument('--depth', type=int, default=3, help='Levels of folders inside every project.')
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every metadata request.')
+    parser.add_argument('--executors', nargs='+', default=['thread', 'process'])
+    args = parser.parse_args()
+
+    logging.getLogger('filechecker').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        src, dest = root.joinpath('src'), root.joinpath('dest')
+        folders = 0
+        for i in range(args.projects):
+            folders += generate_tree(root.joinpath(f'project{i}'), args.depth, args.fanout, seed=i).folders
+            src.joinpath(f'project{i}').mkdir(parents=True)
+            dest.joinpath(f'project{i}').mkdir(parents=True)
+            root.joinpath(f'project{i}', 'src').rename(src.joinpath(f'project{i}', 'tree'))
+            root.joinpath(f'project{i}', 'dest').rename(dest.joinpath(f'project{i}', 'tree'))
+        print(f'{args.projects} projects, {folders} folders, {args.latency * 1000:.2f} ms per metadata request')
+
+        if args.latency:
+            add_latency(args.latency)
+
+        baseline = None
+        for executor in args.executors:
+            for workers in WORKERS:
+                t0 = time.perf_counter()
+                checker.StructureChecker(src, dest, workers=workers, executor=executor)
+                elapsed = time.perf_counter() - t0
+                if baseline is None:
+                    baseline = elapsed
+                print(f'{executor:8} {workers:3} workers: {elapsed:7.3f} s ({baseline / elapsed:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the memory used to hold the findings of a StructureChecker in its lists against a CompactFindings store.
+
+The findings are synthetic (no tree is created on disk): a tree of projects with nested folders, with a mix of found,
+problematic, data and skipped folders. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_results_memory.py --folders 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import checker
+from checker import Finding, FindingKind
+from results import CompactFindings
+
+SRC = Path('/data/lab/src')
+DEST = Path('/mnt/backup/lab/dest')
+
+
+def synthetic_findings(folders: int, fanout: int = 10) -> Iterator[Finding]:
+    """
+    Generates findings for a tree with the given number of folders, in walk order.
+
+    :param folders: Number of folders (and findings) to generate.
+    :param fanout: Number of subfolders of every folder.
+    """
+    count = 0
+    level = [((), None)]
+    while count < folders:
+        next_level = []
+        for rel, data_folder in level:
+            for i in range(fanout):
+                if count >= folders:
+                    return
+                name = f'measurement' if i == 0 and data_folder is None else f'folder_{count:08d}'
+                child = rel + (name,)
+                src = SRC.joinpath(*child)
+                if data_folder is not None:
+                    yield Finding(FindingKind.SKIPPED, src, data_folder)
+                    next_level.append((child, data_folder))
+                elif name == 'measurement':
+                    yield Finding(FindingKind.DATA_FOLDER, src, DEST.joinpath(*child))
+                    next_level.append((child, src))
+                elif i % 3:
+                    yield Finding(FindingKind.TARGET_FOUND, src, DEST.joinpath(*child))
+                    next_level.append((child, None))
+                else:
+                    yield Finding(FindingKind.PROBLEMATIC, src, DEST.joinpath(*child))
+                    next_level.append((child, None))
+                count += 1
+        level = next_level
+
+
+def measure(build) -> tuple:
+    """
+    Measures the memory kept alive by the object returned by build. The object is dropped before returning, so that
+    the next measurement does not share any of its strings.
+
+    :return: A tuple with the bytes the object keeps allocated, the peak bytes while building it and the time it took.
+    """
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - t0
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    return current, peak, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folders', type=int, default=200000)
+    args = parser.parse_args()
+
+    def build_lists():
+        file_checker = checker.StructureChecker(SRC, DEST, scan=False)
+        for finding in synthetic_findings(args.folders):
+            file_checker.collect(finding)
+        return file_checker
+
+    def build_compact():
+        return CompactFindings.from_findings(SRC, DEST, synthetic_findings(args.folders))
+
+    lists_current, lists_peak, lists_time = measure(build_lists)
+    compact_current, compact_peak, compact_time = measure(build_compact)
+
+    print(f'{args.folders} findings')
+    print(f'lists:            {lists_current / 1e6:8.1f} MB held ({lists_current / args.folders:6.0f} B/finding), '
+          f'peak {lists_peak / 1e6:8.1f} MB, {lists_time:.2f} s')
+    print(f'CompactFindings:  {compact_current / 1e6:8.1f} MB held ({compact_current / args.folders:6.0f} B/finding), '
+          f'peak {compact_peak / 1e6:8.1f} MB, {compact_time:.2f} s')
+    print(f'reduction:        {lists_current / compact_current:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of the folder walk of the StructureChecker against the original src.glob('**/*') implementation.
+
+Creates a synthetic src/dest tree (about 1M entries by default) in a temporary directory and times both
+implementations on it. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/bench_walker.py --projects 100
+
+The tree has, for every project, a few regular folders mirrored in dest plus a measurement and a simulation folder with
+nested subfolders full of files, which is where most of the entries of a real data share are.
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import checker
+
+
+def create_tree(root: Path, projects: int, subfolders: int, files: int) -> int:
+    """
+    Creates the synthetic tree.
+
+    :param root: Folder in which src and dest get created.
+    :param projects: Number of project folders.
+    :param subfolders: Number of subfolders inside each data folder.
+    :param files: Number of files inside each subfolder of a data folder.
+    :return: The number of entries created in src.
+    """
+    src = root.joinpath('src')
+    dest = root.joinpath('dest')
+    entries = 0
+    for i in range(projects):
+        for folder in ['code', 'code/analysis', 'notes']:
+            src.joinpath(f'project{i}', folder).mkdir(parents=True)
+            dest.joinpath(f'project{i}', folder).mkdir(parents=True)
+            entries += 1
+        for data_name in ['measurement', 'simulation']:
+            data_folder = src.joinpath(f'project{i}', data_name)
+            for j in range(subfolders):
+                subfolder = data_folder.joinpath(f'run{j}')
+                subfolder.mkdir(parents=True)
+                for k in range(files):
+                    subfolder.joinpath(f'data{k}.dat').touch()
+                entries += files + 1
+            entries += 1
+        entries += 1
+    return entries
+
+
+def glob_check_folders(src: Path, dest: Path) -> int:
+    """
+    The folder check as it was implemented with glob and a linear scan over the data folders.
+
+    :return: The number of folders found.
+    """
+    data_folders = []
+    found = 0
+    for item in src.glob('**/*'):
+        if item.is_dir():
+            found += 1
+            if any(item.is_relative_to(data_folder) for data_folder in data_folders):
+                continue
+            target_path = dest.joinpath(*item.parts[len(src.parts):])
+            if item.name in ['measurement', 'simulation']:
+                data_folders.append(item)
+            target_path.is_dir()
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=250)
+    parser.add_argument('--subfolders', type=int, default=40)
+    parser.add_argument('--files', type=int, default=49)
+    args = parser.parse_args()
+
+    logging.getLogger('filechecker').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        t0 = time.perf_counter()
+        entries = create_tree(root, args.projects, args.subfolders, args.files)
+        print(f'created {entries} entries in {time.perf_counter() - t0:.1f} s')
+        src, dest = root.joinpath('src'), root.joinpath('dest')
+
+        t0 = time.perf_counter()
+        glob_check_folders(src, dest)
+        glob_time = time.perf_counter() - t0
+        print(f'glob walk:                         {glob_time:.2f} s')
+
+        t0 = time.perf_counter()
+        checker.StructureChecker(src, dest)
+        scandir_time = time.perf_counter() - t0
+        print(f'scandir walk:                      {scandir_time:.2f} s ({glob_time / scandir_time:.1f}x)')
+
+        t0 = time.perf_counter()
+        checker.StructureChecker(src, dest, track_skipped=False)
+        pruned_time = time.perf_counter() - t0
+        print(f'scandir walk, pruned data folders: {pruned_time:.2f} s ({glob_time / pruned_time:.1f}x)')
+
+        t0 = time.perf_counter()
+        checker.StructureChecker(src, dest, index_dest=True)
+        index_time = time.perf_counter() - t0
+        print(f'scandir walk, dest index:          {index_time:.2f} s ({glob_time / index_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
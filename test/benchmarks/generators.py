@@ -0,0 +1,115 @@
+"""
+Generators of synthetic input for the benchmarks: src/dest trees for the StructureChecker and the copier, and streams
+of log lines in the format written by log.setup_logging for the log reader.
+"""
+
+import time
+import random
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, Optional
+
+DATA_NAMES = ['measurement', 'simulation']
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+
+class TreeStats(NamedTuple):
+    folders: int
+    data_folders: int
+    missing: int
+    files: int
+    bytes: int
+
+
+def generate_tree(root: Path, depth: int = 3, fanout: int = 5, data_ratio: float = 0.2, missing_ratio: float = 0.1,
+                  files: int = 10, file_size: int = 0, seed: int = 0) -> TreeStats:
+    """
+    Creates root/src and root/dest. Every folder of src has fanout subfolders, down to depth levels. Each subfolder
+    is a data folder with probability data_ratio, as long as its parent does not hold one of every name the
+    StructureChecker looks for yet (so keep fanout * data_ratio below 2 for the ratio to hold). Data folders are not
+    descended into further and hold files files of file_size bytes. Every other folder is a regular folder with a copy
+    in dest, missing with probability missing_ratio (and always missing if its parent is). The tree is the same for the
+    same arguments.
+
+    :param root: Folder in which src and dest get created.
+    :param depth: Number of levels of folders below src.
+    :param fanout: Number of subfolders of every regular folder.
+    :param data_ratio: Fraction of the folders that are data folders.
+    :param missing_ratio: Fraction of the regular folders that do not exist in dest.
+    :param files: Number of files inside every data folder.
+    :param file_size: Size, in bytes, of every file.
+    :param seed: Seed of the random choices.
+    :return: A summary of what got created.
+    """
+    rng = random.Random(seed)
+    src = root.joinpath('src')
+    dest = root.joinpath('dest')
+    src.mkdir(parents=True)
+    dest.mkdir(parents=True)
+    content = rng.randbytes(file_size) if file_size else b''
+    folders = data_folders = missing = file_count = 0
+
+    level = [((), True)]
+    for _ in range(depth):
+        next_level = []
+        for rel, in_dest in level:
+            free_names = list(DATA_NAMES)
+            for i in range(fanout):
+                folders += 1
+                if rng.random() < data_ratio and free_names:
+                    data_folder = src.joinpath(*rel, free_names.pop(0))
+                    data_folder.mkdir()
+                    data_folders += 1
+                    for j in range(files):
+                        data_folder.joinpath(f'data{j:05d}.dat').write_bytes(content)
+                    file_count += files
+                    continue
+                child = rel + (f'folder{i}',)
+                src.joinpath(*child).mkdir()
+                child_in_dest = in_dest and rng.random() >= missing_ratio
+                if child_in_dest:
+                    dest.joinpath(*child).mkdir()
+                else:
+                    missing += 1
+                next_level.append((child, child_in_dest))
+        level = next_level
+
+    return TreeStats(folders, data_folders, missing, file_count, file_count * file_size)
+
+
+def log_line(i: int, level: Optional[str] = None, name: str = 'instrument', line_time: Optional[float] = None) -> str:
+    """
+    Formats the synthetic log line number i.
+    """
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(line_time))
+    level = level if level is not None else LEVELS[i % len(LEVELS)]
+    return f'{stamp}\t| {name}\t| {level}\t| line {i} reading {i * 7 % 1000} from channel {i % 16}\n'
+
+
+def write_log_stream(path: Path, count: int, rate: float = 0, batch: int = 1, levels: Iterable[str] = LEVELS,
+                     on_write: Optional[Callable[[range, float], None]] = None) -> float:
+    """
+    Appends count log lines to path.
+
+    :param path: The log file.
+    :param count: Number of lines to write.
+    :param rate: Lines per second, 0 for as fast as possible.
+    :param batch: Number of lines per write.
+    :param levels: Levels of the lines, used in turns.
+    :param on_write: Called after every write with the numbers of the lines written and the time.perf_counter() value
+        of the write.
+    :return: The seconds it took.
+    """
+    levels = list(levels)
+    start = time.perf_counter()
+    with open(path, 'a') as f:
+        for first in range(0, count, batch):
+            if rate:
+                delay = start + first / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            ids = range(first, min(first + batch, count))
+            f.write(''.join(log_line(i, levels[i % len(levels)]) for i in ids))
+            f.flush()
+            if on_write is not None:
+                on_write(ids, time.perf_counter())
+    return time.perf_counter() - start
@@ -0,0 +1,85 @@
+"""
+Load test of the log forwarder. Runs a LogWatcher with a MemorySink on a temporary log file, appends synthetic log
+lines to it at a fixed rate (or as fast as possible) and reports the end to end latency percentiles, from the write of
+a line to the sink receiving its message, and the lines per second forwarded. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/loadtest_forwarder.py --lines 20000 --rate 5000 --batch 10
+"""
+
+import re
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Dict
+
+import log_reader
+from generators import write_log_stream
+
+LEVELS = ['INFO', 'WARNING', 'ERROR']
+LINE_ID = re.compile(r'line (\d+) ')
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest rank percentile of sorted values.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0, help='Lines per second written, 0 for as fast as possible.')
+    parser.add_argument('--batch', type=int, default=1, help='Lines per write.')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the last notification.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        log_file = tmp_path.joinpath('loadtest.log')
+        log_file.touch()
+        conf_path = tmp_path.joinpath('config.py')
+        config = {
+            'files': {str(log_file): {'channel': 'general'}},
+            'sink': {'type': 'memory'},
+            'status': {'channel': 'status'},
+        }
+        config.update({level: {'channel': level.lower()} for level in LEVELS})
+        conf_path.write_text(f'config = {config!r}\n')
+
+        watcher = log_reader.LogWatcher(conf_path)
+        sink = watcher.communicator
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        written: Dict[int, float] = {}
+        try:
+            time.sleep(0.5)
+            start = time.perf_counter()
+            write_log_stream(log_file, args.lines, args.rate, args.batch, LEVELS,
+                             on_write=lambda ids, now: written.update(dict.fromkeys(ids, now)))
+            complete = sink.wait_for(args.lines, timeout=args.timeout)
+            elapsed = time.perf_counter() - start
+        finally:
+            watcher.stop()
+            thread.join()
+
+    latencies = []
+    for received, message, _ in sink.messages:
+        match = LINE_ID.search(message)
+        if match is not None:
+            latencies.append(received - written[int(match.group(1))])
+    latencies.sort()
+
+    if not complete:
+        print(f'Timed out: {len(latencies)} of {args.lines} lines were forwarded.')
+    if not latencies:
+        return
+    print(f'{len(latencies)} lines forwarded in {elapsed:.2f} s: {len(latencies) / elapsed:.0f} lines/s')
+    print('latency (ms): ' + ', '.join(f'p{int(q * 100)} {percentile(latencies, q) * 1000:.2f}'
+                                       for q in (0.5, 0.9, 0.99)) + f', max {latencies[-1] * 1000:.2f}')
+
+
+if __name__ == '__main__':
+    main()
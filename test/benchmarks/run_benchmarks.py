@@ -0,0 +1,178 @@
+"""
+Benchmark suite. Generates a synthetic src/dest tree and a synthetic log file (see generators.py) and measures:
+
+    * StructureChecker: wall time, number of stat and scandir calls, and peak RSS, with the default options, without
+      tracking skipped folders and with the dest index.
+    * LogReaderEventHandler: lines per second read, parsed and forwarded to a MemorySink.
+
+Every benchmark runs in a fresh interpreter, so the peak RSS reported is its own. The results are saved to a JSON file,
+and a previous results file can be given to print the ratios against it. Run it from the root of the repository::
+
+    PYTHONPATH=. python test/benchmarks/run_benchmarks.py --output results.json
+    PYTHONPATH=. python test/benchmarks/run_benchmarks.py --output new.json --compare results.json
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict
+
+from generators import generate_tree, write_log_stream
+
+CHECKER_CASES = {
+    'checker_default': {},
+    'checker_pruned': {'track_skipped': False},
+    'checker_dest_index': {'index_dest': True},
+}
+
+
+class CallCounter:
+    """
+    Counts the calls to functions of the os module while active.
+
+    :param names: Names of the functions of the os module to count.
+    """
+    def __init__(self, *names: str):
+        self.counts: Dict[str, int] = {name: 0 for name in names}
+        self._originals: Dict[str, Callable] = {}
+
+    def _wrap(self, name: str, function: Callable) -> Callable:
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self) -> 'CallCounter':
+        for name in self.counts:
+            self._originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self._originals[name]))
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for name, function in self._originals.items():
+            setattr(os, name, function)
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process, in MB.
+    """
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def bench_checker(root: str, options: dict) -> dict:
+    import checker
+
+    # Keeps the missing folders of the tree from flooding the output.
+    logging.getLogger('filechecker').setLevel(logging.CRITICAL)
+    src, dest = Path(root, 'src'), Path(root, 'dest')
+    with CallCounter('stat', 'lstat', 'scandir') as counter:
+        t0 = time.perf_counter()
+        structure_checker = checker.StructureChecker(src, dest, **options)
+        wall_time = time.perf_counter() - t0
+    return {'wall_time': wall_time, 'calls': counter.counts, 'peak_rss_mb': peak_rss_mb(),
+            'problematic': len(structure_checker.problematic_folders),
+            'data_folders': len(structure_checker.data_folders)}
+
+
+def bench_log_reader(root: str, lines: int) -> dict:
+    import log_reader
+    from sinks import MemorySink
+    from watchdog.events import FileModifiedEvent
+
+    log_file = Path(root, 'bench.log')
+    levels = ['INFO', 'WARNING', 'ERROR']
+    config = {'files': {str(log_file): {'channel': 'general'}}, 'status': {'channel': 'status'}}
+    config.update({level: {'channel': level.lower()} for level in levels})
+    sink = MemorySink(config)
+    handler = log_reader.LogReaderEventHandler(config, sink, state_path=Path(root, 'bench_state.json'))
+    write_log_stream(log_file, lines, levels=levels)
+
+    t0 = time.perf_counter()
+    handler.on_modified(FileModifiedEvent(str(log_file)))
+    elapsed = time.perf_counter() - t0
+    return {'wall_time': elapsed, 'lines_per_second': lines / elapsed, 'messages': len(sink.messages),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_isolated(function: Callable, *args) -> dict:
+    """
+    Runs function(*args) in a new interpreter and returns its result.
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: dict, previous: dict) -> None:
+    """
+    Prints the ratio of the wall times of results against the ones in previous.
+    """
+    print(f'\ncompared with {previous.get("commit", "")[:10] or "previous run"}:')
+    for name, result in results['results'].items():
+        old = previous.get('results', {}).get(name)
+        if old is None:
+            continue
+        print(f'{name:20} {result["wall_time"] / old["wall_time"]:6.2f}x wall time, '
+              f'{result["peak_rss_mb"] / old["peak_rss_mb"]:6.2f}x peak RSS')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--data-ratio', type=float, default=0.2)
+    parser.add_argument('--missing-ratio', type=float, default=0.1)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--file-size', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-lines', type=int, default=200000)
+    parser.add_argument('--output', type=Path, help='JSON file the results are saved to.')
+    parser.add_argument('--compare', type=Path, help='JSON file of a previous run to compare with.')
+    args = parser.parse_args()
+
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    results = {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'params': params, 'results': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        stats = generate_tree(Path(tmp), args.depth, args.fanout, args.data_ratio, args.missing_ratio, args.files,
+                              args.file_size, args.seed)
+        results['tree'] = stats._asdict()
+        print(f'created {stats.folders} folders and {stats.files} files in {time.perf_counter() - t0:.1f} s')
+
+        for name, options in CHECKER_CASES.items():
+            result = run_isolated(bench_checker, tmp, options)
+            results['results'][name] = result
+            print(f'{name:20} {result["wall_time"]:8.3f} s  {result["peak_rss_mb"]:7.1f} MB  {result["calls"]}')
+
+        result = run_isolated(bench_log_reader, tmp, args.log_lines)
+        results['results']['log_reader'] = result
+        print(f'{"log_reader":20} {result["wall_time"]:8.3f} s  {result["peak_rss_mb"]:7.1f} MB  '
+              f'{result["lines_per_second"]:.0f} lines/s')
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,14 @@ python file with a dictionary called config.
 The dictionary must have at most 8 different keys, 2 of which are special keys:
 
     * 'files': The files key indicate what logging files the LogReader should monitor. It must be a dictionary whose keys
-        are the file paths to monitor. The values are again another nested dictionary with the following keys:
+        are the file paths to monitor. The file name of a key can also be a glob pattern (e.g. 'D:/logs/*.log'): every
+        file in that folder matching it gets monitored, including the ones created while the LogReader runs, which are
+        read from the start, and the ones deleted or renamed to a name not matching it stop being monitored. The values
+        are again another nested dictionary with the following keys:
             * 'period': The period, in hours, key indicates how often this file should receive updates.
                 E.g: If a backup should happen every 24 hours, this period should be 24, so that the LogReader knows
-                that the backup did not happen at the right time.
+                that the backup did not happen at the right time. For a pattern, an update of any file matching it
+                counts.
             * 'channel': The channel where alarms respecting the periodicity of the updates should go.
                 E.g: What channel does the LogReader sends a warning if the log did not receive the appropriate updates.
             * 'tag': Optional, A list containing what users should be tagged.
@@ -17,12 +21,39 @@ The dictionary must have at most 8 different keys, 2 of which are special keys:
 
     * 'token': The Slack app authentication token.
 
+    * 'state_file': Optional. Path of the file where the LogReader saves how far it has read every log file, so that
+        lines written while it was not running get reported after a restart. Defaults to a file named like the config
+        file with '_state.json' at the end, in the same folder. The state is saved at most once every
+        'checkpoint_interval' seconds (default 1).
+
+    * 'catch_up_mode': Optional. What to do on start with the lines written since the state was saved: 'forward'
+        (default) sends at most 'catch_up_max_lines' (default 100) of them per file and a single summary of the rest,
+        'summary' only sends the summary and 'skip' ignores them.
+
+    * 'slack_cache': Optional. Path of the file where the ids of the Slack users and channels are cached. Defaults to a
+        file named like the config file with '_slack_cache.json' at the end, in the same folder.
+
+    * 'slack_cache_ttl': Optional. Time, in hours, the cache of users and channels is valid for. Defaults to 24.
+
+    * 'metrics_file': Optional. Path of a file where the LogReader writes its metrics (lines read, Slack queue depth
+        and post latency, ...) every 'metrics_interval' seconds (default 15). In JSON if the file ends in '.json', in
+        the Prometheus text format otherwise.
+
+    * 'sink': Optional. Where the messages go. Defaults to 'slack'. To send them somewhere else, a dictionary with the
+        key 'type' and its options: {'type': 'jsonl', 'path': <file>} appends them to a JSON lines file,
+        {'type': 'webhook', 'url': <url>} posts them as JSON to an HTTP endpoint and {'type': 'memory'} keeps them in
+        memory (for tests). 'token' is only needed for 'slack'.
+
 The other 6 are optional and all have the same structure. They are keys that specify where the different levels of
  logging levels should go. All of them have dictionary as values that look have the same structure,
  they hold 2 different keys:
 
     * 'channel': The channel on which to send the messages regarding that level of message.
     * 'tag': Optional. List of usernames to tag for updates of that level.
+    * 'dedup_window': Optional. Time, in seconds, during which repetitions of the same message are not sent. A single
+        summary with the number of repetitions is sent once the time is over instead.
+
+The optional key 'dedup_max_entries' sets how many different messages are aggregated at the same time (default 10000).
 
 The 6 levels are:
     * 'status': sending messages for general updates about the LogReader itself.
@@ -45,5 +76,6 @@ config = {
     'WARNING': {'channel': 'general',
                 'tag': ['user1']},
     'ERROR': {'channel': 'extra-channel',
-              'tag': ['user1', 'user2']},
+              'tag': ['user1', 'user2'],
+              'dedup_window': 300},
 }
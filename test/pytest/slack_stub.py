@@ -0,0 +1,114 @@
+"""
+Local stand-in for the parts of the Slack Web API used by log_reader: users.list, conversations.list (both with cursor
+pagination) and chat.postMessage. Runs an HTTP server in a background thread; point a WebClient at it with base_url.
+"""
+
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Tuple, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from slack_sdk import WebClient
+
+
+class SlackStub:
+    """
+    :param users: Dictionary mapping user names to ids.
+    :param channels: Dictionary mapping channel names to ids.
+    :param page_size: Number of users or channels per page of the list methods.
+    """
+    def __init__(self, users: Optional[Dict[str, str]] = None, channels: Optional[Dict[str, str]] = None,
+                 page_size: int = 2):
+        self.users = users if users is not None else {'user1': 'U1', 'user2': 'U2', 'user3': 'U3'}
+        self.channels = channels if channels is not None else {'general': 'C1', 'status': 'C2', 'errors': 'C3'}
+        self.page_size = page_size
+
+        self.lock = threading.Lock()
+        self.posts: List[Tuple[str, str]] = []
+        self.calls: List[str] = []
+        # Number of upcoming chat.postMessage calls answered with a rate limit error, and with a server error.
+        self.rate_limit_next = 0
+        self.retry_after = '0.2'
+        self.fail_next = 0
+        # Time, in seconds, every call to a list method takes.
+        self.list_delay = 0.0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.handle_call()
+
+            def do_POST(self):
+                self.handle_call()
+
+            def handle_call(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                if body:
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+                status, headers, response = stub.call(url.path.rsplit('/', 1)[-1], params)
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/api/'
+
+    def client(self) -> WebClient:
+        return WebClient(token='xoxb-test', base_url=self.url)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _page(self, items: Dict[str, str], params: dict, key: str, make) -> Tuple[int, dict, dict]:
+        names = list(items)
+        start = int(params.get('cursor') or 0)
+        limit = min(int(params.get('limit') or self.page_size), self.page_size)
+        page = names[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(names) else ''
+        return 200, {}, {'ok': True, key: [make(name, items[name]) for name in page],
+                         'response_metadata': {'next_cursor': next_cursor}}
+
+    def call(self, method: str, params: dict) -> Tuple[int, dict, dict]:
+        if method.endswith('.list'):
+            time.sleep(self.list_delay)
+        with self.lock:
+            self.calls.append(method)
+            if method == 'users.list':
+                return self._page(self.users, params, 'members', lambda name, id: {'name': name, 'id': id})
+            if method == 'conversations.list':
+                return self._page(self.channels, params, 'channels', lambda name, id: {'name': name, 'id': id})
+            if method == 'chat.postMessage':
+                if params['channel'] not in self.channels.values():
+                    return 200, {}, {'ok': False, 'error': 'channel_not_found'}
+                if self.rate_limit_next > 0:
+                    self.rate_limit_next -= 1
+                    return 429, {'Retry-After': self.retry_after}, {'ok': False, 'error': 'ratelimited'}
+                if self.fail_next > 0:
+                    self.fail_next -= 1
+                    return 500, {}, {'ok': False, 'error': 'internal_error'}
+                self.posts.append((params['channel'], params['text']))
+                return 200, {}, {'ok': True, 'channel': params['channel'], 'ts': str(len(self.posts))}
+            return 200, {}, {'ok': False, 'error': 'unknown_method'}
@@ -158,7 +158,152 @@ def test_folder_inside_measurement(tmp_path):
     assert file_checker.skipped_folders[0] == extra_folder
 
 
+def glob_check(src_path: Path, dest_path: Path) -> dict:
+    """Reference implementation of the check, as it was done with src.glob('**/*')."""
+    results = {'problematic': [], 'data': [], 'create': [], 'found': [], 'skipped': []}
+    for item in src_path.glob('**/*'):
+        if item.is_dir():
+            if any(item.is_relative_to(data_folder) for data_folder in results['data']):
+                results['skipped'].append(item)
+                continue
+            target_path = dest_path.joinpath(*item.parts[len(src_path.parts):])
+            if item.name in ['measurement', 'simulation']:
+                results['data'].append(item)
+                if not target_path.is_dir():
+                    results['create'].append((item, target_path))
+            elif target_path.is_dir():
+                results['found'].append((item, target_path))
+            else:
+                results['problematic'].append((item, target_path))
+    return results
+
+
+def test_walker_matches_glob(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
 
+    for folder in ['project1/a/b/c', 'project1/measurement/x/y', 'project1/measurement/simulation/z',
+                   'project2/a/measurement/q', 'project3/simulation', 'project3/b/c']:
+        src_path.joinpath(folder).mkdir(parents=True)
+    for folder in ['project1/a/b', 'project3/b']:
+        dest_path.joinpath(folder).mkdir(parents=True)
+    src_path.joinpath('project1/a/file.txt').write_text('text_file')
+    src_path.joinpath('project1/measurement/x/file.txt').write_text('text_file')
 
+    expected = glob_check(src_path, dest_path)
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    assert file_checker.problematic_folders == expected['problematic']
+    assert file_checker.data_folders == expected['data']
+    assert file_checker.create_data_folders == expected['create']
+    assert file_checker.target_founds == expected['found']
+    assert file_checker.skipped_folders == expected['skipped']
 
 
+def test_not_tracking_skipped_folders(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    src_path.joinpath('project1', 'measurement', 'extra folder', 'deeper').mkdir(parents=True)
+
+    file_checker = checker.StructureChecker(src_path, dest_path, track_skipped=False)
+    assert len(file_checker.problematic_folders) == 0
+    assert len(file_checker.target_founds) == 2
+    assert len(file_checker.data_folders) == 2
+    assert len(file_checker.create_data_folders) == 0
+    assert len(file_checker.skipped_folders) == 0
+
+
+def test_dest_index_matches_stat(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+
+    for folder in ['project1/a/b/c', 'project2/a/measurement', 'project3/simulation', 'project3/b/c']:
+        src_path.joinpath(folder).mkdir(parents=True)
+    for folder in ['project1/a/b', 'project3/b']:
+        dest_path.joinpath(folder).mkdir(parents=True)
+    dest_path.joinpath('project1/a/c').write_text('a file, not a folder')
+
+    expected = checker.StructureChecker(src_path, dest_path)
+    file_checker = checker.StructureChecker(src_path, dest_path, index_dest=True)
+    assert file_checker.problematic_folders == expected.problematic_folders
+    assert file_checker.data_folders == expected.data_folders
+    assert file_checker.create_data_folders == expected.create_data_folders
+    assert file_checker.target_founds == expected.target_founds
+    assert file_checker.skipped_folders == expected.skipped_folders
+
+
+def test_dest_index_does_not_list_missing_folders(tmp_path):
+    create_basic_structure(tmp_path)
+    dest_path = tmp_path.joinpath('dest')
+
+    index = checker.DestinationIndex(dest_path)
+    assert index.has_folder(('project1', 'measurement'))
+    assert not index.has_folder(('project1', 'missing', 'deeper', 'deepest'))
+    assert index.listing(('project1', 'missing')) is None
+    assert index.listing(('project1', 'missing', 'deeper')) is None
+    assert set(index.listing(())) == {'project1', 'project2'}
+
+
+def test_iter_findings(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    src_path.joinpath('project1', 'extra_folder').mkdir()
+    src_path.joinpath('project1', 'measurement', 'extra folder').mkdir()
+    src_path.joinpath('project2', 'measurement').mkdir()
+
+    file_checker = checker.StructureChecker(src_path, dest_path, scan=False)
+    assert len(file_checker.target_founds) == 0
+
+    findings = list(file_checker.iter_findings())
+    assert len(file_checker.target_founds) == 0
+    kinds = [finding.kind for finding in findings]
+    assert kinds.count(checker.FindingKind.TARGET_FOUND) == 2
+    assert kinds.count(checker.FindingKind.DATA_FOLDER) == 3
+    assert kinds.count(checker.FindingKind.SKIPPED) == 1
+    assert checker.Finding(checker.FindingKind.PROBLEMATIC, src_path.joinpath('project1', 'extra_folder'),
+                           dest_path.joinpath('project1', 'extra_folder')) in findings
+
+    create = kinds.index(checker.FindingKind.CREATE_DATA_FOLDER)
+    assert findings[create].src == src_path.joinpath('project2', 'measurement')
+    assert findings[create + 1] == checker.Finding(checker.FindingKind.DATA_FOLDER,
+                                                   src_path.joinpath('project2', 'measurement'),
+                                                   dest_path.joinpath('project2', 'measurement'))
+
+    file_checker.check_folders()
+    assert len(file_checker.problematic_folders) == 1
+    assert len(file_checker.create_data_folders) == 1
+
+
+def test_parallel_walk_matches_sequential(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    for folder in ['project1/a/b/c', 'project1/measurement/x/y', 'project2/a/measurement/q', 'project3/simulation',
+                   'project3/b/c', 'project4/d/e/f', 'measurement/top']:
+        src_path.joinpath(folder).mkdir(parents=True)
+    for folder in ['project1/a/b', 'project3/b', 'project4/d']:
+        dest_path.joinpath(folder).mkdir(parents=True)
+
+    for track_skipped in [True, False]:
+        expected = list(checker.StructureChecker(src_path, dest_path, track_skipped=track_skipped,
+                                                 scan=False).iter_findings())
+        for options in [{'workers': 4}, {'workers': 3, 'split_depth': 2, 'index_dest': True},
+                        {'workers': 2, 'executor': 'process'}]:
+            parallel = checker.StructureChecker(src_path, dest_path, track_skipped=track_skipped, scan=False,
+                                                **options)
+            assert list(parallel.iter_findings()) == expected
+
+    sequential = checker.StructureChecker(src_path, dest_path)
+    parallel = checker.StructureChecker(src_path, dest_path, workers=8)
+    assert parallel.problematic_folders == sequential.problematic_folders
+    assert parallel.data_folders == sequential.data_folders
+    assert parallel.create_data_folders == sequential.create_data_folders
+    assert parallel.skipped_folders == sequential.skipped_folders
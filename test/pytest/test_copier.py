@@ -0,0 +1,154 @@
+import os
+import errno
+from pathlib import Path
+
+import checker
+import copier
+from manifest import Manifest
+
+from test_checker import create_basic_structure
+
+
+def fill_measurement(src_path: Path) -> None:
+    measurement = src_path.joinpath('project1', 'measurement')
+    measurement.joinpath('run1', 'raw').mkdir(parents=True)
+    measurement.joinpath('data.dat').write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    measurement.joinpath('run1', 'notes.txt').write_text('notes')
+    measurement.joinpath('run1', 'raw', 'empty.dat').touch()
+
+
+def test_copy_data_folders(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    src_path.joinpath('project2', 'new', 'simulation').mkdir(parents=True)
+    dest_path.joinpath('project2', 'new').mkdir()
+    src_path.joinpath('project2', 'new', 'simulation', 'output.h5').write_bytes(b'output')
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    stats = copier.DataFolderCopier(file_checker, workers=2).copy()
+    assert stats.files == 4
+    assert stats.errors == 0
+
+    for file in ['project1/measurement/data.dat', 'project1/measurement/run1/notes.txt',
+                 'project1/measurement/run1/raw/empty.dat', 'project2/new/simulation/output.h5']:
+        assert dest_path.joinpath(file).read_bytes() == src_path.joinpath(file).read_bytes()
+        assert dest_path.joinpath(file).stat().st_mtime_ns == src_path.joinpath(file).stat().st_mtime_ns
+    assert not list(dest_path.glob('**/*.part'))
+
+
+def test_unchanged_files_are_skipped(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    copier.DataFolderCopier(file_checker).copy()
+
+    src_path.joinpath('project1', 'measurement', 'run1', 'notes.txt').write_text('new notes')
+    stats = copier.DataFolderCopier(file_checker).copy()
+    assert stats.files == 1
+    assert stats.skipped == 2
+    assert dest_path.joinpath('project1', 'measurement', 'run1', 'notes.txt').read_text() == 'new notes'
+
+
+def test_chunked_fallback(tmp_path, monkeypatch):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'not supported')
+
+    monkeypatch.setattr(os, 'copy_file_range', unsupported, raising=False)
+    monkeypatch.setattr(os, 'sendfile', unsupported, raising=False)
+
+    src = tmp_path.joinpath('src.dat')
+    dest = tmp_path.joinpath('dest.dat')
+    src.write_bytes(os.urandom(1024 * 1024 + 3))
+    assert copier.copy_file(src, dest, buffer_size=64 * 1024) == src.stat().st_size
+    assert dest.read_bytes() == src.read_bytes()
+
+
+def test_data_folder_without_dest_parent(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    src_path.joinpath('project3', 'measurement').mkdir(parents=True)
+    src_path.joinpath('project3', 'measurement', 'data.dat').write_bytes(b'data')
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    stats = copier.DataFolderCopier(file_checker).copy()
+    assert stats.files == 0
+    assert not dest_path.joinpath('project3').exists()
+
+
+def test_copy_while_walking(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    src_path.joinpath('project2', 'new', 'simulation').mkdir(parents=True)
+    dest_path.joinpath('project2', 'new').mkdir()
+    src_path.joinpath('project2', 'new', 'simulation', 'output.h5').write_bytes(b'output')
+
+    file_checker = checker.StructureChecker(src_path, dest_path, scan=False)
+    stats = copier.DataFolderCopier(file_checker).copy(file_checker.iter_findings())
+    assert stats.files == 4
+    assert dest_path.joinpath('project2', 'new', 'simulation', 'output.h5').read_bytes() == b'output'
+    assert len(file_checker.data_folders) == 0
+
+
+def test_unreadable_folders_are_skipped(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    src_path.joinpath('project2', 'simulation', 'run1').mkdir()
+    src_path.joinpath('project2', 'simulation', 'run1', 'output.h5').write_bytes(b'output')
+    src_path.joinpath('project2', 'simulation', 'summary.txt').write_text('summary')
+    # A stray file where a folder should be created.
+    dest_path.joinpath('project2', 'simulation', 'run1').write_text('stray')
+
+    stats = copier.DataFolderCopier(checker.StructureChecker(src_path, dest_path)).copy()
+    assert stats.errors == 1
+    assert stats.files == 4
+    assert dest_path.joinpath('project2', 'simulation', 'summary.txt').read_text() == 'summary'
+    assert dest_path.joinpath('project1', 'measurement', 'data.dat').is_file()
+
+
+def test_unexpected_errors_are_counted(tmp_path, monkeypatch):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    measurement = src_path.joinpath('project1', 'measurement')
+    measurement.joinpath('data2.dat').write_bytes(measurement.joinpath('data.dat').read_bytes())
+    copy_file = copier.copy_file
+
+    def failing_copy(src, *args):
+        if src.name.startswith('data'):
+            raise ValueError('unexpected')
+        return copy_file(src, *args)
+
+    monkeypatch.setattr(copier, 'copy_file', failing_copy)
+    # With dedup the two data files have the same content, the second one waits for the copy of the first.
+    with Manifest.for_dest(dest_path) as manifest:
+        stats = copier.DataFolderCopier(checker.StructureChecker(src_path, dest_path), workers=2, manifest=manifest,
+                                        dedup=True).copy()
+    assert stats.errors == 2
+    assert stats.files == 2
+
+
+def test_files_named_like_temporary_files(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    measurement = src_path.joinpath('project1', 'measurement')
+    for i in range(20):
+        measurement.joinpath(f'x{i}').write_bytes(os.urandom(100 * 1024))
+        measurement.joinpath(f'x{i}.part').write_bytes(os.urandom(100 * 1024))
+
+    stats = copier.DataFolderCopier(checker.StructureChecker(src_path, dest_path), workers=4).copy()
+    assert stats.files == 40 and stats.errors == 0
+    for src in measurement.iterdir():
+        assert dest_path.joinpath('project1', 'measurement', src.name).read_bytes() == src.read_bytes()
+    assert len(list(dest_path.joinpath('project1', 'measurement').iterdir())) == 40
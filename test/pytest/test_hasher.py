@@ -0,0 +1,77 @@
+import os
+
+import checker
+import copier
+from hasher import FileHasher
+from manifest import Manifest
+
+from test_checker import create_basic_structure
+
+
+def test_hash_does_not_depend_on_workers(tmp_path):
+    big = tmp_path.joinpath('big.dat')
+    big.write_bytes(os.urandom(5 * 1024 * 1024 + 11))
+    small = tmp_path.joinpath('small.dat')
+    small.write_bytes(b'small')
+    empty = tmp_path.joinpath('empty.dat')
+    empty.touch()
+
+    with FileHasher(workers=1, chunk_size=1024 * 1024) as hasher:
+        expected = {path: hasher.hash_file(path) for path in [big, small, empty]}
+    with FileHasher(workers=8, chunk_size=1024 * 1024) as hasher:
+        assert dict(hasher.hash_files([big, small, empty], window=2)) == expected
+
+    assert len(set(expected.values())) == 3
+
+
+def test_duplicates_are_hardlinked(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+
+    content = os.urandom(256 * 1024)
+    for folder in ['project1/measurement', 'project2/simulation']:
+        src_path.joinpath(folder, 'output.h5').write_bytes(content)
+        src_path.joinpath(folder, 'copy.h5').write_bytes(content)
+    src_path.joinpath('project2/simulation/other.h5').write_bytes(b'other')
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    with Manifest.for_dest(dest_path) as manifest:
+        stats = copier.DataFolderCopier(file_checker, workers=4, manifest=manifest, dedup=True, verify=True).copy()
+        assert stats.files == 2
+        assert stats.linked == 3
+        assert stats.verify_errors == 0
+
+    inodes = {dest_path.joinpath(folder, name).stat().st_ino
+              for folder in ['project1/measurement', 'project2/simulation'] for name in ['output.h5', 'copy.h5']}
+    assert len(inodes) == 1
+
+    # A later run links new duplicates to files recorded in the manifest.
+    src_path.joinpath('project1/measurement/third.h5').write_bytes(content)
+    with Manifest.for_dest(dest_path) as manifest:
+        stats = copier.DataFolderCopier(file_checker, manifest=manifest, dedup=True).copy()
+        assert stats.files == 0
+        assert stats.linked == 1
+
+
+def test_verification_finds_mismatches(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    src_path.joinpath('project1/measurement/data.dat').write_bytes(b'data')
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    data_copier = copier.DataFolderCopier(file_checker, verify=True)
+    stats = data_copier.copy()
+    assert stats.verify_errors == 0
+
+    dest_path.joinpath('project1/measurement/data.dat').write_bytes(b'corrupted')
+    with FileHasher() as hasher:
+        data_copier.hasher = hasher
+        assert data_copier.verify_copies() == [dest_path.joinpath('project1/measurement/data.dat')]
+
+    # A dest file that disappeared is reported instead of aborting the verification.
+    dest_path.joinpath('project1/measurement/data.dat').unlink()
+    with FileHasher() as hasher:
+        data_copier.hasher = hasher
+        assert data_copier.verify_copies() == [dest_path.joinpath('project1/measurement/data.dat')]
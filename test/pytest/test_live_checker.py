@@ -0,0 +1,90 @@
+import time
+
+from live_checker import LiveStructureChecker
+
+from test_checker import create_basic_structure
+
+
+def wait_for(condition, timeout=5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def test_incremental_updates(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+
+    alerts = []
+    live = LiveStructureChecker(src_path, dest_path, alert=lambda src, dest: alerts.append(src))
+    live.check_folders()
+    live._live = True
+    assert len(live.target_founds) == 2
+    assert len(live.data_folders) == 2
+
+    # A whole tree moved into src.
+    new_tree = src_path.joinpath('project3')
+    new_tree.joinpath('a', 'b').mkdir(parents=True)
+    new_tree.joinpath('simulation', 'inside').mkdir(parents=True)
+    live.src_created(new_tree)
+    assert sorted(alerts) == [new_tree, new_tree.joinpath('a'), new_tree.joinpath('a', 'b')]
+    assert len(live.problematic_folders) == 3
+    assert (new_tree.joinpath('simulation'), dest_path.joinpath('project3', 'simulation')) in live.create_data_folders
+
+    # Creating part of it in dest.
+    dest_path.joinpath('project3', 'a').mkdir(parents=True)
+    live.dest_changed(dest_path.joinpath('project3'))
+    assert [src for src, _ in live.problematic_folders] == [new_tree.joinpath('a', 'b')]
+    assert len(live.target_founds) == 4
+
+    dest_path.joinpath('project3', 'simulation').mkdir()
+    live.dest_changed(dest_path.joinpath('project3', 'simulation'))
+    assert live.create_data_folders == []
+
+    # Folders inside data folders are ignored.
+    live.src_created(src_path.joinpath('project1', 'measurement', 'new'))
+    assert len(live.problematic_folders) == 1
+
+    # Deleting a dest folder makes its src folders problematic again.
+    dest_path.joinpath('project3', 'a').rmdir()
+    live.dest_changed(dest_path.joinpath('project3', 'a'))
+    assert len(live.problematic_folders) == 2
+    assert alerts[-1] == new_tree.joinpath('a')
+
+    # Deleting the src tree forgets everything inside it.
+    live.src_deleted(new_tree)
+    assert live.problematic_folders == []
+    assert len(live.target_founds) == 2
+    assert len(live.data_folders) == 2
+
+
+def test_watching(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+
+    with LiveStructureChecker(src_path, dest_path) as live:
+        assert len(live.target_founds) == 2
+        src_path.joinpath('project1', 'extra_folder').mkdir()
+        assert wait_for(lambda: len(live.problematic_folders) == 1)
+        dest_path.joinpath('project1', 'extra_folder').mkdir()
+        assert wait_for(lambda: len(live.problematic_folders) == 0 and len(live.target_founds) == 3)
+
+
+def test_nested_folders_are_alerted_once(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+
+    alerts = []
+    with LiveStructureChecker(src_path, dest_path, alert=lambda src, dest: alerts.append(src)) as live:
+        nested = src_path.joinpath('project1', 'a', 'b', 'c', 'd')
+        nested.mkdir(parents=True)
+        assert wait_for(lambda: len(live.problematic_folders) == 4)
+        # Give the events of the deeper levels time to arrive.
+        time.sleep(0.5)
+    assert sorted(alerts) == [nested.parents[2], nested.parents[1], nested.parent, nested]
@@ -0,0 +1,58 @@
+import logging
+
+import log
+import log_reader
+
+
+def test_queue_mode_keeps_the_file_format(tmp_path):
+    log_file = tmp_path.joinpath('queued.log')
+    log.setup_logging(False, str(log_file), name='test_queue', use_queue=True, flush_interval=0.05)
+    logger = logging.getLogger('test_queue')
+    assert any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers)
+    for i in range(100):
+        logger.info(f'message {i}')
+    logger.error('failed')
+    log.stop_logging('test_queue')
+    assert logger.handlers == []
+
+    parser = log_reader.LogLineParser(log.FILE_DATE_FORMAT)
+    records = [parser.parse(line) for line in log_file.read_text().splitlines()]
+    assert all(record is not None for record in records)
+    assert [record.message for record in records[1:]] == [f'message {i}' for i in range(100)] + ['failed']
+    assert records[-1].level == 'ERROR' and records[-1].name == 'test_queue'
+
+
+def test_buffered_handler_rotates_and_flushes(tmp_path):
+    log_file = tmp_path.joinpath('rotating.log')
+    handler = log.BufferedRotatingFileHandler(str(log_file), max_bytes=1000, backup_count=2, flush_interval=0)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.getLogger('test_rotating')
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        logger.info('buffered')
+        assert log_file.read_text() == ''
+        logger.warning('flushed')
+        assert log_file.read_text() == 'buffered\nflushed\n'
+
+        for i in range(200):
+            logger.info(f'line {i:05d}')
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert tmp_path.joinpath('rotating.log.1').exists() and tmp_path.joinpath('rotating.log.2').exists()
+    assert not tmp_path.joinpath('rotating.log.3').exists()
+    assert all(path.stat().st_size < 1000 for path in tmp_path.glob('rotating.log*'))
+    assert log_file.read_text().splitlines()[-1] == 'line 00199'
+
+
+def test_level_fast_path(tmp_path):
+    log.setup_logging(False, str(tmp_path.joinpath('info.log')), name='test_level',
+                      stream_handler_level=logging.INFO)
+    logger = logging.getLogger('test_level')
+    assert not logger.isEnabledFor(logging.DEBUG)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        h.close()
@@ -0,0 +1,615 @@
+import os
+import time
+import threading
+from pathlib import Path
+
+import pytest
+from watchdog.events import FileModifiedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+import log_reader
+
+from slack_stub import SlackStub
+
+
+class FakeCommunicator:
+    """
+    Stand-in for the SlackCommunicator that keeps the messages instead of sending them.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message, message_config=None):
+        self.messages.append((message, message_config))
+
+
+def log_line(level: str, message: str, name: str = 'filechecker') -> str:
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t| {name}\t| {level}\t| {message}\n"
+
+
+def make_config(log_file: Path) -> dict:
+    return {
+        'files': {str(log_file): {'period': 1, 'channel': 'general'}},
+        'status': {'channel': 'status'},
+        'ERROR': {'channel': 'errors'},
+        'INFO': {'channel': 'general'},
+    }
+
+
+def modified(handler: log_reader.LogReaderEventHandler, log_file: Path) -> None:
+    handler.on_modified(FileModifiedEvent(str(log_file)))
+
+
+def test_only_new_lines_are_sent(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    log_file.write_text(log_line('ERROR', 'written before starting'))
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(make_config(log_file), communicator)
+
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'first'))
+        f.write(log_line('DEBUG', 'not configured'))
+        f.write(log_line('INFO', 'second'))
+    modified(handler, log_file)
+    assert len(communicator.messages) == 2
+    assert 'first' in communicator.messages[0][0]
+    assert 'second' in communicator.messages[1][0]
+    assert communicator.messages[0][1] == {'channel': 'errors'}
+
+    # Lines in the same second as the last read are not lost, and partial lines wait for their newline.
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'third'))
+        f.write(log_line('ERROR', 'fourth')[:20])
+    modified(handler, log_file)
+    assert len(communicator.messages) == 3
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'fourth')[20:])
+    modified(handler, log_file)
+    assert len(communicator.messages) == 4
+    assert 'fourth' in communicator.messages[3][0]
+
+
+def test_rotation_and_truncation(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    log_file.write_text(log_line('ERROR', 'old'))
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(make_config(log_file), communicator)
+
+    os.rename(log_file, tmp_path.joinpath('test.log.1'))
+    log_file.write_text(log_line('ERROR', 'after rotation'))
+    modified(handler, log_file)
+    assert len(communicator.messages) == 1
+    assert 'after rotation' in communicator.messages[0][0]
+
+    log_file.write_text(log_line('ERROR', 'truncated'))
+    modified(handler, log_file)
+    assert len(communicator.messages) == 2
+    assert 'truncated' in communicator.messages[1][0]
+
+
+def test_offsets_survive_restarts(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    state_file = tmp_path.joinpath('state.json')
+    log_file.write_text(log_line('ERROR', 'before'))
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(make_config(log_file), communicator, state_path=state_file)
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'first'))
+    modified(handler, log_file)
+    assert len(communicator.messages) == 1
+
+    # Written while the handler was not running.
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'while down'))
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(make_config(log_file), communicator, state_path=state_file)
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'after restart'))
+    modified(handler, log_file)
+    assert len(communicator.messages) == 2
+    assert 'while down' in communicator.messages[0][0]
+    assert 'after restart' in communicator.messages[1][0]
+
+
+def test_parser_matches_strptime():
+    parser = log_reader.LogLineParser()
+    for asctime in ['2021-03-14 01:59:59', '2021-03-14 03:00:00', '2021-12-31 23:59:59', '2022-01-01 00:00:00']:
+        line = f'{asctime}\t| filechecker\t| ERROR\t| message with | inside'
+        record = parser.parse(line)
+        assert record.time == time.mktime(time.strptime(asctime, '%Y-%m-%d %H:%M:%S'))
+        assert record.asctime == asctime
+        assert record.name == 'filechecker'
+        assert record.level == 'ERROR'
+        assert record.message == 'message with | inside'
+
+    assert parser.parse('not a log line') is None
+    assert parser.parse('garbage\t| a\t| b\t| c') is None
+
+    other = log_reader.LogLineParser('%d/%m/%Y %H:%M')
+    assert other.parse('14/03/2021 10:30\t| x\t| INFO\t| m').time == \
+        time.mktime(time.strptime('14/03/2021 10:30', '%d/%m/%Y %H:%M'))
+
+
+@pytest.fixture
+def slack():
+    stub = SlackStub()
+    yield stub
+    stub.close()
+
+
+def test_dispatcher_coalesces_per_channel(slack):
+    dispatcher = log_reader.SlackDispatcher(slack.client(), min_interval=0.3)
+    dispatcher.submit('C1', 'first')
+    assert dispatcher.flush(5)
+
+    t0 = time.perf_counter()
+    for i in range(500):
+        dispatcher.submit('C3', f'error {i}')
+    dispatcher.submit('C1', 'second')
+    dispatcher.submit('C1', 'third')
+    assert time.perf_counter() - t0 < 0.5
+    assert dispatcher.flush(5)
+    dispatcher.stop()
+
+    c1 = [text for channel, text in slack.posts if channel == 'C1']
+    c3 = [text for channel, text in slack.posts if channel == 'C3']
+    assert c1 == ['first', 'second\nthird']
+    assert '\n'.join(c3).split('\n') == [f'error {i}' for i in range(500)]
+    assert len(c3) < 10
+    assert all(len(text) <= dispatcher.max_chars for text in c3)
+
+
+def test_dispatcher_retries(slack):
+    slack.rate_limit_next = 2
+    slack.fail_next = 1
+    dispatcher = log_reader.SlackDispatcher(slack.client(), backoff=0.05)
+    dispatcher.submit('C1', 'message')
+    assert dispatcher.flush(5)
+    dispatcher.stop()
+    assert slack.posts == [('C1', 'message')]
+    assert slack.calls.count('chat.postMessage') == 4
+
+
+def test_communicator_queues_messages(slack):
+    config = {'token': 'xoxb-test', 'status': {'channel': 'status'},
+              'ERROR': {'channel': 'errors', 'tag': ['user1', 'all']}}
+    communicator = log_reader.SlackCommunicator(config, client=slack.client())
+    assert communicator.send_message('something broke', config['ERROR']) is None
+    communicator.close()
+
+    assert slack.posts[0][0] == 'C2'
+    assert 'ENGAGED' in slack.posts[0][1]
+    assert ('C3', '<@U1>, <!channel>, something broke') in slack.posts
+    assert 'DISENGAGED' in slack.posts[-1][1]
+
+
+def test_names_are_looked_up_by_the_dispatcher(slack):
+    slack.list_delay = 0.3
+    config = {'token': 'xoxb-test', 'status': {'channel': 'status'}}
+    start = time.perf_counter()
+    communicator = log_reader.SlackCommunicator(config, client=slack.client())
+    communicator.send_message('lost', {'channel': 'missing'})
+    communicator.send_message('tagged', {'channel': 'general', 'tag': ['user3']})
+    assert time.perf_counter() - start < 0.2
+    communicator.close()
+    assert ('C1', '<@U3>, tagged') in slack.posts
+    assert not any('lost' in text for _, text in slack.posts)
+
+
+def test_repeated_messages_are_aggregated():
+    now = [0.0]
+    communicator = FakeCommunicator()
+    config = {'ERROR': {'channel': 'errors', 'dedup_window': 60}, 'INFO': {'channel': 'general'},
+              'dedup_max_entries': 2}
+    aggregator = log_reader.MessageAggregator(config, communicator, clock=lambda: now[0])
+
+    def record(level, message, name='instrument'):
+        return log_reader.LogRecord(now[0], '2022-05-01 10:00:00', name, level, message)
+
+    for i in range(100):
+        aggregator.submit(record('ERROR', f'timeout after {i} s'))
+        aggregator.submit(record('INFO', 'not aggregated'))
+        now[0] += 0.1
+    assert len(communicator.messages) == 101
+    assert aggregator.flush_expired() == pytest.approx(50)
+
+    aggregator.submit(record('ERROR', 'timeout after 3 s', name='other module'))
+    assert len(communicator.messages) == 102
+
+    now[0] = 71
+    assert aggregator.flush_expired() is None
+    assert len(communicator.messages) == 103
+    assert communicator.messages[-1] == ('2022-05-01 10:00:00: ERROR: timeout after 0 s '
+                                         '(repeated 99 times in the last 71 seconds)', config['ERROR'])
+
+    # When full, the least recently seen message is closed early.
+    aggregator.submit(record('ERROR', 'first'))
+    aggregator.submit(record('ERROR', 'first'))
+    aggregator.submit(record('ERROR', 'second'))
+    aggregator.submit(record('ERROR', 'third'))
+    assert [message for message, _ in communicator.messages[-4:]] == [
+        '2022-05-01 10:00:00: ERROR: first', '2022-05-01 10:00:00: ERROR: second',
+        '2022-05-01 10:00:00: ERROR: third',
+        '2022-05-01 10:00:00: ERROR: first (repeated 1 times in the last 0 seconds)']
+
+
+def write_config(path: Path, config: dict) -> None:
+    path.write_text(f'config = {config!r}\n')
+
+
+def test_watcher_reports_stale_files(tmp_path, slack, monkeypatch):
+    monkeypatch.setattr(log_reader, 'WebClient', lambda token: slack.client())
+    stale_log = tmp_path.joinpath('stale.log')
+    active_log = tmp_path.joinpath('active.log')
+    stale_log.touch()
+    active_log.touch()
+    conf_path = tmp_path.joinpath('config.py')
+    write_config(conf_path, {
+        'files': {str(stale_log): {'period': 0.5 / 3600, 'channel': 'errors'},
+                  str(active_log): {'period': 0.5 / 3600, 'channel': 'errors'}},
+        'token': 'xoxb-test',
+        'status': {'channel': 'status'},
+    })
+
+    watcher = log_reader.LogWatcher(conf_path, resend_period=0.6 / 3600)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        end = time.monotonic() + 1.5
+        while time.monotonic() < end:
+            with open(active_log, 'a') as f:
+                f.write(log_line('DEBUG', 'still alive'))
+            time.sleep(0.1)
+    finally:
+        watcher.stop()
+        thread.join(5)
+    assert not thread.is_alive()
+
+    stale_messages = [text for _, text in slack.posts if 'has not received an update' in text]
+    assert 2 <= len(stale_messages) <= 3
+    assert all(str(stale_log) in text for text in stale_messages)
+
+
+def test_open_windows_are_summarized_on_stop(tmp_path, slack, monkeypatch):
+    monkeypatch.setattr(log_reader, 'WebClient', lambda token: slack.client())
+    log_file = tmp_path.joinpath('test.log')
+    log_file.touch()
+    conf_path = tmp_path.joinpath('config.py')
+    config = make_config(log_file)
+    config.update({'token': 'xoxb-test', 'ERROR': {'channel': 'errors', 'dedup_window': 3600}})
+    write_config(conf_path, config)
+
+    watcher = log_reader.LogWatcher(conf_path)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        with open(log_file, 'a') as f:
+            f.write(log_line('ERROR', 'device timeout') * 3)
+        end = time.monotonic() + 5
+        while time.monotonic() < end and not any('device timeout' in text for _, text in slack.posts):
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+        thread.join(5)
+    assert not thread.is_alive()
+
+    errors = '\n'.join(text for channel, text in slack.posts if channel == 'C3').split('\n')
+    assert len(errors) == 2
+    assert 'device timeout (repeated 2 times in the last' in errors[1]
+
+
+def test_directory_is_lazy_and_cached(tmp_path, slack):
+    cache_path = tmp_path.joinpath('cache.json')
+    directory = log_reader.SlackDirectory(slack.client(), cache_path, page_size=2)
+    assert slack.calls == []
+
+    # user1 is in the first page, the listing stops there.
+    assert directory.user_id('user1') == 'U1'
+    assert slack.calls == ['users.list']
+    assert directory.user_id('user2') == 'U2'
+    assert slack.calls == ['users.list']
+    assert directory.user_id('user3') == 'U3'
+    assert slack.calls == ['users.list', 'users.list', 'users.list']
+
+    assert directory.channel_id('missing') is None
+    assert directory.channel_id('missing') is None
+    assert slack.calls.count('conversations.list') == 2
+
+    # A warm cache needs no calls at all.
+    slack.calls.clear()
+    warm = log_reader.SlackDirectory(slack.client(), cache_path)
+    assert warm.user_id('user3') == 'U3'
+    assert warm.channel_id('general') == 'C1'
+    assert slack.calls == []
+
+    expired = log_reader.SlackDirectory(slack.client(), cache_path, ttl=0)
+    assert expired.entries == {'users': {}, 'channels': {}}
+
+
+def test_directory_entries_expire(tmp_path, slack):
+    cache_path = tmp_path.joinpath('cache.json')
+    directory = log_reader.SlackDirectory(slack.client(), cache_path, ttl=100)
+    assert directory.user_id('user1') == 'U1'
+    directory.listed['users']['user1'] -= 200
+
+    # Refreshing for a miss does not make the old entries valid again.
+    assert directory.channel_id('missing') is None
+    assert 'user1' not in log_reader.SlackDirectory(slack.client(), cache_path, ttl=100).entries['users']
+    assert log_reader.SlackDirectory(slack.client(), cache_path, ttl=100).entries['channels']['general'] == 'C1'
+
+    slack.calls.clear()
+    slack.users['user1'] = 'U9'
+    assert directory.user_id('user1') == 'U9'
+    assert slack.calls == ['users.list']
+
+
+@pytest.mark.parametrize('asynchronous', [True, False])
+def test_channels_not_found_are_looked_up_again(slack, asynchronous):
+    config = {'token': 'xoxb-test', 'status': {'channel': 'status'}}
+    communicator = log_reader.SlackCommunicator(config, asynchronous=asynchronous, client=slack.client())
+    assert communicator.directory.channel_id('errors') == 'C3'
+
+    # The channel gets deleted and created again with a new id.
+    slack.channels['errors'] = 'C9'
+    communicator.send_message('first', {'channel': 'errors'})
+    communicator.send_message('second', {'channel': 'errors'})
+    communicator.close()
+    assert [text for channel, text in slack.posts if channel == 'C9'] in (['first\nsecond'], ['first', 'second'])
+    assert communicator.channels['errors'] == 'C9'
+
+
+def test_unknown_names_do_not_raise(slack):
+    config = {'token': 'xoxb-test', 'status': {'channel': 'status'}}
+    communicator = log_reader.SlackCommunicator(config, asynchronous=False, client=slack.client())
+    assert communicator.send_message('lost', {'channel': 'missing'}) is None
+    assert communicator.send_message('tagged', {'channel': 'general', 'tag': ['nobody', 'user2']}) is not None
+    communicator.close()
+    assert ('C1', '<@U2>, tagged') in slack.posts
+
+
+def test_patterns_and_shared_watches(tmp_path):
+    logs = tmp_path.joinpath('logs')
+    logs.mkdir()
+    for name in ['a.log', 'b.log', 'notes.txt']:
+        logs.joinpath(name).write_text(log_line('ERROR', 'written before starting'))
+    explicit = tmp_path.joinpath('other.log')
+    conf_path = tmp_path.joinpath('config.py')
+    write_config(conf_path, {
+        'files': {str(logs.joinpath('*.log')): {'channel': 'general', 'period': 1},
+                  str(logs.joinpath('notes.txt')): {'channel': 'general'},
+                  str(explicit): {'channel': 'general'}},
+        'sink': 'memory',
+        'status': {'channel': 'status'},
+        'ERROR': {'channel': 'errors'},
+    })
+
+    watcher = log_reader.LogWatcher(conf_path)
+    handler = watcher.event_handler
+    assert sorted(handler.files) == sorted(str(logs.joinpath(name)) for name in ['a.log', 'b.log', 'notes.txt']) + \
+        [str(explicit)]
+    assert sorted(handler.directories.values()) == sorted([str(logs), str(tmp_path)])
+
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        with open(logs.joinpath('a.log'), 'a') as f:
+            f.write(log_line('ERROR', 'from a'))
+        # New files matching the pattern are read from the start, the others are ignored.
+        logs.joinpath('c.log').write_text(log_line('ERROR', 'from c'))
+        logs.joinpath('c.txt').write_text(log_line('ERROR', 'ignored'))
+        assert watcher.communicator.wait_for(2, timeout=5)
+        time.sleep(0.2)
+    finally:
+        watcher.stop()
+        thread.join(5)
+
+    messages = sorted(message for _, message, _ in watcher.communicator.messages)
+    assert len(messages) == 2
+    assert 'from a' in messages[0] and 'from c' in messages[1]
+    assert str(logs.joinpath('c.log')) in handler.file_configs
+    # The period applies to the pattern, not to every file matching it.
+    assert list(watcher.last_message_sent) == [str(logs.joinpath('*.log'))]
+    assert handler.updates[str(logs.joinpath('*.log'))] >= handler.files[str(logs.joinpath('c.log'))]
+
+
+def test_files_matching_patterns_are_untracked(tmp_path):
+    logs = tmp_path.joinpath('logs')
+    logs.mkdir()
+    explicit = logs.joinpath('main.txt')
+    explicit.write_text('')
+    config = {
+        'files': {str(logs.joinpath('*.log')): {'channel': 'general', 'period': 1},
+                  str(explicit): {'channel': 'general'}},
+        'ERROR': {'channel': 'errors'},
+    }
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(config, communicator)
+
+    a_log = logs.joinpath('a.log')
+    a_log.write_text(log_line('ERROR', 'first'))
+    handler.on_created(FileCreatedEvent(str(a_log)))
+    assert str(a_log) in handler.files and len(communicator.messages) == 1
+
+    # Renamed to a name matching the pattern: read from where it was left.
+    b_log = logs.joinpath('b.log')
+    with open(a_log, 'a') as f:
+        f.write(log_line('ERROR', 'second'))
+    os.rename(a_log, b_log)
+    handler.on_moved(FileMovedEvent(str(a_log), str(b_log)))
+    assert str(a_log) not in handler.files and str(b_log) in handler.files
+    assert len(communicator.messages) == 2 and 'second' in communicator.messages[1][0]
+
+    # Renamed to a name that does not match it, or deleted: not tracked anymore.
+    os.rename(b_log, logs.joinpath('b.old'))
+    handler.on_moved(FileMovedEvent(str(b_log), str(logs.joinpath('b.old'))))
+    c_log = logs.joinpath('c.log')
+    c_log.write_text('')
+    handler.on_created(FileCreatedEvent(str(c_log)))
+    c_log.unlink()
+    handler.on_deleted(FileDeletedEvent(str(c_log)))
+    assert sorted(handler.files) == [str(explicit)]
+    assert sorted(handler.offsets) == [str(explicit)] and sorted(handler.file_configs) == [str(explicit)]
+
+    # Files given by name stay tracked.
+    explicit.unlink()
+    handler.on_deleted(FileDeletedEvent(str(explicit)))
+    assert str(explicit) in handler.files
+
+
+def test_json_lines_are_detected(tmp_path):
+    import logging
+    import log
+
+    json_log = tmp_path.joinpath('json.log')
+    text_log = tmp_path.joinpath('text.log')
+    config = make_config(json_log)
+    config['files'][str(text_log)] = {'channel': 'general'}
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(config, communicator)
+
+    log.setup_logging(False, str(json_log), name='test_json', file_format='json')
+    logger = logging.getLogger('test_json')
+    logger.error('a message | with pipes\nand a newline')
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        h.close()
+    text_log.write_text(log_line('ERROR', 'plain text'))
+    modified(handler, json_log)
+    modified(handler, text_log)
+
+    assert isinstance(handler.parsers[str(json_log)], log_reader.JsonLineParser)
+    assert isinstance(handler.parsers[str(text_log)], log_reader.LogLineParser)
+    messages = [message for message, _ in communicator.messages]
+    assert len(messages) == 3
+    assert messages[1].endswith(': ERROR: a message | with pipes\nand a newline')
+    assert messages[2].endswith(': ERROR: plain text')
+
+    parser = log_reader.JsonLineParser()
+    record = parser.parse('{"time": 1651399200.5, "name": "n", "level": "INFO", "message": "m"}')
+    assert record.time == 1651399200.5
+    assert record.asctime == time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(1651399200))
+    assert parser.parse('{"time": 1}') is None
+    assert parser.parse('{not json') is None
+
+
+def test_checkpoints_are_batched(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    state_file = tmp_path.joinpath('state.json')
+    log_file.write_text('')
+    config = make_config(log_file)
+    config['checkpoint_interval'] = 60
+
+    handler = log_reader.LogReaderEventHandler(config, FakeCommunicator(), state_path=state_file)
+    for i in range(5):
+        with open(log_file, 'a') as f:
+            f.write(log_line('ERROR', f'line {i}'))
+        modified(handler, log_file)
+    # Saved right after the first change, the next ones wait for the interval.
+    assert log_reader.load_state(state_file)[str(log_file)][1] == len(log_line('ERROR', 'line 0'))
+    assert 59 < handler.checkpoint() <= 60
+
+    handler.checkpoint(force=True)
+    inode, offset, updated = log_reader.load_state(state_file)[str(log_file)]
+    assert offset == log_file.stat().st_size
+    assert updated == handler.files[str(log_file)]
+    assert handler.checkpoint() is None
+
+    # The last update time survives restarts, for the period deadlines.
+    handler = log_reader.LogReaderEventHandler(config, FakeCommunicator(), state_path=state_file)
+    assert handler.files[str(log_file)] == updated
+
+    # State files without the update times are still read.
+    state_file.write_text(f'{{"{log_file}": [{inode}, {offset}]}}')
+    assert log_reader.load_state(state_file) == {str(log_file): (inode, offset, None)}
+
+
+@pytest.mark.parametrize('mode', ['forward', 'summary', 'skip'])
+def test_catch_up(tmp_path, mode):
+    log_file = tmp_path.joinpath('test.log')
+    state_file = tmp_path.joinpath('state.json')
+    log_file.write_text(log_line('ERROR', 'before'))
+    config = make_config(log_file)
+    config['catch_up_mode'] = mode
+    config['catch_up_max_lines'] = 3
+
+    handler = log_reader.LogReaderEventHandler(config, FakeCommunicator(), state_path=state_file)
+    assert handler.catch_up() == 0
+
+    # Written while the handler was not running, in more than one block.
+    with open(log_file, 'a') as f:
+        for i in range(20000):
+            f.write(log_line('INFO' if i % 2 else 'ERROR', f'while down {i}'))
+        f.write(log_line('DEBUG', 'not configured'))
+        f.write(log_line('ERROR', 'partial')[:10])
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(config, communicator, state_path=state_file)
+    read = handler.catch_up()
+    messages = [message for message, _ in communicator.messages]
+    if mode == 'skip':
+        assert read == 0 and messages == []
+    else:
+        assert read == 20001
+        forwarded = 3 if mode == 'forward' else 0
+        assert len(messages) == forwarded + 1
+        assert all(f'while down {i}' in messages[i] for i in range(forwarded))
+        summary = messages[-1]
+        by_level = '9998 ERROR, 9999 INFO' if mode == 'forward' else '10000 ERROR, 10000 INFO'
+        assert f'{20000 - forwarded}' in summary and by_level in summary and 'while down 19999' in summary
+        assert communicator.messages[-1][1] == {'channel': 'errors'}
+
+    # Caught up: the next modification only reads what comes after, starting with the partial line.
+    assert log_reader.load_state(state_file)[str(log_file)][1] == handler.offsets[str(log_file)][1]
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'partial')[10:])
+    communicator.messages.clear()
+    modified(handler, log_file)
+    assert len(communicator.messages) == 1 and 'partial' in communicator.messages[0][0]
+
+
+def test_lines_written_during_start_up_are_read(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    log_file.write_text(log_line('ERROR', 'before'))
+    config = make_config(log_file)
+    initial_offsets = log_reader.current_offsets(config)
+
+    # Written while the sink is being created.
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'during start up'))
+
+    communicator = FakeCommunicator()
+    handler = log_reader.LogReaderEventHandler(config, communicator, initial_offsets=initial_offsets)
+    assert handler.catch_up() == 1
+    assert len(communicator.messages) == 1 and 'during start up' in communicator.messages[0][0]
+
+
+def test_updates_only_wake_up_for_new_deadlines(tmp_path):
+    log_file = tmp_path.joinpath('test.log')
+    log_file.write_text('')
+    config = make_config(log_file)
+    config['ERROR']['dedup_window'] = 60
+    config['checkpoint_interval'] = 60
+    handler = log_reader.LogReaderEventHandler(config, FakeCommunicator(), state_path=tmp_path.joinpath('s.json'))
+    wake_ups = []
+    handler.on_update = lambda: wake_ups.append(1)
+    handler.checkpoint()
+
+    for i in range(10):
+        with open(log_file, 'a') as f:
+            f.write(log_line('INFO', f'update {i}'))
+        modified(handler, log_file)
+    # Only the first change waiting for the checkpoint.
+    assert len(wake_ups) == 1
+
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'timeout after 1 s'))
+        f.write(log_line('ERROR', 'timeout after 2 s'))
+    modified(handler, log_file)
+    # A single window opened.
+    assert len(wake_ups) == 2
+    assert 59 < handler.aggregator.flush_expired() <= 60
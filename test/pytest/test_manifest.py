@@ -0,0 +1,59 @@
+import checker
+import copier
+from manifest import Manifest, ManifestEntry
+
+from test_checker import create_basic_structure
+from test_copier import fill_measurement
+
+
+def test_entries_persist(tmp_path):
+    with Manifest.for_dest(tmp_path, batch_size=2) as manifest:
+        manifest.record(ManifestEntry('project1/measurement/a.dat', 10, 123, 1))
+        manifest.record(ManifestEntry('project1/measurement/b.dat', 20, 456, 2, 'abc'))
+        manifest.record(ManifestEntry('project1/measurement/a.dat', 11, 124, 1))
+
+    with Manifest.for_dest(tmp_path) as manifest:
+        assert len(manifest) == 2
+        assert manifest.get('project1/measurement/a.dat') == ManifestEntry('project1/measurement/a.dat', 11, 124, 1)
+        assert manifest.get('project1/measurement/b.dat').hash == 'abc'
+        assert manifest.get('missing') is None
+        assert manifest.is_unchanged('project1/measurement/a.dat', 11, 124, 1)
+        assert not manifest.is_unchanged('project1/measurement/a.dat', 11, 125, 1)
+
+
+def test_incremental_copy(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    file_checker = checker.StructureChecker(src_path, dest_path)
+
+    with Manifest.for_dest(dest_path) as manifest:
+        stats = copier.DataFolderCopier(file_checker, manifest=manifest).copy()
+        assert stats.files == 3
+        assert len(manifest) == 3
+
+    # Unchanged files are decided from the manifest alone, dest is not looked at.
+    dest_path.joinpath('project1', 'measurement', 'data.dat').unlink()
+    src_path.joinpath('project1', 'measurement', 'run1', 'notes.txt').write_text('new notes')
+    src_path.joinpath('project1', 'measurement', 'new.txt').write_text('new file')
+
+    with Manifest.for_dest(dest_path) as manifest:
+        incremental = copier.DataFolderCopier(file_checker, manifest=manifest)
+        changed = [rel for _, _, rel, _ in incremental.iter_changed_files()]
+    assert sorted(changed) == ['project1/measurement/new.txt', 'project1/measurement/run1/notes.txt']
+
+
+def test_manifest_bootstraps_from_dest(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    copier.DataFolderCopier(file_checker).copy()
+
+    with Manifest.for_dest(dest_path) as manifest:
+        stats = copier.DataFolderCopier(file_checker, manifest=manifest).copy()
+        assert stats.files == 0
+        assert stats.skipped == 3
+        assert len(manifest) == 3
@@ -0,0 +1,88 @@
+import json
+import pstats
+from pathlib import Path
+
+import pytest
+
+import metrics
+import checker
+import log_reader
+
+from test_checker import create_basic_structure
+from test_log_reader import FakeCommunicator, log_line, make_config, modified
+
+
+@pytest.fixture
+def enabled():
+    metrics.REGISTRY.reset()
+    metrics.enable()
+    yield metrics.REGISTRY
+    metrics.disable()
+    metrics.REGISTRY.reset()
+
+
+def test_registry_export(tmp_path):
+    registry = metrics.Registry(enabled=True)
+    counter = registry.counter('things_total', 'Things.')
+    assert registry.counter('things_total', 'Things.') is counter
+    with pytest.raises(ValueError):
+        registry.gauge('things_total', 'Things.')
+    counter.inc(3)
+    histogram = registry.histogram('wait_seconds', 'Waits.', buckets=(0.1, 1))
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value)
+
+    text = registry.to_prometheus()
+    assert '# TYPE things_total counter\nthings_total 3\n' in text
+    assert 'wait_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'wait_seconds_bucket{le="1"} 2\n' in text
+    assert 'wait_seconds_bucket{le="+Inf"} 3\n' in text
+    assert 'wait_seconds_count 3\n' in text
+
+    registry.write(tmp_path.joinpath('metrics.json'))
+    snapshot = json.loads(tmp_path.joinpath('metrics.json').read_text())
+    assert snapshot['metrics']['things_total'] == 3
+    assert snapshot['metrics']['wait_seconds']['buckets'] == {'0.1': 1, '1': 1, '+Inf': 1}
+
+
+def test_disabled_registry_records_nothing():
+    registry = metrics.Registry()
+    counter = registry.counter('things_total', 'Things.')
+    histogram = registry.histogram('wait_seconds', 'Waits.')
+    counter.inc()
+    with histogram.time():
+        pass
+    assert counter.value == 0 and histogram.count == 0
+
+
+def test_checker_metrics_and_profile(tmp_path, enabled):
+    create_basic_structure(tmp_path)
+    tmp_path.joinpath('src', 'project3').mkdir()
+    profile = tmp_path.joinpath('check.prof')
+    checker.StructureChecker(tmp_path.joinpath('src'), tmp_path.joinpath('dest'), profile=profile)
+
+    assert checker.FOLDERS_WALKED.value == 5
+    assert checker.DEST_LOOKUPS.value == checker.DEST_STATS.value == 5
+    assert checker.CHECK_SECONDS.count == 1
+    assert checker.PROBLEMATIC.value == 1
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+    checker.StructureChecker(tmp_path.joinpath('src'), tmp_path.joinpath('dest'), index_dest=True)
+    assert checker.DEST_STATS.value == 5
+    assert checker.DEST_LISTINGS.value > 0
+
+
+def test_log_reader_metrics(tmp_path, enabled):
+    log_file = tmp_path.joinpath('test.log')
+    log_file.touch()
+    handler = log_reader.LogReaderEventHandler(make_config(log_file), FakeCommunicator())
+    with open(log_file, 'a') as f:
+        f.write(log_line('ERROR', 'first'))
+        f.write(log_line('DEBUG', 'not configured'))
+        f.write('not a log line\n')
+    modified(handler, log_file)
+
+    assert log_reader.LINES_READ.value == 3
+    assert log_reader.LINES_UNPARSED.value == 1
+    assert log_reader.MESSAGES_SUBMITTED.value == 1
+    assert log_reader.EVENT_SECONDS.count == 1
@@ -0,0 +1,115 @@
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import checker
+import packer
+
+from test_checker import create_basic_structure
+
+
+def fill_simulation(folder):
+    folder.joinpath('empty').mkdir(parents=True)
+    folder.joinpath('runs', 'a').mkdir(parents=True)
+    folder.joinpath('big.dat').write_bytes(os.urandom(300 * 1024 + 5))
+    for i in range(200):
+        folder.joinpath('runs', 'a' if i % 2 else '', f'out{i}.txt').write_text(f'result {i}\n' * i)
+    folder.joinpath('runs', 'zero.txt').touch()
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'xz'])
+def test_pack_and_read_single_files(tmp_path, codec):
+    folder = tmp_path.joinpath('simulation')
+    fill_simulation(folder)
+    archive_path = tmp_path.joinpath('simulation' + packer.CODECS[codec][0])
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        index = packer.pack_folder(folder, archive_path, pool, codec, chunk_size=64 * 1024)
+    assert len(index.files) == 202
+    assert len(index.chunks) > 5
+    assert index.compressed_size == archive_path.stat().st_size
+    assert not list(tmp_path.glob('*.part'))
+
+    # The archive is a regular tar archive.
+    with tarfile.open(archive_path) as tar:
+        names = tar.getnames()
+        assert 'simulation/empty' in names
+        assert tar.extractfile('simulation/runs/a/out7.txt').read() == b'result 7\n' * 7
+
+    loaded = packer.ArchiveIndex.load(packer.index_path(archive_path))
+    assert loaded.chunks == index.chunks and loaded.files == index.files
+    for name in index.files:
+        expected = tmp_path.joinpath(name).read_bytes()
+        assert packer.read_file(archive_path, name, loaded) == expected
+
+    packer.extract_file(archive_path, 'simulation/big.dat', tmp_path.joinpath('big.dat'))
+    assert tmp_path.joinpath('big.dat').read_bytes() == folder.joinpath('big.dat').read_bytes()
+    assert tmp_path.joinpath('big.dat').stat().st_mtime_ns == folder.joinpath('big.dat').stat().st_mtime_ns
+
+    with pytest.raises(KeyError):
+        packer.read_file(archive_path, 'simulation/missing.txt')
+
+
+def test_pack_data_folders(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_simulation(src_path.joinpath('project2', 'new', 'simulation'))
+    dest_path.joinpath('project2', 'new').mkdir()
+
+    file_checker = checker.StructureChecker(src_path, dest_path)
+    stats = packer.DataFolderPacker(file_checker, chunk_size=32 * 1024).pack()
+    assert stats.files == 202 and stats.errors == 0
+    archive_path = dest_path.joinpath('project2', 'new', 'simulation.tar.gz')
+    assert packer.read_file(archive_path, 'simulation/runs/out4.txt') == b'result 4\n' * 4
+    # Packing does not create the data folders themselves.
+    assert not dest_path.joinpath('project2', 'new', 'simulation').exists()
+
+    stats = packer.DataFolderPacker(file_checker).pack(file_checker.iter_findings())
+    assert stats.files == 0 and stats.skipped == len(file_checker.data_folders)
+
+    src_path.joinpath('project2', 'new', 'simulation', 'runs', 'new.txt').write_text('new')
+    stats = packer.DataFolderPacker(file_checker).pack()
+    assert stats.files == 203
+    assert packer.read_file(archive_path, 'simulation/runs/new.txt') == b'new'
+
+
+def test_unreadable_folders_are_left_out(tmp_path, monkeypatch):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_simulation(src_path.joinpath('project2', 'new', 'simulation'))
+    dest_path.joinpath('project2', 'new').mkdir()
+    unreadable = src_path.joinpath('project2', 'new', 'simulation', 'runs', 'a')
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if str(path) == str(unreadable):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    stats = packer.DataFolderPacker(checker.StructureChecker(src_path, dest_path)).pack()
+    assert stats.errors == 1
+    assert stats.files == 102
+    archive_path = dest_path.joinpath('project2', 'new', 'simulation.tar.gz')
+    assert packer.read_file(archive_path, 'simulation/runs/out4.txt') == b'result 4\n' * 4
+
+
+def test_symlinks_are_packed_like_the_copier(tmp_path):
+    folder = tmp_path.joinpath('simulation')
+    folder.mkdir()
+    outside = tmp_path.joinpath('outside')
+    outside.mkdir()
+    outside.joinpath('data.txt').write_text('linked')
+    folder.joinpath('data.txt').symlink_to(outside.joinpath('data.txt'))
+    folder.joinpath('folder').symlink_to(outside)
+    folder.joinpath('dangling').symlink_to(tmp_path.joinpath('missing'))
+    archive_path = tmp_path.joinpath('simulation.tar.gz')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        index = packer.pack_folder(folder, archive_path, pool)
+    assert sorted(index.files) == ['simulation/data.txt']
+    assert packer.read_file(archive_path, 'simulation/data.txt') == b'linked'
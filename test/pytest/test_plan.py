@@ -0,0 +1,128 @@
+import os
+import json
+
+import pytest
+
+import checker
+import plan
+
+from manifest import Manifest
+from test_checker import create_basic_structure
+from test_copier import fill_measurement
+
+
+def make_tree(tmp_path):
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+    src_path.joinpath('project2', 'new', 'simulation', 'deep').mkdir(parents=True)
+    dest_path.joinpath('project2', 'new').mkdir()
+    for i in range(5):
+        src_path.joinpath('project2', 'new', 'simulation', 'deep', f'out{i}.dat').write_bytes(bytes(100 * i))
+    return src_path, dest_path
+
+
+def test_plan_roundtrip_and_summary(tmp_path):
+    src_path, dest_path = make_tree(tmp_path)
+    backup_plan = plan.build_plan(checker.StructureChecker(src_path, dest_path))
+
+    assert backup_plan.folders == ['project1/measurement/run1', 'project1/measurement/run1/raw',
+                                   'project2/new/simulation', 'project2/new/simulation/deep']
+    assert len(backup_plan.files) == 8
+    assert backup_plan.total_bytes == 3 * 1024 * 1024 + 17 + len('notes') + 100 * (1 + 2 + 3 + 4)
+    assert '4 folders to create, 8 files to copy' in backup_plan.summary()
+    # Nothing gets created by planning.
+    assert not dest_path.joinpath('project2', 'new', 'simulation').exists()
+
+    streamed = plan.build_plan(checker.StructureChecker(src_path, dest_path, scan=False),
+                               checker.StructureChecker(src_path, dest_path, scan=False).iter_findings())
+    assert streamed.folders == backup_plan.folders and streamed.files == backup_plan.files
+
+    plan_path = tmp_path.joinpath('plan.jsonl')
+    backup_plan.save(plan_path)
+    loaded = plan.BackupPlan.load(plan_path)
+    assert (loaded.plan_id, loaded.src, loaded.dest) == (backup_plan.plan_id, src_path, dest_path)
+    assert loaded.folders == backup_plan.folders and loaded.files == backup_plan.files
+
+    plan_path.write_text('\n'.join(plan_path.read_text().splitlines()[:-2]) + '\n')
+    with pytest.raises(ValueError):
+        plan.BackupPlan.load(plan_path)
+
+
+def test_execution_resumes_from_the_journal(tmp_path):
+    src_path, dest_path = make_tree(tmp_path)
+    backup_plan = plan.build_plan(checker.StructureChecker(src_path, dest_path))
+    journal_path = tmp_path.joinpath('journal.jsonl')
+
+    stats = plan.PlanExecutor(backup_plan, journal_path, workers=2).execute()
+    assert stats.files == 8 and stats.errors == 0
+    for file in backup_plan.files:
+        assert dest_path.joinpath(file.path).read_bytes() == src_path.joinpath(file.path).read_bytes()
+
+    # Emulate a run killed after 3 files, in the middle of writing the journal line of the fourth.
+    lines = journal_path.read_text().splitlines()
+    done = lines[:1 + len(backup_plan.folders) + 3]
+    journal_path.write_text('\n'.join(done) + '\n' + lines[len(done)][:5])
+    done_files = {json.loads(line)['f'] for line in done if '"f"' in line}
+    for file in backup_plan.files:
+        if file.path not in done_files:
+            dest_path.joinpath(file.path).unlink()
+
+    executor = plan.PlanExecutor(backup_plan, journal_path, workers=2)
+    assert len(executor.remaining().files) == 5
+    assert executor.remaining().folders == []
+    stats = executor.execute()
+    assert stats.files == 5 and stats.skipped == 3
+    for file in backup_plan.files:
+        assert dest_path.joinpath(file.path).read_bytes() == src_path.joinpath(file.path).read_bytes()
+    assert executor.remaining().files == []
+
+    other = plan.BackupPlan(src_path, dest_path)
+    with pytest.raises(ValueError):
+        plan.PlanExecutor(other, journal_path).execute()
+
+
+def test_planning_does_not_write_to_the_manifest(tmp_path):
+    src_path, dest_path = make_tree(tmp_path)
+    plan.PlanExecutor(plan.build_plan(checker.StructureChecker(src_path, dest_path)),
+                      tmp_path.joinpath('journal.jsonl')).execute()
+
+    # Everything is in dest but nothing in the manifest, as if it was backed up before the manifest existed.
+    with Manifest.for_dest(tmp_path) as manifest:
+        backup_plan = plan.build_plan(checker.StructureChecker(src_path, dest_path), manifest=manifest)
+        assert backup_plan.folders == [] and backup_plan.files == []
+        assert len(manifest) == 0
+
+
+def test_unreadable_folders_are_skipped(tmp_path, monkeypatch):
+    src_path, dest_path = make_tree(tmp_path)
+    unreadable = str(src_path.joinpath('project1', 'measurement', 'run1'))
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if str(path) == unreadable:
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    backup_plan = plan.build_plan(checker.StructureChecker(src_path, dest_path))
+    assert backup_plan.folders == ['project2/new/simulation', 'project2/new/simulation/deep']
+    assert len(backup_plan.files) == 6
+
+
+def test_unexpected_errors_are_counted(tmp_path, monkeypatch):
+    src_path, dest_path = make_tree(tmp_path)
+    backup_plan = plan.build_plan(checker.StructureChecker(src_path, dest_path))
+    copy_file = plan.copy_file
+
+    def failing_copy(src, *args):
+        if src.name == 'out3.dat':
+            raise ValueError('unexpected')
+        return copy_file(src, *args)
+
+    monkeypatch.setattr(plan, 'copy_file', failing_copy)
+    executor = plan.PlanExecutor(backup_plan, tmp_path.joinpath('journal.jsonl'), workers=2)
+    stats = executor.execute()
+    assert stats.errors == 1 and stats.files == 7
+    assert [file.path for file in executor.remaining().files] == ['project2/new/simulation/deep/out3.dat']
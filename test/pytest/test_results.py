@@ -0,0 +1,38 @@
+import checker
+from results import CompactFindings, PathTrie
+
+from test_checker import create_basic_structure
+
+
+def test_path_trie():
+    trie = PathTrie()
+    node = trie.intern(('project1', 'a', 'b'))
+    assert trie.intern(('project1', 'a', 'b')) == node
+    assert trie.intern(('project1', 'a')) != node
+    assert trie.parts(node) == ('project1', 'a', 'b')
+    assert trie.parts(0) == ()
+    assert len(trie) == 4
+
+    trie.freeze()
+    assert trie.parts(node) == ('project1', 'a', 'b')
+
+
+def test_compact_findings_match_checker(tmp_path):
+    create_basic_structure(tmp_path)
+
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    src_path.joinpath('project1', 'extra_folder').mkdir()
+    src_path.joinpath('project1', 'measurement', 'extra folder', 'deeper').mkdir(parents=True)
+    src_path.joinpath('project3', 'simulation').mkdir(parents=True)
+
+    file_checker = checker.StructureChecker(src_path, dest_path, scan=False)
+    expected = list(file_checker.iter_findings())
+    store = CompactFindings.from_findings(src_path, dest_path, file_checker.iter_findings())
+
+    assert len(store) == len(expected)
+    assert list(store) == expected
+    assert store[-1] == expected[-1]
+    assert store.count(checker.FindingKind.SKIPPED) == 2
+    assert {finding.src for finding in store.of_kind(checker.FindingKind.PROBLEMATIC)} == \
+        {src_path.joinpath('project1', 'extra_folder'), src_path.joinpath('project3')}
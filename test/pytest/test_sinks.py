@@ -0,0 +1,76 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import sinks
+import log_reader
+
+from test_log_reader import log_line, write_config
+
+
+def test_jsonl_file_sink(tmp_path):
+    path = tmp_path.joinpath('messages.jsonl')
+    sink = sinks.JsonlFileSink(path, {'status': {'channel': 'status'}})
+    sink.send_message('first')
+    sink.send_message('second', {'channel': 'errors', 'tag': ['user1']})
+    sink.close()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r['channel'], r['tag'], r['text']) for r in records] == [('status', [], 'first'),
+                                                                      ('errors', ['user1'], 'second')]
+
+
+def test_webhook_sink():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            self.send_response(204)
+            self.end_headers()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sink = sinks.WebhookSink(f'http://127.0.0.1:{server.server_address[1]}/hook', {})
+        for i in range(3):
+            sink.send_message(f'message {i}', {'channel': 'general'})
+        sink.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [(r['channel'], r['text']) for r in received] == [('general', f'message {i}') for i in range(3)]
+
+
+def test_watcher_with_memory_sink(tmp_path):
+    log_file = tmp_path.joinpath('instrument.log')
+    log_file.touch()
+    conf_path = tmp_path.joinpath('config.py')
+    write_config(conf_path, {
+        'files': {str(log_file): {'channel': 'general'}},
+        'sink': {'type': 'memory'},
+        'status': {'channel': 'status'},
+        'ERROR': {'channel': 'errors'},
+    })
+
+    watcher = log_reader.LogWatcher(conf_path)
+    assert isinstance(watcher.communicator, sinks.MemorySink)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        with open(log_file, 'a') as f:
+            f.write(log_line('ERROR', 'pump stopped'))
+        assert watcher.communicator.wait_for(1, timeout=5)
+    finally:
+        watcher.stop()
+        thread.join(5)
+
+    _, message, message_config = watcher.communicator.messages[0]
+    assert 'pump stopped' in message
+    assert message_config['channel'] == 'errors'
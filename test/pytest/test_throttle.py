@@ -0,0 +1,126 @@
+import time
+import datetime
+
+import pytest
+
+import checker
+import copier
+import metrics
+import throttle
+
+from test_checker import create_basic_structure
+from test_copier import fill_measurement
+from test_metrics import enabled  # noqa: F401
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = throttle.TokenBucket(100, 100, clock, clock.sleep)
+    assert bucket.acquire(100) == 0
+    # Amounts larger than the burst leave the bucket in debt.
+    assert bucket.acquire(250) == 2.5
+    clock.now += 10
+    assert bucket.acquire(50) == 0
+    assert bucket.tokens == 50
+
+    bucket.set_rate(None, 0)
+    assert bucket.acquire(10 ** 9) == 0
+
+
+def test_profiles():
+    profiles = throttle.parse_profiles([{'start': '20:00', 'end': '07:00'},
+                                        {'start': '07:00', 'end': '20:00', 'mb_per_second': 10, 'iops': 50}])
+    assert profiles[0].contains(datetime.time(23, 30)) and profiles[0].contains(datetime.time(3))
+    assert not profiles[0].contains(datetime.time(12))
+
+    clock = FakeClock()
+    moment = [datetime.datetime(2024, 1, 1, 12)]
+    limiter = throttle.Throttle(bytes_per_second=1e9, profiles=profiles, clock=clock, sleep=clock.sleep,
+                                now=lambda: moment[0])
+    limiter.acquire(0)
+    assert limiter.limits.bytes_per_second == 10e6 and limiter.limits.iops == 50
+    limiter.acquire(20 * 10 ** 6)
+    assert 1.9 < clock.slept < 2.1
+
+    moment[0] = datetime.datetime(2024, 1, 1, 21)
+    clock.now += 1
+    limiter.acquire(0)
+    assert limiter.limits.bytes_per_second is None and limiter.limits.iops is None
+    slept = clock.slept
+    limiter.acquire(10 ** 10, 10 ** 6)
+    assert clock.slept == slept
+
+
+def test_adaptive_backoff(enabled):  # noqa: F811
+    clock = FakeClock()
+    limiter = throttle.Throttle(bytes_per_second=100e6, adaptive=True, adjust_interval=1, clock=clock,
+                                sleep=clock.sleep)
+    for _ in range(20):
+        limiter.observe(0.01, throttle.CHUNK_SIZE)
+        clock.now += 0.1
+    assert limiter.factor == 1.0
+
+    for _ in range(20):
+        limiter.observe(0.1, throttle.CHUNK_SIZE)
+        clock.now += 0.1
+    assert limiter.factor == 0.25
+    assert throttle.LIMIT_BYTES.value == 25e6
+
+    for _ in range(200):
+        limiter.observe(0.01, throttle.CHUNK_SIZE)
+        clock.now += 0.1
+    assert limiter.factor == 1.0
+    assert throttle.BACKOFF_FACTOR.value == 1.0
+    assert enabled.snapshot()['metrics']['throttle_chunk_latency_seconds']['count'] == 240
+
+
+def test_adaptive_mode_compares_latency_per_byte():
+    clock = FakeClock()
+    limiter = throttle.Throttle(bytes_per_second=100e6, adaptive=True, adjust_interval=1, clock=clock,
+                                sleep=clock.sleep)
+    # Constant throughput of 100 MB/s, with small files, short last chunks and full chunks mixed.
+    for size in ([100] * 3 + [throttle.CHUNK_SIZE // 2, throttle.CHUNK_SIZE] * 2) * 50:
+        limiter.observe(size / 100e6, size)
+        clock.now += 0.1
+    assert limiter.factor == 1.0
+
+    with pytest.raises(ValueError):
+        throttle.Throttle(adaptive=True)
+    throttle.Throttle(adaptive=True, profiles=throttle.parse_profiles([{'start': '08:00', 'end': '20:00', 'iops': 50}]))
+
+
+def test_throttled_copy(tmp_path, enabled):  # noqa: F811
+    create_basic_structure(tmp_path)
+    src_path = tmp_path.joinpath('src')
+    dest_path = tmp_path.joinpath('dest')
+    fill_measurement(src_path)
+
+    limiter = throttle.Throttle(bytes_per_second=20e6, burst_seconds=0.05, chunk_size=256 * 1024)
+    start = time.perf_counter()
+    stats = copier.DataFolderCopier(checker.StructureChecker(src_path, dest_path), workers=2,
+                                    throttle=limiter).copy()
+    elapsed = time.perf_counter() - start
+    assert stats.files == 3 and stats.errors == 0
+    size = 3 * 1024 * 1024 + 17 + len('notes')
+    assert elapsed > (size - 1e6) / 20e6
+    for file in ['project1/measurement/data.dat', 'project1/measurement/run1/notes.txt']:
+        assert dest_path.joinpath(file).read_bytes() == src_path.joinpath(file).read_bytes()
+
+    assert throttle.BYTES.value == size
+    # One operation per file and one per chunk of the large file and of the non-empty small one.
+    assert throttle.OPERATIONS.value == 3 + 13 + 1
+    assert throttle.WAIT_SECONDS.value > 0
+    assert metrics.REGISTRY.snapshot()['metrics']['throttle_limit_bytes_per_second'] == 20e6
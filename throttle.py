@@ -0,0 +1,292 @@
+"""
+I/O throttling for the copies of the backup tool, so that a bulk copy of the data folders does not push up the write
+latency of the measurements being acquired on the same storage.
+
+A Throttle limits the bytes and the operations per second of every copy going through it with two token buckets. The
+limits can change with the time of day (ThrottleProfile), e.g. to copy slowly during the day and at full speed at
+night. In adaptive mode the throttle also watches how long the chunks take to be written, per byte, and backs off,
+halving the limits, when that latency rises, then slowly goes back to the configured limits once it recovers.
+
+Pass a Throttle to DataFolderCopier or PlanExecutor::
+
+    throttle = Throttle(bytes_per_second=50e6, iops=500, adaptive=True,
+                        profiles=parse_profiles([{'start': '20:00', 'end': '07:00', 'mb_per_second': None}]))
+    DataFolderCopier(checker, throttle=throttle).copy()
+
+Throttled files are copied in chunks of chunk_size bytes. Each file costs one operation for opening, creating and
+renaming it, and every chunk one more.
+"""
+
+import time
+import datetime
+import threading
+from typing import Optional, Iterable, List, NamedTuple, Callable
+
+import metrics
+from log import *
+
+logger = log_logger('filechecker.throttle')
+
+CHUNK_SIZE = 1024 * 1024
+
+BYTES = metrics.counter('throttle_bytes_total', 'Bytes that went through the throttle.')
+OPERATIONS = metrics.counter('throttle_operations_total', 'Operations that went through the throttle.')
+WAIT_SECONDS = metrics.counter('throttle_wait_seconds_total', 'Time spent waiting for the throttle.')
+LIMIT_BYTES = metrics.gauge('throttle_limit_bytes_per_second', 'Bytes per second allowed right now, 0 if unlimited.')
+LIMIT_IOPS = metrics.gauge('throttle_limit_iops', 'Operations per second allowed right now, 0 if unlimited.')
+THROUGHPUT_BYTES = metrics.gauge('throttle_throughput_bytes_per_second', 'Bytes per second achieved.')
+THROUGHPUT_IOPS = metrics.gauge('throttle_throughput_iops', 'Operations per second achieved.')
+BACKOFF_FACTOR = metrics.gauge('throttle_backoff_factor', 'Fraction of the limits applied by the adaptive mode.')
+CHUNK_LATENCY = metrics.histogram('throttle_chunk_latency_seconds', 'Time taken to copy a chunk.')
+
+
+class TokenBucket:
+    """
+    Token bucket allowing rate tokens per second with bursts of up to burst tokens. Safe to use from several threads.
+
+    Taking more tokens than there are leaves the bucket in debt and makes the caller wait until the debt is paid, so
+    amounts larger than the burst are allowed and callers queue fairly.
+
+    :param rate: Tokens added per second. None or 0 for no limit.
+    :param burst: The maximum number of tokens in the bucket.
+    :param clock: Monotonic clock, in seconds.
+    :param sleep: Function used to wait.
+    """
+    def __init__(self, rate: Optional[float], burst: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate: Optional[float], burst: float) -> None:
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = rate
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+
+    def acquire(self, amount: float) -> float:
+        """
+        Takes amount tokens, waiting until they are available.
+
+        :return: The time waited, in seconds.
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill(self._clock())
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class ThrottleProfile(NamedTuple):
+    """
+    Limits applied between two times of the day. If end is before start the profile goes past midnight. None means
+    no limit.
+    """
+    start: datetime.time
+    end: datetime.time
+    bytes_per_second: Optional[float] = None
+    iops: Optional[float] = None
+
+    def contains(self, moment: datetime.time) -> bool:
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+
+def parse_profiles(entries: Iterable[dict]) -> List[ThrottleProfile]:
+    """
+    Creates profiles from config entries like {'start': '08:00', 'end': '20:00', 'mb_per_second': 50, 'iops': 200}.
+    Missing limits mean no limit.
+    """
+    profiles = []
+    for entry in entries:
+        mb_per_second = entry.get('mb_per_second')
+        profiles.append(ThrottleProfile(datetime.time.fromisoformat(entry['start']),
+                                        datetime.time.fromisoformat(entry['end']),
+                                        mb_per_second * 1e6 if mb_per_second is not None else None,
+                                        entry.get('iops')))
+    return profiles
+
+
+class Throttle:
+    """
+    Limits the bandwidth and the operations per second of the copies going through it.
+
+    :param bytes_per_second: The bandwidth limit outside of the profiles. None for no limit.
+    :param iops: The limit of operations per second outside of the profiles. None for no limit.
+    :param profiles: Time of day profiles. The first one containing the current time replaces the limits above.
+    :param adaptive: If True, the limits get multiplied by a factor that is halved every time the latency of the chunks
+        rises and increased again by steps of a tenth while it is normal. Unlimited limits stay unlimited, so at least
+        one limit has to be set, here or in a profile.
+    :param target_latency: Latency of a chunk of chunk_size bytes, in seconds, above which the adaptive mode backs off.
+        If None, the lowest average latency seen times backoff_threshold is used.
+    :param backoff_threshold: See target_latency.
+    :param min_factor: The adaptive mode never goes below this fraction of the limits.
+    :param adjust_interval: Minimum time, in seconds, between two changes of the adaptive factor.
+    :param burst_seconds: The buckets allow bursts of this many seconds of their limit.
+    :param chunk_size: Size of the chunks throttled files are copied in.
+    :param clock: Monotonic clock, in seconds.
+    :param sleep: Function used to wait.
+    :param now: Gets the current date and time, to pick the profile.
+    """
+    def __init__(self, bytes_per_second: Optional[float] = None, iops: Optional[float] = None,
+                 profiles: Iterable[ThrottleProfile] = (), adaptive: bool = False,
+                 target_latency: Optional[float] = None, backoff_threshold: float = 2.0, min_factor: float = 0.1,
+                 adjust_interval: float = 1.0, burst_seconds: float = 1.0, chunk_size: int = CHUNK_SIZE,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 now: Callable[[], datetime.datetime] = datetime.datetime.now):
+        self.bytes_per_second = bytes_per_second
+        self.iops = iops
+        self.profiles = list(profiles)
+        if adaptive and not (bytes_per_second or iops or any(p.bytes_per_second or p.iops for p in self.profiles)):
+            raise ValueError('The adaptive mode needs a bytes_per_second or iops limit to scale down.')
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.backoff_threshold = backoff_threshold
+        self.min_factor = min_factor
+        self.adjust_interval = adjust_interval
+        self.burst_seconds = burst_seconds
+        self.chunk_size = chunk_size
+        self._clock = clock
+        self._now = now
+
+        self.factor = 1.0
+        self.profile: Optional[ThrottleProfile] = None
+        self.throughput = 0.0
+        self.operations_per_second = 0.0
+
+        self._lock = threading.Lock()
+        self._bytes = TokenBucket(None, 0, clock, sleep)
+        self._operations = TokenBucket(None, 0, clock, sleep)
+        self._next_profile_check = clock()
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._samples = 0
+        self._next_adjust = clock()
+        self._window_start = clock()
+        self._window_bytes = 0
+        self._window_operations = 0
+        self._apply()
+
+    @property
+    def limits(self) -> ThrottleProfile:
+        """
+        The configured limits for the current profile, before the adaptive factor.
+        """
+        if self.profile is not None:
+            return self.profile
+        return ThrottleProfile(datetime.time(), datetime.time(), self.bytes_per_second, self.iops)
+
+    def _apply(self) -> None:
+        """
+        Sets the rates of the buckets from the current limits and factor.
+        """
+        limits = self.limits
+        bytes_per_second = limits.bytes_per_second * self.factor if limits.bytes_per_second else None
+        iops = limits.iops * self.factor if limits.iops else None
+        self._bytes.set_rate(bytes_per_second, max(bytes_per_second or 0, 1) * self.burst_seconds)
+        self._operations.set_rate(iops, max(iops or 0, 1) * self.burst_seconds)
+        LIMIT_BYTES.set(bytes_per_second or 0)
+        LIMIT_IOPS.set(iops or 0)
+        BACKOFF_FACTOR.set(self.factor)
+
+    def _check_profile(self, now: float) -> None:
+        # Profiles have a resolution of seconds at best, so the time of day is looked at once per second.
+        if now < self._next_profile_check or not self.profiles:
+            return
+        self._next_profile_check = now + 1.0
+        moment = self._now().time()
+        profile = next((p for p in self.profiles if p.contains(moment)), None)
+        if profile != self.profile:
+            self.profile = profile
+            self._apply()
+            logger.info(f'throttle limits changed to {self.limits.bytes_per_second} bytes/s and '
+                        f'{self.limits.iops} operations/s.')
+
+    def acquire(self, size: int, operations: int = 1) -> float:
+        """
+        Waits until size bytes and the given number of operations are allowed.
+
+        :return: The time waited, in seconds.
+        """
+        now = self._clock()
+        with self._lock:
+            self._check_profile(now)
+            self._window_bytes += size
+            self._window_operations += operations
+            elapsed = now - self._window_start
+            if elapsed >= 1.0:
+                self.throughput = self._window_bytes / elapsed
+                self.operations_per_second = self._window_operations / elapsed
+                THROUGHPUT_BYTES.set(self.throughput)
+                THROUGHPUT_IOPS.set(self.operations_per_second)
+                self._window_start = now
+                self._window_bytes = 0
+                self._window_operations = 0
+
+        waited = self._operations.acquire(operations)
+        if size:
+            waited += self._bytes.acquire(size)
+        BYTES.inc(size)
+        OPERATIONS.inc(operations)
+        WAIT_SECONDS.inc(waited)
+        return waited
+
+    def observe(self, seconds: float, size: int) -> None:
+        """
+        Records the time a chunk took to be copied, not counting the time waited for the throttle. In adaptive mode,
+        backs off if the average latency is too high and recovers otherwise.
+
+        The latency is scaled to the time a chunk of chunk_size bytes would take, so that small files and the last
+        chunk of a file do not look faster than full chunks. Chunks under a quarter of chunk_size are not used by the
+        adaptive mode, since the fixed cost of the calls makes most of their time.
+
+        :param seconds: The time taken.
+        :param size: The bytes copied.
+        """
+        CHUNK_LATENCY.observe(seconds)
+        if not self.adaptive or size * 4 < self.chunk_size:
+            return
+        seconds = seconds * self.chunk_size / size
+        now = self._clock()
+        with self._lock:
+            self._latency = seconds if self._latency is None else self._latency + 0.2 * (seconds - self._latency)
+            self._samples += 1
+            if self._samples >= 10 and (self._baseline is None or self._latency < self._baseline):
+                self._baseline = self._latency
+
+            if now < self._next_adjust:
+                return
+            if self.target_latency is not None:
+                limit = self.target_latency
+            elif self._baseline is not None:
+                limit = self._baseline * self.backoff_threshold
+            else:
+                return
+
+            if self._latency > limit and self.factor > self.min_factor:
+                self.factor = max(self.min_factor, self.factor / 2)
+                logger.info(f'copy latency at {self._latency * 1000:.1f} ms, throttling down to {self.factor:.0%} '
+                            f'of the limits.')
+            elif self._latency <= limit and self.factor < 1.0:
+                self.factor = min(1.0, self.factor + 0.1)
+                logger.debug(f'copy latency back to {self._latency * 1000:.1f} ms, throttle at {self.factor:.0%} '
+                             f'of the limits.')
+            else:
+                return
+            self._next_adjust = now + self.adjust_interval
+            self._apply()